@@ -2,9 +2,16 @@
 
 from .control_range import ControlRange
 from .create_library import library
+from .stacking import Stacking
+from .adaptive import AdaptiveFrames
 from .image_library import ImageLibrary
+from .pool import ReaderPool
+from .async_library import AsyncImageLibrary
+from .cache import DarkframeCache
+from .shared_cache import SharedDarkframeCache
 from .get_image import ImageNotFoundError
 from .dummy_camera import DummyCamera
 from .camera import ImageTaker
 from .fuse_libraries import fuse_libraries
-from .substract import substract
+from .substract import substract, substract_stack, substract_frames
+from .engine import TiledEngine
@@ -0,0 +1,129 @@
+"""
+Module for adapting the number of frames taken for a darkframe
+to the noise of these frames: frames are taken until the standard
+error of their mean is low enough.
+"""
+
+import math
+import typing
+import numpy as np
+from numpy import typing as npt
+from .stacking import RunningVariance
+
+
+class AdaptiveFrames:
+    """
+    Configuration of the adaptive number of frames taken for a darkframe
+    (see the 'adaptive' argument of create_library.library): frames are
+    taken until the standard error of their mean falls below target_error
+    (or until the max number of frames is reached).
+
+    The standard error is computed over a subsample of the pixels (see
+    StandardError), as the median of the per-pixel standard errors (so
+    that hot pixels and cosmic rays do not prevent convergence).
+
+    Arguments
+    ---------
+    target_error:
+      standard error (in pixel value) under which no more frames are taken.
+    min_frames:
+      number of frames taken before the standard error is first checked.
+    subsample:
+      one pixel out of 'subsample' (along each axis) is considered.
+    read_noise, dark_noise:
+      model of the noise of the frames (standard deviation of a frame of
+      null exposure, and standard deviation accumulated per second of
+      exposure), used only for estimating the number of frames which will
+      be taken (see expected_frames).
+    """
+
+    def __init__(
+        self,
+        target_error: float,
+        min_frames: int = 3,
+        subsample: int = 8,
+        read_noise: typing.Optional[float] = None,
+        dark_noise: typing.Optional[float] = None,
+    ) -> None:
+        if target_error <= 0:
+            raise ValueError(
+                f"adaptive frames: the target error must be positive (got {target_error})"
+            )
+        if min_frames < 2:
+            raise ValueError(
+                f"adaptive frames: at least 2 frames are required to estimate "
+                f"the standard error (got {min_frames})"
+            )
+        if subsample < 1:
+            raise ValueError(
+                f"adaptive frames: the subsample step must be positive (got {subsample})"
+            )
+        self.target_error = target_error
+        self.min_frames = min_frames
+        self.subsample = subsample
+        self.read_noise = read_noise
+        self.dark_noise = dark_noise
+
+    def expected_frames(self, picture_time: float, max_frames: int) -> int:
+        """
+        Returns the number of frames expected to be taken for pictures
+        of picture_time seconds, assuming the variance of the frames is
+        read_noise**2 + dark_noise**2 * picture_time. If the noise model
+        is unknown (read_noise and dark_noise are None), returns max_frames.
+        """
+        if self.read_noise is None and self.dark_noise is None:
+            return max_frames
+        variance = (self.read_noise or 0.0) ** 2
+        variance += (self.dark_noise or 0.0) ** 2 * picture_time
+        nb_frames = math.ceil(variance / self.target_error**2)
+        return min(max_frames, max(self.min_frames, nb_frames))
+
+    def tracker(self) -> "StandardError":
+        return StandardError(self.target_error, self.min_frames, self.subsample)
+
+    def __repr__(self) -> str:
+        return str(
+            f"AdaptiveFrames(target_error={self.target_error}, "
+            f"min_frames={self.min_frames}, subsample={self.subsample}, "
+            f"read_noise={self.read_noise}, dark_noise={self.dark_noise})"
+        )
+
+
+class StandardError:
+    """
+    Running standard error of the mean of frames (median of the
+    per-pixel standard errors), updated frame by frame over one pixel
+    out of 'subsample' along each axis (see AdaptiveFrames).
+    """
+
+    def __init__(self, target_error: float, min_frames: int, subsample: int) -> None:
+        self._target_error = target_error
+        self._min_frames = min_frames
+        self._subsample = subsample
+        self._variance = RunningVariance()
+
+    def count(self) -> int:
+        return self._variance.count
+
+    def add(self, frame: npt.NDArray) -> None:
+        step = self._subsample
+        self._variance.add(frame[tuple(slice(None, None, step) for _ in frame.shape)])
+
+    def value(self) -> float:
+        """
+        Returns the standard error (inf if less than two frames
+        have been added).
+        """
+        count = self._variance.count
+        if count < 2:
+            return math.inf
+        return float(np.median(np.sqrt(self._variance.variance() / count)))
+
+    def converged(self) -> bool:
+        """
+        True if at least min_frames frames have been added and the
+        standard error is below the target error.
+        """
+        if self._variance.count < self._min_frames:
+            return False
+        return self.value() <= self._target_error
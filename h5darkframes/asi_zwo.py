@@ -101,6 +101,11 @@ class AsiZwoCamera(Camera):
         r: typing.Dict[str, typing.Any] = {}
         r["darkframes"] = {}
         r["darkframes"]["average_over"] = 5
+        r["darkframes"]["stacking"] = {
+            "mode": "mean",
+            "memory_budget": 256,
+            "variance": False,
+        }
         control_ranges = OrderedDict()
         control_ranges["TargetTemp"] = ControlRange(-15, 15, 3, 1, 600)
         control_ranges["Exposure"] = ControlRange(1000000, 30000000, 4000000, 1, 0.1)
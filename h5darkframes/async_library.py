@@ -0,0 +1,174 @@
+"""
+Module providing an asyncio API for reading darkframes libraries.
+"""
+
+import typing
+import asyncio
+import functools
+import numpy as np
+from numpy import typing as npt
+from concurrent.futures import Executor, ThreadPoolExecutor
+from .h5types import Param, Params
+from .image_library import ImageLibrary
+from .substract import substract
+
+T = typing.TypeVar("T")
+
+
+class _InFlight:
+    """
+    Computation running in the executor, and the number of
+    coroutines awaiting its result.
+    """
+
+    def __init__(self, future: "asyncio.Future[typing.Any]") -> None:
+        self.future = future
+        self.waiters = 0
+
+
+class AsyncImageLibrary:
+    """
+    Wrapper over an ImageLibrary for asyncio applications: darkframes
+    are read, generated and substracted in an executor, so that the
+    event loop is not blocked.
+
+    Concurrent requests for the same darkframe share the same
+    computation (the returned arrays are then the same object:
+    they should not be modified in place). Cancelled requests
+    do not cancel the computation if other requests await it;
+    otherwise the computation is cancelled if it did not start yet
+    (a running read or interpolation can not be interrupted, its
+    result is dropped).
+
+    Arguments
+    ---------
+    library:
+      the darkframes library.
+    executor:
+      the executor running the reads and computations. If None,
+      a pool of 'workers' threads is created (and closed by the
+      close method).
+    workers:
+      number of threads of the pool (if executor is None).
+    """
+
+    def __init__(
+        self,
+        library: ImageLibrary,
+        executor: typing.Optional[Executor] = None,
+        workers: typing.Optional[int] = None,
+    ) -> None:
+        self._library = library
+        self._own_executor = executor is None
+        self._executor: Executor = (
+            ThreadPoolExecutor(max_workers=workers) if executor is None else executor
+        )
+        self._in_flight: typing.Dict[typing.Hashable, _InFlight] = {}
+
+    def library(self) -> ImageLibrary:
+        return self._library
+
+    def _forget(self, key: typing.Hashable, in_flight: _InFlight) -> None:
+        if self._in_flight.get(key) is in_flight:
+            del self._in_flight[key]
+
+    def _done(
+        self, key: typing.Hashable, in_flight: _InFlight, _: "asyncio.Future"
+    ) -> None:
+        self._forget(key, in_flight)
+
+    async def _run(self, key: typing.Hashable, f: typing.Callable[..., T], *args) -> T:
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, functools.partial(f, *args))
+            in_flight = _InFlight(future)
+            self._in_flight[key] = in_flight
+            future.add_done_callback(functools.partial(self._done, key, in_flight))
+        in_flight.waiters += 1
+        try:
+            # shield: cancelling this request does not
+            # cancel the computation for the other ones
+            return await asyncio.shield(in_flight.future)
+        except asyncio.CancelledError:
+            if in_flight.waiters == 1 and not in_flight.future.done():
+                in_flight.future.cancel()
+                self._forget(key, in_flight)
+            raise
+        finally:
+            in_flight.waiters -= 1
+
+    async def get(
+        self, controls: typing.Union[Param, typing.Dict[str, int]]
+    ) -> typing.Tuple[npt.ArrayLike, typing.Dict]:
+        """
+        See ImageLibrary.get (the darkframe is returned as a numpy array).
+        """
+        param = self._library._param(controls)
+        return await self._run(("get", param), self._library.get, param)
+
+    async def get_interpolation_neighbors(
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        fixed_index: int = 1,
+        free_index: typing.Optional[int] = None,
+    ) -> Params:
+        """
+        See ImageLibrary.get_interpolation_neighbors.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            self._library.get_interpolation_neighbors,
+            controls,
+            fixed_index,
+            free_index,
+        )
+
+    async def generate_darkframe(
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        neighbors: Params,
+        dtype: typing.Optional[npt.DTypeLike] = None,
+    ) -> npt.ArrayLike:
+        """
+        See ImageLibrary.generate_darkframe.
+        """
+        param = self._library._param(controls)
+        key = (
+            "generate",
+            param,
+            tuple(sorted(tuple(n) for n in neighbors)),
+            None if dtype is None else np.dtype(dtype).str,
+        )
+        return await self._run(
+            key, self._library.generate_darkframe, param, neighbors, dtype
+        )
+
+    async def substract(
+        self,
+        img: npt.NDArray,
+        darkframe: npt.NDArray,
+        out: typing.Optional[npt.NDArray] = None,
+    ) -> npt.NDArray:
+        """
+        See substract.substract.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, substract, img, darkframe, out
+        )
+
+    def close(self) -> None:
+        """
+        Shuts down the executor (if created by this instance).
+        The library is not closed.
+        """
+        if self._own_executor:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _, __, ___):
+        self.close()
@@ -0,0 +1,151 @@
+"""
+Module for keeping decoded darkframes in memory.
+"""
+
+import typing
+import threading
+from collections import OrderedDict
+from numpy import typing as npt
+
+
+class CacheStats:
+    """
+    Counters of a cache: number of hits, misses and evictions,
+    number of cached items and number of bytes they use.
+    """
+
+    def __init__(
+        self, hits: int, misses: int, evictions: int, items: int, nbytes: int
+    ) -> None:
+        self.hits = hits
+        self.misses = misses
+        self.evictions = evictions
+        self.items = items
+        self.nbytes = nbytes
+
+    def __str__(self) -> str:
+        return str(
+            f"hits: {self.hits} misses: {self.misses} evictions: {self.evictions} "
+            f"items: {self.items} bytes: {self.nbytes}"
+        )
+
+
+class DarkframeCache:
+    """
+    Least recently used cache of numpy arrays, bounded by the total
+    number of bytes of the cached arrays (and not by the number of
+    arrays). Cached arrays are made read-only, so that users of the
+    cache can not corrupt the cached data.
+
+    Arguments
+    ---------
+    max_bytes:
+      memory budget of the cache. When adding an array would exceed it,
+      the least recently used arrays are evicted. Arrays larger than
+      the budget are not cached.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        if max_bytes < 0:
+            raise ValueError(
+                f"darkframe cache: the memory budget ({max_bytes}) can not be negative"
+            )
+        self._max_bytes = max_bytes
+        self._arrays: typing.OrderedDict[typing.Hashable, npt.NDArray] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    def nbytes(self) -> int:
+        """
+        Number of bytes used by the cached arrays.
+        """
+        return self._nbytes
+
+    def get(self, key: typing.Hashable) -> typing.Optional[npt.NDArray]:
+        """
+        Returns the (read-only) array cached for key, or None.
+        """
+        with self._lock:
+            try:
+                array = self._arrays[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._arrays.move_to_end(key)
+            self.hits += 1
+            return array
+
+    def put(self, key: typing.Hashable, array: npt.NDArray) -> npt.NDArray:
+        """
+        Adds the array to the cache (evicting least recently
+        used arrays if required) and returns it. The array
+        is made read-only, unless it is too large to be cached.
+        """
+        if array.nbytes > self._max_bytes:
+            return array
+        array.setflags(write=False)
+        with self._lock:
+            self._discard(key)
+            while self._arrays and self._nbytes + array.nbytes > self._max_bytes:
+                _, evicted = self._arrays.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+                self.evictions += 1
+            self._arrays[key] = array
+            self._nbytes += array.nbytes
+        return array
+
+    def _discard(self, key: typing.Hashable) -> None:
+        try:
+            array = self._arrays.pop(key)
+        except KeyError:
+            return
+        self._nbytes -= array.nbytes
+
+    def discard(self, key: typing.Hashable) -> None:
+        """
+        Removes the array cached for key, if any.
+        """
+        with self._lock:
+            self._discard(key)
+
+    def discard_if(self, predicate: typing.Callable[[typing.Any], bool]) -> None:
+        """
+        Removes all the arrays which key satisfies the predicate.
+        """
+        with self._lock:
+            for key in [key for key in self._arrays.keys() if predicate(key)]:
+                self._discard(key)
+
+    def clear(self) -> None:
+        """
+        Removes all cached arrays (the counters are not reset).
+        """
+        with self._lock:
+            self._arrays.clear()
+            self._nbytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self.hits, self.misses, self.evictions, len(self._arrays), self._nbytes
+            )
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        # the cached arrays are not sent to other processes:
+        # unpickling results in an empty cache of same budget
+        return {"max_bytes": self._max_bytes}
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+        self.__init__(state["max_bytes"])  # type: ignore
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._arrays
+
+    def __len__(self) -> int:
+        return len(self._arrays)
@@ -0,0 +1,276 @@
+"""
+Module for substracting darkframes from sets of light frames
+stored in files.
+"""
+
+import re
+import time
+import queue
+import typing
+import logging
+import threading
+import toml
+import numpy as np
+from numpy import typing as npt
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from .h5types import Controllables, Param
+from .image_library import ImageLibrary
+from .substract import substract
+
+_logger = logging.getLogger("calibration")
+
+FRAME_FORMATS = (".npy", ".tiff", ".tif")
+"""
+Supported file formats for light frames
+"""
+
+
+def default_pattern(controllables: Controllables) -> str:
+    """
+    Pattern for reading the controllable values from the name of a frame
+    file, e.g. for the controllables ("TargetTemp", "Exposure"), matches
+    'TargetTemp_-10_Exposure_2000_3.npy' (as for pictures dumped
+    during the creation of a library).
+    """
+    return "_".join(
+        [f"{controllable}_(?P<{controllable}>-?\\d+)" for controllable in controllables]
+    )
+
+
+def frame_param(
+    path: Path, controllables: Controllables, pattern: typing.Optional[str] = None
+) -> Param:
+    """
+    Returns the values of the controllables for the frame (e.g. temperature
+    and exposure), read from the sidecar file if any (a toml file with
+    the same name as the frame, e.g. 'frame.npy.toml' or 'frame.toml',
+    with the controllables as keys), from the name of the file
+    otherwise, using the pattern (a regular expression with the
+    controllables as named groups, see default_pattern).
+    Raises a ValueError if the values can not be found.
+    """
+    for sidecar in (path.with_name(path.name + ".toml"), path.with_suffix(".toml")):
+        if sidecar.is_file():
+            content = toml.load(str(sidecar))
+            try:
+                return tuple([int(content[c]) for c in controllables])
+            except KeyError as e:
+                raise ValueError(
+                    f"failed to read the value of {e} from the sidecar file {sidecar}"
+                )
+    if pattern is None:
+        pattern = default_pattern(controllables)
+    match = re.search(pattern, path.name)
+    if match is None:
+        raise ValueError(
+            f"failed to read the values of {', '.join(controllables)} from "
+            f"the file name {path.name} (pattern: {pattern})"
+        )
+    try:
+        return tuple([int(match.group(c)) for c in controllables])
+    except IndexError as e:
+        raise ValueError(f"the pattern {pattern} has no group for {e}")
+
+
+def read_frame(path: Path) -> npt.NDArray:
+    """
+    Reads a light frame from a npy or tiff file.
+    """
+    if path.suffix == ".npy":
+        return np.load(path)
+    import cv2
+
+    image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"failed to read the image file {path}")
+    return image
+
+
+def write_frame(path: Path, image: npt.NDArray) -> None:
+    """
+    Writes a frame into a npy or (uncompressed) tiff file,
+    depending on the suffix of path.
+    """
+    if path.suffix == ".npy":
+        np.save(path, image)
+        return
+    import cv2
+
+    cv2.imwrite(str(path), image, [cv2.IMWRITE_TIFF_COMPRESSION, 1])
+
+
+def get_darkframe(library: ImageLibrary, param: Param) -> npt.NDArray:
+    """
+    Returns the darkframe of the library for param if any, or
+    a darkframe generated from its interpolation neighbors, or the
+    darkframe of the closest param if there are no such neighbors.
+    """
+    try:
+        neighbors = library.get_interpolation_neighbors(param)
+    except ValueError:
+        neighbors = [library.get_closest(param)]
+    if len(neighbors) == 1:
+        darkframe, _ = library.get(neighbors[0])
+        return darkframe  # type: ignore
+    return library.generate_darkframe(param, neighbors)  # type: ignore
+
+
+class CalibrationReport:
+    """
+    Summary of a calibration run.
+    """
+
+    def __init__(self, nb_frames: int, nb_failures: int, duration: float) -> None:
+        self.nb_frames = nb_frames
+        self.nb_failures = nb_failures
+        self.duration = duration
+
+    def frames_per_second(self) -> float:
+        if self.duration <= 0:
+            return 0.0
+        return self.nb_frames / self.duration
+
+    def __str__(self) -> str:
+        return str(
+            f"calibrated {self.nb_frames} frame(s) in {self.duration:.2f} seconds "
+            f"({self.frames_per_second():.2f} frames per second), "
+            f"{self.nb_failures} failure(s)"
+        )
+
+
+_Read = typing.Tuple[Path, Param, npt.NDArray]
+_Done = typing.Tuple[Path, "Future[npt.NDArray]"]
+
+
+def _read(
+    frames: typing.Sequence[typing.Tuple[Path, Param]],
+    read_queue: "queue.Queue[typing.Optional[_Read]]",
+    stop: threading.Event,
+    counters: typing.Dict[str, int],
+) -> None:
+    # reads the frames in advance, the size of the
+    # queue limiting the number of frames in memory
+    try:
+        for path, param in frames:
+            if stop.is_set():
+                return
+            try:
+                image = read_frame(path)
+            except Exception as e:
+                _logger.error(f"failed to read {path}: {e}")
+                counters["read failures"] += 1
+                continue
+            read_queue.put((path, param, image))
+    finally:
+        read_queue.put(None)
+
+
+def _write(
+    output_dir: Path,
+    write_queue: "queue.Queue[typing.Optional[_Done]]",
+    counters: typing.Dict[str, int],
+) -> None:
+    while True:
+        item = write_queue.get()
+        if item is None:
+            return
+        path, future = item
+        try:
+            write_frame(output_dir / path.name, future.result())
+        except Exception as e:
+            _logger.error(f"failed to calibrate {path}: {e}")
+            counters["failures"] += 1
+        else:
+            _logger.debug(f"calibrated {path}")
+            counters["frames"] += 1
+
+
+def calibrate(
+    library: ImageLibrary,
+    frames: typing.Iterable[Path],
+    output_dir: Path,
+    pattern: typing.Optional[str] = None,
+    workers: typing.Optional[int] = None,
+    prefetch: int = 4,
+) -> CalibrationReport:
+    """
+    Substracts the suitable darkframe from each frame (see get_darkframe)
+    and writes the result in output_dir (same file name and format).
+    The controllable values of each frame are read from a sidecar file
+    or from the file name (see frame_param).
+
+    Frames are grouped by controllable values, so that each darkframe
+    is generated only once. Frames are read by a dedicated thread (up to
+    'prefetch' frames in advance), substracted by a pool of 'workers'
+    threads and written by another thread.
+    """
+
+    start = time.time()
+    controllables = library.controllables()
+
+    # reading the params of all frames and grouping
+    # them by param
+    failures = 0
+    groups: typing.Dict[Param, typing.List[Path]] = {}
+    for path in frames:
+        try:
+            param = frame_param(path, controllables, pattern)
+        except ValueError as e:
+            _logger.error(str(e))
+            failures += 1
+            continue
+        groups.setdefault(param, []).append(path)
+    ordered = [(path, param) for param, paths in groups.items() for path in paths]
+
+    read_queue: "queue.Queue[typing.Optional[_Read]]" = queue.Queue(maxsize=prefetch)
+    write_queue: "queue.Queue[typing.Optional[_Done]]" = queue.Queue(maxsize=prefetch)
+    counters = {"frames": 0, "failures": 0, "read failures": 0}
+    stop = threading.Event()
+
+    reader = threading.Thread(target=_read, args=(ordered, read_queue, stop, counters))
+    writer = threading.Thread(target=_write, args=(output_dir, write_queue, counters))
+    reader.start()
+    writer.start()
+
+    current: typing.Optional[typing.Tuple[Param, npt.NDArray]] = None
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                item = read_queue.get()
+                if item is None:
+                    break
+                path, param, image = item
+                if current is None or current[0] != param:
+                    _logger.info(f"generating darkframe for {param}")
+                    current = (param, get_darkframe(library, param))
+                # substracting in place: the image is not used elsewhere
+                future = executor.submit(substract, image, current[1], image)
+                write_queue.put((path, future))
+    finally:
+        stop.set()
+        # unblocking the reader if it waits on a full queue
+        while reader.is_alive():
+            try:
+                read_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        write_queue.put(None)
+        writer.join()
+
+    failures += counters["failures"] + counters["read failures"]
+    return CalibrationReport(counters["frames"], failures, time.time() - start)
+
+
+def list_frames(directory: Path) -> typing.List[Path]:
+    """
+    Returns the (sorted) list of the frame files of the directory.
+    """
+    return sorted(
+        [
+            path
+            for path in directory.iterdir()
+            if path.is_file() and path.suffix.lower() in FRAME_FORMATS
+        ]
+    )
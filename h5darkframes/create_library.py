@@ -1,6 +1,10 @@
 from collections import OrderedDict
 from pathlib import Path
+import contextlib
 import logging
+import queue
+import threading
+import time
 import h5py
 import typing
 import cv2
@@ -9,10 +13,52 @@ from numpy import typing as npt
 from .camera import Camera, ImageTaker
 from .control_range import ControlRange
 from .progress import Progress
+from .stacking import Stacking, FrameStack, RunningVariance
+from .adaptive import AdaptiveFrames, StandardError
+from . import h5
 
 _logger = logging.getLogger("h5darkframes")
 
 
+class StageTimes:
+    """
+    Cumulated durations (in seconds) of the stages of the creation
+    of a library: reaching the controls, capturing the frames,
+    averaging them, writing the darkframes, and waiting for the writer
+    thread (pipelined mode only, see library), as well as the total
+    duration of the creation. In pipelined mode, stages overlap: the
+    time recovered is the sum of the stages minus the total duration.
+    """
+
+    STAGES = ("reach", "capture", "average", "write", "wait")
+
+    def __init__(self) -> None:
+        self.durations: typing.Dict[str, float] = {stage: 0.0 for stage in self.STAGES}
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> typing.Generator[None, None, None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.durations[stage] += duration
+
+    def recovered(self) -> float:
+        return max(0.0, sum(self.durations.values()) - self.total)
+
+    def __str__(self) -> str:
+        stages = ", ".join(
+            [f"{stage}: {duration:.2f}s" for stage, duration in self.durations.items()]
+        )
+        return str(
+            f"total: {self.total:.2f}s ({stages}, recovered: {self.recovered():.2f}s)"
+        )
+
+
 def _get_group(
     hdf5_file: h5py.File,
     controls: typing.OrderedDict[str, int],
@@ -69,7 +115,35 @@ def _dump_picture(
         cv2.imwrite(path, image)
 
 
-def _take_and_average_images(
+def _accumulator_type(images_type: npt.DTypeLike, avg_over: int) -> np.dtype:
+    """
+    Returns the narrowest type able to host the sum of avg_over
+    images of type images_type (plus the rounding offset added by
+    _average), e.g. uint32 for up to 65536 uint16 images.
+    Sums of floating point images are computed in float64.
+    """
+    images_type = np.dtype(images_type)
+    if images_type.kind == "b":
+        images_type = np.dtype(np.uint8)
+    if images_type.kind not in ("u", "i"):
+        return np.dtype(np.float64)
+    info = np.iinfo(images_type)
+    # max value of the sum plus the rounding offset
+    max_ = int(info.max) * avg_over + avg_over // 2
+    min_ = int(info.min) * avg_over
+    candidates = (
+        (np.uint16, np.uint32, np.uint64)
+        if images_type.kind == "u"
+        else (np.int16, np.int32, np.int64)
+    )
+    for candidate in candidates:
+        candidate_info = np.iinfo(candidate)
+        if candidate_info.min <= min_ and max_ <= candidate_info.max:
+            return np.dtype(candidate)
+    return np.dtype(np.float64)
+
+
+def _pictures(
     camera: ImageTaker,
     avg_over: int,
     progress: typing.Optional[Progress] = None,
@@ -77,25 +151,489 @@ def _take_and_average_images(
     estimated_duration: float = 0,
     dump: typing.Optional[Path] = None,
     dump_format: typing.Optional[str] = None,
-) -> npt.ArrayLike:
-    images_sum: typing.Optional[npt.ArrayLike] = None
-    images_type = None
+    variance: typing.Optional[RunningVariance] = None,
+    standard_error: typing.Optional[StandardError] = None,
+) -> typing.Generator[npt.NDArray, None, None]:
+    """
+    Has the camera take avg_over images, and yields them
+    (after adding them to variance, if any). If standard_error
+    is not None, stops as soon as it converged.
+    """
     for index in range(avg_over):
         _logger.debug("taking picture")
-        original_image = camera.picture()
+        original_image = np.asarray(camera.picture())
+        if variance is not None:
+            variance.add(original_image)
         if dump and dump_format and controls:
             _dump_picture(original_image, dump, index, controls, dump_format)
-        if images_type is None:
-            images_type = original_image.dtype  # type: ignore
-        image_ = original_image.astype(np.uint64)  # type: ignore
-        if images_sum is None:
-            images_sum = image_
-        else:
-            images_sum += image_
+        yield original_image
         if progress is not None:
             if controls is not None:
                 progress.picture_taken_feedback(controls, estimated_duration, 1)
-    return (images_sum / avg_over).astype(images_type)  # type: ignore
+        if standard_error is not None:
+            standard_error.add(original_image)
+            if standard_error.converged():
+                _logger.debug(
+                    f"standard error converged after {index+1} picture(s): "
+                    f"{standard_error.value()}"
+                )
+                return
+
+
+def _take_images(
+    camera: ImageTaker,
+    avg_over: int,
+    progress: typing.Optional[Progress] = None,
+    controls: typing.Optional[OrderedDict] = None,
+    estimated_duration: float = 0,
+    dump: typing.Optional[Path] = None,
+    dump_format: typing.Optional[str] = None,
+    variance: typing.Optional[RunningVariance] = None,
+    standard_error: typing.Optional[StandardError] = None,
+) -> typing.Tuple[npt.ArrayLike, npt.DTypeLike, int]:
+    """
+    Has the camera take avg_over images (less if standard_error
+    converged before, see _pictures), and returns their sum, the
+    type of the images (see _average) and the number of images.
+    The images are added in place to an accumulator of the narrowest
+    type able to host the sum (see _accumulator_type), and to variance
+    (if not None) in the same pass.
+    """
+    images_sum: typing.Optional[npt.NDArray] = None
+    images_type = None
+    nb_images = 0
+    for original_image in _pictures(
+        camera,
+        avg_over,
+        progress,
+        controls,
+        estimated_duration,
+        dump,
+        dump_format,
+        variance,
+        standard_error,
+    ):
+        nb_images += 1
+        if images_sum is None:
+            images_type = original_image.dtype
+            images_sum = original_image.astype(_accumulator_type(images_type, avg_over))
+        else:
+            np.add(images_sum, original_image, out=images_sum, casting="same_kind")
+    return images_sum, images_type, nb_images  # type: ignore
+
+
+def _average(
+    images_sum: npt.ArrayLike, images_type: npt.DTypeLike, avg_over: int
+) -> npt.ArrayLike:
+    """
+    Divides (in place) the sum of the images by their number, rounding
+    to the nearest integer for integer types, and returns the result
+    converted to the type of the images.
+    """
+    images_sum = typing.cast(npt.NDArray, images_sum)
+    if images_sum.dtype.kind in ("u", "i"):
+        # rounding integer division, the type of the
+        # accumulator accounting for the offset
+        np.add(images_sum, avg_over // 2, out=images_sum, casting="unsafe")
+        np.floor_divide(images_sum, avg_over, out=images_sum)
+    else:
+        np.divide(images_sum, avg_over, out=images_sum)
+        if np.dtype(images_type).kind in ("u", "i", "b"):
+            np.rint(images_sum, out=images_sum)
+    return images_sum.astype(images_type)
+
+
+def _take_and_average_images(
+    camera: ImageTaker,
+    avg_over: int,
+    progress: typing.Optional[Progress] = None,
+    controls: typing.Optional[OrderedDict] = None,
+    estimated_duration: float = 0,
+    dump: typing.Optional[Path] = None,
+    dump_format: typing.Optional[str] = None,
+    variance: typing.Optional[RunningVariance] = None,
+    adaptive: typing.Optional[AdaptiveFrames] = None,
+) -> npt.ArrayLike:
+    """
+    Has the camera take avg_over images and returns their average.
+    If variance is not None, the per-pixel variance of the images is
+    computed in the same pass (see stacking.RunningVariance).
+    If adaptive is not None, avg_over is the max number of images:
+    no more images are taken once the standard error of their mean
+    falls below the target of adaptive (see adaptive.AdaptiveFrames).
+    """
+    images_sum, images_type, nb_images = _take_images(
+        camera,
+        avg_over,
+        progress=progress,
+        controls=controls,
+        estimated_duration=estimated_duration,
+        dump=dump,
+        dump_format=dump_format,
+        variance=variance,
+        standard_error=None if adaptive is None else adaptive.tracker(),
+    )
+    return _average(images_sum, images_type, nb_images)
+
+
+class _Sum:
+    """
+    Sum of the images taken for a darkframe (mean stacking mode),
+    same API as stacking.FrameStack.
+    """
+
+    def __init__(
+        self, images_sum: npt.ArrayLike, images_type: npt.DTypeLike, avg_over: int
+    ) -> None:
+        self._images_sum = images_sum
+        self._images_type = images_type
+        self._avg_over = avg_over
+
+    def combine(self) -> npt.ArrayLike:
+        return _average(self._images_sum, self._images_type, self._avg_over)
+
+    def close(self) -> None:
+        pass
+
+
+_Frames = typing.Union[_Sum, FrameStack]
+
+
+class _Captured:
+    """
+    Images taken for a darkframe (to be combined), their number,
+    their running variance (if requested, see stacking.Stacking)
+    and the standard error of their mean (adaptive mode only).
+    """
+
+    def __init__(
+        self,
+        frames: _Frames,
+        nb_frames: int,
+        variance: typing.Optional[RunningVariance],
+        standard_error: typing.Optional[float] = None,
+    ) -> None:
+        self.frames = frames
+        self.nb_frames = nb_frames
+        self.variance = variance
+        self.standard_error = standard_error
+
+
+def _capture(
+    camera: ImageTaker,
+    avg_over: int,
+    stacking: typing.Optional[Stacking] = None,
+    progress: typing.Optional[Progress] = None,
+    controls: typing.Optional[OrderedDict] = None,
+    estimated_duration: float = 0,
+    dump: typing.Optional[Path] = None,
+    dump_format: typing.Optional[str] = None,
+    adaptive: typing.Optional[AdaptiveFrames] = None,
+) -> _Captured:
+    """
+    Has the camera take avg_over images (at most, if adaptive is not
+    None), and returns them either summed (mean stacking mode) or
+    spilled to a frame stack (other modes, see stacking.FrameStack),
+    to be combined into a darkframe.
+    """
+    variance: typing.Optional[RunningVariance] = None
+    if stacking is not None and stacking.variance:
+        variance = RunningVariance()
+    standard_error: typing.Optional[StandardError] = None
+    if adaptive is not None:
+        standard_error = adaptive.tracker()
+
+    def _captured(frames: _Frames, nb_frames: int) -> _Captured:
+        return _Captured(
+            frames,
+            nb_frames,
+            variance,
+            None if standard_error is None else standard_error.value(),
+        )
+
+    if stacking is None or stacking.mode == "mean":
+        images_sum, images_type, nb_images = _take_images(
+            camera,
+            avg_over,
+            progress,
+            controls,
+            estimated_duration,
+            dump,
+            dump_format,
+            variance,
+            standard_error,
+        )
+        return _captured(_Sum(images_sum, images_type, nb_images), nb_images)
+    stack = FrameStack(stacking, avg_over)
+    nb_images = 0
+    try:
+        for image in _pictures(
+            camera,
+            avg_over,
+            progress,
+            controls,
+            estimated_duration,
+            dump,
+            dump_format,
+            variance,
+            standard_error,
+        ):
+            stack.add(image)
+            nb_images += 1
+    except BaseException:
+        stack.close()
+        raise
+    return _captured(stack, nb_images)
+
+
+def _write_darkframe(
+    hdf5_file: h5py.File,
+    group: h5py.Group,
+    applied_controls: typing.OrderedDict[str, int],
+    image: npt.ArrayLike,
+    camera_config: typing.Mapping[str, int],
+    nb_frames: int,
+    variance: typing.Optional[npt.ArrayLike] = None,
+    standard_error: typing.Optional[float] = None,
+) -> None:
+    """
+    Writes the darkframe, the camera configuration, the number of
+    frames the darkframe has been computed from and (if not None) the
+    per-pixel variance of these frames and the standard error of their
+    mean into the group, and adds the darkframe to the index of the file.
+    """
+
+    report: str = ", ".join(
+        [f"{control}: {value}" for control, value in applied_controls.items()]
+    )
+    _logger.info(f"creating dataset for {report}")
+    dataset = group.create_dataset("image", data=image)
+
+    # add the camera current configuration to the group
+    group.attrs["camera_config"] = repr(camera_config)
+    group.attrs["nb_frames"] = nb_frames
+    if variance is not None:
+        group.create_dataset("variance", data=variance)
+    if standard_error is not None:
+        group.attrs["standard_error"] = standard_error
+
+    # keeping the index of the file up to date
+    h5.index_add(hdf5_file, tuple(applied_controls.values()), dataset, nb_frames)
+
+    # so that processes reading the library while it is being
+    # created can use this darkframe (see ImageLibrary.refresh)
+    hdf5_file.flush()
+
+
+def _frames_to_top_up(
+    group: h5py.Group, avg_over: int, adaptive: typing.Optional[AdaptiveFrames]
+) -> int:
+    """
+    Returns the number of frames to take so that the darkframe of the
+    group is computed from avg_over frames, 0 for darkframes created
+    by older versions of h5darkframes (which do not store their number
+    of frames) and, in adaptive mode, for darkframes which standard
+    error already reached the target.
+    """
+    if adaptive is not None and "standard_error" in group.attrs:
+        if float(group.attrs["standard_error"]) <= adaptive.target_error:
+            return 0
+    try:
+        nb_frames = int(group.attrs["nb_frames"])
+    except KeyError:
+        _logger.warning(
+            f"{group.name}: number of frames unknown, can not top up the darkframe"
+        )
+        return 0
+    return max(0, avg_over - nb_frames)
+
+
+def _merge_darkframe(
+    hdf5_file: h5py.File,
+    group: h5py.Group,
+    applied_controls: typing.OrderedDict[str, int],
+    image: npt.ArrayLike,
+    captured: _Captured,
+) -> None:
+    """
+    Merges the darkframe computed from the captured frames into the
+    darkframe of the group (average weighted by the numbers of frames,
+    the dataset being updated in place). The stored variance, if
+    any, is merged with the variance of the captured frames (or
+    deleted, if the variance of the captured frames was not computed).
+    """
+    report: str = ", ".join(
+        [f"{control}: {value}" for control, value in applied_controls.items()]
+    )
+    dataset = group["image"]
+    image = np.asarray(image)
+    if dataset.shape != image.shape:
+        raise ValueError(
+            f"can not top up the darkframe for {report}: shape of the "
+            f"stored darkframe {dataset.shape} and of the new frames "
+            f"{image.shape} differ"
+        )
+    nb_stored = int(group.attrs["nb_frames"])
+    nb_new = captured.nb_frames
+    nb_frames = nb_stored + nb_new
+    _logger.info(f"topping up darkframe for {report} ({nb_stored} + {nb_new} frames)")
+    stored = dataset[()].astype(np.float64)
+    new = image.astype(np.float64)
+    if captured.variance is not None and isinstance(captured.frames, _Sum):
+        # exact mean (the averaged image may be rounded)
+        new = captured.variance.mean()
+    merged = (stored * nb_stored + new * nb_new) / nb_frames
+    if dataset.dtype.kind in ("u", "i", "b"):
+        np.rint(merged, out=merged)
+    dataset[...] = merged.astype(dataset.dtype)
+
+    if "variance" in group:
+        if captured.variance is None:
+            _logger.warning(
+                f"variance of the new frames for {report} not computed, "
+                "deleting the stored variance"
+            )
+            del group["variance"]
+        else:
+            # combining the sums of squared differences (Chan et al.)
+            m2 = group["variance"][()].astype(np.float64) * (nb_stored - 1)
+            m2 += captured.variance.variance() * (nb_new - 1)
+            delta = captured.variance.mean() - stored
+            m2 += delta**2 * (nb_stored * nb_new / nb_frames)
+            group["variance"][...] = (m2 / (nb_frames - 1)).astype(np.float32)
+    group.attrs["nb_frames"] = nb_frames
+    if "standard_error" in group.attrs:
+        # the standard error of the merged frames is not known
+        del group.attrs["standard_error"]
+    h5.index_add(hdf5_file, tuple(applied_controls.values()), dataset, nb_frames)
+
+    # so that processes reading the library while it is
+    # being updated read the updated darkframe
+    hdf5_file.flush()
+
+
+def _combine_and_write(
+    hdf5_file: h5py.File,
+    group: typing.Optional[h5py.Group],
+    applied_controls: typing.OrderedDict[str, int],
+    captured: _Captured,
+    camera_config: typing.Mapping[str, int],
+    times: StageTimes,
+) -> None:
+    """
+    Combines the captured images and writes the darkframe into
+    the group (created if None), or merges it into the darkframe
+    the group already hosts (see the top_up mode of library).
+    """
+    with times.measure("average"):
+        try:
+            image = captured.frames.combine()
+        finally:
+            captured.frames.close()
+        variance = None
+        if captured.variance is not None:
+            variance = captured.variance.variance()
+    with times.measure("write"):
+        if group is None:
+            create = True
+            group, _ = _get_group(hdf5_file, applied_controls, create)
+        group = typing.cast(h5py.Group, group)
+        if "image" in group:
+            _merge_darkframe(hdf5_file, group, applied_controls, image, captured)
+            return
+        _write_darkframe(
+            hdf5_file,
+            group,
+            applied_controls,
+            image,
+            camera_config,
+            captured.nb_frames,
+            variance,
+            captured.standard_error,
+        )
+
+
+# darkframe to be written by the writer thread: applied controls,
+# captured images, camera configuration
+_Pending = typing.Tuple[typing.OrderedDict[str, int], _Captured, typing.Mapping]
+
+
+class _Writer:
+    """
+    Thread combining and writing the darkframes (see the
+    pipelined mode of library), the darkframes being submitted
+    via a bounded queue.
+    """
+
+    def __init__(
+        self,
+        hdf5_file: h5py.File,
+        queue_size: int,
+        times: StageTimes,
+    ) -> None:
+        self._hdf5_file = hdf5_file
+        self._times = times
+        self._queue: "queue.Queue[typing.Optional[_Pending]]" = queue.Queue(
+            maxsize=queue_size
+        )
+        # params submitted but not written yet
+        self._pending: typing.Set[typing.Tuple[int, ...]] = set()
+        self._lock = threading.Lock()
+        self._error: typing.Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def pending(self, controls: typing.Mapping[str, int]) -> bool:
+        with self._lock:
+            return tuple(controls.values()) in self._pending
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(
+                f"failed to write a darkframe: {self._error}"
+            ) from self._error
+
+    def submit(self, item: _Pending) -> None:
+        self._check()
+        with self._lock:
+            self._pending.add(tuple(item[0].values()))
+        with self._times.measure("wait"):
+            self._queue.put(item)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            applied_controls, captured, camera_config = item
+            try:
+                if self._error is None:
+                    _combine_and_write(
+                        self._hdf5_file,
+                        None,
+                        applied_controls,
+                        captured,
+                        camera_config,
+                        self._times,
+                    )
+            except BaseException as e:
+                # the following darkframes are dropped, the
+                # error is raised by the main thread
+                _logger.error(f"failed to write the darkframe: {e}")
+                self._error = e
+            finally:
+                captured.frames.close()
+                with self._lock:
+                    self._pending.discard(tuple(applied_controls.values()))
+
+    def close(self) -> None:
+        """
+        Waits for the submitted darkframes to be written.
+        """
+        with self._times.measure("wait"):
+            self._queue.put(None)
+            self._thread.join()
+        self._check()
 
 
 def _add_to_hdf5(
@@ -106,31 +644,58 @@ def _add_to_hdf5(
     progress: typing.Optional[Progress] = None,
     dump: typing.Optional[Path] = None,
     dump_format: typing.Optional[str] = None,
+    writer: typing.Optional[_Writer] = None,
+    times: typing.Optional[StageTimes] = None,
+    stacking: typing.Optional[Stacking] = None,
+    top_up: bool = False,
+    adaptive: typing.Optional[AdaptiveFrames] = None,
 ) -> None:
     """
-    Has the camera take images, average them and adds this averaged image
-    to the hdf5 file, with 'path'
+    Has the camera take images, average them (or combine them according
+    to stacking) and adds this averaged image to the hdf5 file, with 'path'
     like hdf5_file[param1.value][param2.value][param3.value]...
     Before taking the image, the camera's configuration is set accordingly.
+    If a writer is provided, the images are averaged and written by
+    the writer thread.
+    If top_up is True and the hdf5 file already has a darkframe computed
+    from less than avg_over images, only the missing images are taken,
+    and merged into this darkframe.
+    If adaptive is not None, avg_over is the max number of images
+    (see adaptive.AdaptiveFrames).
     """
 
+    if times is None:
+        times = StageTimes()
+
+    def _missing(controls: typing.OrderedDict[str, int]) -> int:
+        # number of images to take, 0 if the data already exist
+        if writer is not None and writer.pending(controls):
+            return 0
+        create = False
+        group, _ = _get_group(hdf5_file, controls, create)
+        if group is None:
+            return avg_over
+        if not top_up:
+            return 0
+        return _frames_to_top_up(group, avg_over, adaptive)
+
     _logger.info(f"creating darkframe for {repr(controls)}")
 
     # for the progress feedback
     estimated_duration = camera.estimate_picture_time(controls)
 
     # the darkframe for this control set already exists, exit
-    create = False
-    if _get_group(hdf5_file, controls, create)[0] is not None:
+    if _missing(controls) == 0:
         _logger.info(f"data already exists for {repr(controls)}, skipping")
         if progress is not None:
             progress.picture_taken_feedback(controls, estimated_duration, 1)
         return
 
     # setting the configuration of the current pictures set
-    for control, value in controls.items():
-        _logger.info(f"{control}: reaching value of {value}")
-        camera.reach_control(control, value, progress=progress)
+    with times.measure("reach"):
+        for control, value in controls.items():
+            _logger.info(f"{control}: reaching value of {value}")
+            camera.reach_control(control, value, progress=progress)
 
     # the control values we reached (which may not be the one
     # we asked for)
@@ -141,34 +706,42 @@ def _add_to_hdf5(
 
     # do the data for these reached controls already exist ?
     # if so, skipping
-    create = True
-    group, created = _get_group(hdf5_file, applied_controls, create)
-    if group is None or not created:
+    missing = _missing(applied_controls)
+    if missing == 0:
         _logger.info(f"data already exists for {repr(applied_controls)}, skipping")
         if progress is not None:
             progress.picture_taken_feedback(controls, estimated_duration, 1)
         return
 
-    # taking and averaging the pictures
-    image = _take_and_average_images(
-        camera,
-        avg_over,
-        progress=progress,
-        controls=controls,
-        estimated_duration=estimated_duration,
-        dump=dump,
-        dump_format=dump_format,
-    )
+    group: typing.Optional[h5py.Group] = None
+    if writer is None:
+        # (if pipelined, the group is created by the writer thread)
+        create = True
+        group, _ = _get_group(hdf5_file, applied_controls, create)
+
+    # taking the pictures
+    with times.measure("capture"):
+        captured = _capture(
+            camera,
+            missing,
+            stacking=stacking,
+            progress=progress,
+            controls=controls,
+            estimated_duration=estimated_duration,
+            dump=dump,
+            dump_format=dump_format,
+            adaptive=adaptive,
+        )
+        camera_config = camera.get_configuration()
+
+    if writer is not None:
+        writer.submit((applied_controls, captured, camera_config))
+        return
 
-    # adding the image to the hdf5 file
-    report: str = ", ".join(
-        [f"{control}: {value}" for control, value in applied_controls.items()]
+    # averaging the pictures and adding the image to the hdf5 file
+    _combine_and_write(
+        hdf5_file, group, applied_controls, captured, camera_config, times
     )
-    _logger.info(f"creating dataset for {report}")
-    group.create_dataset("image", data=image)
-
-    # add the camera current configuration to the group
-    group.attrs["camera_config"] = repr(camera.get_configuration())
 
 
 def library(
@@ -180,7 +753,12 @@ def library(
     progress: typing.Optional[Progress] = None,
     dump: typing.Optional[Path] = None,
     dump_format: typing.Optional[str] = "npy",
-) -> None:
+    pipelined: bool = False,
+    queue_size: int = 2,
+    stacking: typing.Optional[Stacking] = None,
+    top_up: bool = False,
+    adaptive: typing.Optional[AdaptiveFrames] = None,
+) -> StageTimes:
     """Create an hdf5 image library file
 
     This function will take pictures using
@@ -197,8 +775,45 @@ def library(
     Note that 'all' really means all, i.e. before averaging
     (if 'avg_over' is 10, 10 pictures will be dumped per control
     range).
+
+    The file is flushed after each darkframe, so that the library
+    can be used while being created (see the 'live' argument of
+    ImageLibrary).
+
+    If 'pipelined' is True, the images are averaged and written by
+    a dedicated thread, while the camera moves to the next controls.
+    Up to 'queue_size' darkframes wait for this thread (the main thread
+    blocks when the queue is full).
+
+    'stacking' configures how the pictures are combined (see
+    stacking.Stacking): averaged (the default), or combined with
+    outliers rejection (median, sigma clipping, min/max rejection),
+    in which case the pictures are spilled to a temporary file and
+    combined within a memory budget. The number of pictures is stored
+    alongside each darkframe, as well as, if requested by stacking, the
+    per-pixel variance of the pictures (see ImageLibrary.get).
+
+    If 'top_up' is True, darkframes of the file computed from less
+    than 'avg_over' pictures (e.g. because 'avg_over' has been increased
+    since the file was created) are improved: only the missing pictures
+    are taken, and their average is merged into the darkframe (weighted
+    by the numbers of pictures). With stacking modes other than mean,
+    the merged darkframe is the weighted mean of the stored darkframe and
+    of the combination of the new pictures. Darkframes created by older
+    versions of h5darkframes (which do not store their number of
+    pictures) are not topped up.
+
+    If 'adaptive' is not None (see adaptive.AdaptiveFrames), 'avg_over' is
+    the max number of pictures: pictures are taken until the standard error
+    of their mean falls below the configured target. The number of pictures
+    taken and the standard error are stored alongside each darkframe.
+
+    Returns the durations of the stages of the creation.
     """
 
+    times = StageTimes()
+    start = time.perf_counter()
+
     # opening the hdf5 file in write mode
     with h5py.File(hdf5_path, "a") as hdf5_file:
 
@@ -208,15 +823,37 @@ def library(
         # adding the control ranges to the hdf5 file
         hdf5_file.attrs["controls"] = repr(control_ranges)
 
+        # files created by older versions of h5darkframes
+        # may not have an index yet
+        h5.ensure_index(hdf5_file, len(control_ranges))
+        hdf5_file.flush()
+
+        writer: typing.Optional[_Writer] = None
+        if pipelined:
+            writer = _Writer(hdf5_file, queue_size, times)
+
         # iterating over all the controls and adding
         # the images to the hdf5 file
-        for controls in ControlRange.iterate_controls(control_ranges):
-            _add_to_hdf5(
-                camera,
-                controls,
-                avg_over,
-                hdf5_file,
-                progress=progress,
-                dump=dump,
-                dump_format=dump_format,
-            )
+        try:
+            for controls in ControlRange.iterate_controls(control_ranges):
+                _add_to_hdf5(
+                    camera,
+                    controls,
+                    avg_over,
+                    hdf5_file,
+                    progress=progress,
+                    dump=dump,
+                    dump_format=dump_format,
+                    writer=writer,
+                    times=times,
+                    stacking=stacking,
+                    top_up=top_up,
+                    adaptive=adaptive,
+                )
+        finally:
+            if writer is not None:
+                writer.close()
+
+    times.total = time.perf_counter() - start
+    _logger.info(f"library created, {times}")
+    return times
@@ -141,6 +141,11 @@ class DummyCamera(Camera):
         r: typing.Dict[str, typing.Any] = {}
         r["darkframes"] = {}
         r["darkframes"]["average_over"] = 5
+        r["darkframes"]["stacking"] = {
+            "mode": "mean",
+            "memory_budget": 256,
+            "variance": False,
+        }
         control_ranges = OrderedDict()
         control_ranges["height"] = ControlRange(100, 200, 50, 0, 10)
         control_ranges["width"] = ControlRange(10, 20, 5, 0, 10)
@@ -2,17 +2,24 @@ import typing
 from collections import OrderedDict
 from .camera import Camera
 from .control_range import ControlRange
+from .adaptive import AdaptiveFrames
 
 
 def estimate_total_duration(
     camera: Camera,
     control_ranges: OrderedDict[str, ControlRange],
     avg_over: int,
+    adaptive: typing.Optional[AdaptiveFrames] = None,
 ) -> typing.Tuple[int, int]:
     """
     Return an estimation of how long capturing all darkframes will
     take (in seconds).
 
+    If adaptive is not None, avg_over is the max number of pictures
+    per darkframe, and the number of pictures of each darkframe is
+    estimated from the noise model of adaptive (see
+    adaptive.AdaptiveFrames.expected_frames).
+
     Returns
     -------
        the expected duration (in seconds) and the number of pictures
@@ -22,15 +29,17 @@ def estimate_total_duration(
     all_values: typing.List[typing.Dict[str, int]] = list(
         ControlRange.iterate_controls(control_ranges)
     )
-    total_time_ = sum(
-        [
-            camera.estimate_picture_time(
-                {control: values[control] for control in control_ranges.keys()}
-            )
-            * avg_over
-            for values in all_values
-        ]
-    )
+    total_time_ = 0.0
+    nb_pics = 0
+    for values in all_values:
+        picture_time = camera.estimate_picture_time(
+            {control: values[control] for control in control_ranges.keys()}
+        )
+        if adaptive is None:
+            nb_frames = avg_over
+        else:
+            nb_frames = adaptive.expected_frames(picture_time, avg_over)
+        total_time_ += picture_time * nb_frames
+        nb_pics += nb_frames
     total_time = int(total_time_ + 0.5)
-    nb_pics = len(all_values) * avg_over
     return total_time, nb_pics
@@ -0,0 +1,130 @@
+"""
+Module for running darkframes interpolation and substraction
+over several threads.
+"""
+
+import os
+import typing
+import numpy as np
+from numpy import typing as npt
+from concurrent.futures import ThreadPoolExecutor
+from .h5types import Param, ParamImages
+from .neighbors import average_neighbors
+from .substract import _check, _substract
+
+
+class TiledEngine:
+    """
+    Splits frames into tiles of rows and processes the tiles in
+    parallel using a pool of threads (numpy releases the GIL while
+    computing over arrays, so the threads run on several cores).
+
+    Arguments
+    ---------
+    workers:
+      number of threads (if None, the number of cores).
+      With 1 worker, tiles are processed in the calling thread.
+    tiles_per_worker:
+      each frame is split into workers * tiles_per_worker tiles,
+      to balance the load between the threads.
+    """
+
+    def __init__(
+        self, workers: typing.Optional[int] = None, tiles_per_worker: int = 4
+    ) -> None:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1:
+            raise ValueError(f"tiled engine: invalid number of workers ({workers})")
+        self._workers = workers
+        self._tiles_per_worker = tiles_per_worker
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+        if workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def workers(self) -> int:
+        return self._workers
+
+    def _tiles(self, nb_rows: int) -> typing.List[slice]:
+        nb_tiles = min(nb_rows, self._workers * self._tiles_per_worker)
+        bounds = np.linspace(0, nb_rows, max(1, nb_tiles) + 1).astype(int)
+        return [slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _run(self, f: typing.Callable[[slice], typing.Any], nb_rows: int) -> None:
+        tiles = self._tiles(nb_rows)
+        if self._executor is None:
+            for tile in tiles:
+                f(tile)
+            return
+        # list: waiting for all tiles, and raising the first error (if any)
+        list(self._executor.map(f, tiles))
+
+    def average_neighbors(
+        self,
+        target_values: Param,
+        min_values: Param,
+        max_values: Param,
+        images: ParamImages,
+        dtype: typing.Optional[npt.DTypeLike] = None,
+        out: typing.Optional[npt.NDArray] = None,
+        accumulator: typing.Optional[npt.DTypeLike] = None,
+    ) -> npt.NDArray:
+        """
+        Same as neighbors.average_neighbors, computed tile by tile.
+        """
+        first = next(iter(images.values()))[0]
+        if out is None:
+            out = np.empty(
+                first.shape, dtype=first.dtype if dtype is None else dtype  # type: ignore
+            )
+        result = out
+
+        def _tile(tile: slice) -> None:
+            average_neighbors(
+                target_values,
+                min_values,
+                max_values,
+                {values: (image[tile], config) for values, (image, config) in images.items()},  # type: ignore
+                dtype=dtype,
+                out=result[tile],
+                accumulator=accumulator,
+            )
+
+        self._run(_tile, first.shape[0])  # type: ignore
+        return result
+
+    def substract(
+        self,
+        img: npt.NDArray,
+        darkframe: npt.NDArray,
+        out: typing.Optional[npt.NDArray] = None,
+    ) -> npt.NDArray:
+        """
+        Same as substract.substract, computed tile by tile.
+        """
+        _check(img, darkframe)
+        if out is None:
+            out = np.empty_like(img)
+        elif out.dtype != img.dtype or out.shape != img.shape:
+            raise ValueError(
+                f"darkframe substraction: output array of type {out.dtype} and shape "
+                f"{out.shape}, expected {img.dtype} and {img.shape}"
+            )
+        result = out
+
+        def _tile(tile: slice) -> None:
+            _substract(img[tile], darkframe[tile], result[tile])
+
+        self._run(_tile, img.shape[0])
+        return result
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _, __, ___):
+        self.close()
@@ -6,7 +6,7 @@ from pathlib import Path
 from .camera import Camera
 from .progress import AliveBarProgress
 from .create_library import library
-from .toml_config import read_config
+from .toml_config import read_config, read_stacking, read_adaptive
 from .duration_estimate import estimate_total_duration
 
 _root_dir = Path(os.getcwd())
@@ -88,6 +88,7 @@ def darkframes_library(
     progress_bar: bool,
     dump: typing.Optional[Path],
     dump_format: typing.Optional[str],
+    top_up: bool = False,
     **camera_kwargs,
 ) -> Path:
 
@@ -98,19 +99,24 @@ def darkframes_library(
     path = get_darkframes_path(check_exists=False)
 
     # if a file already exists, exiting
-    if path.is_file():
+    # (not if the user asked to top it up)
+    if path.is_file() and not top_up:
         append = _append_user_feedback(path)
         if not append:
             raise RuntimeError("user exit")
 
     # reading configuration file
     control_ranges, average_over = read_config(config_path)
+    stacking = read_stacking(config_path)
+    adaptive = read_adaptive(config_path)
 
     # configuring the camera
     camera = typing.cast(Camera, camera_class.configure(config_path, **camera_kwargs))
 
     # estimating duration and number of pics
-    duration, nb_pics = estimate_total_duration(camera, control_ranges, average_over)
+    duration, nb_pics = estimate_total_duration(
+        camera, control_ranges, average_over, adaptive
+    )
 
     # adding a progress bar
     if progress_bar:
@@ -144,6 +150,9 @@ def darkframes_library(
             progress=progress_bar_,
             dump=dump,
             dump_format=dump_format,
+            stacking=stacking,
+            top_up=top_up,
+            adaptive=adaptive,
         )
 
     # stopping camera
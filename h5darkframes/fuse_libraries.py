@@ -10,6 +10,7 @@ from pathlib import Path
 from .control_range import ControlRange  # noqa: F401
 from collections import OrderedDict  # noqa: F401
 from . import create_library
+from . import h5
 from .get_image import ImageNotFoundError
 from .image_library import ImageLibrary
 from .h5types import Params
@@ -18,16 +19,19 @@ _logger = logging.getLogger("fusion")
 
 
 def _add(
-    h5: h5py.File,
+    h5file: h5py.File,
     controllables: typing.Sequence[str],
     param: typing.Sequence[int],
     image: npt.ArrayLike,
     config: typing.Dict,
+    nb_frames: typing.Optional[int] = None,
+    variance: typing.Optional[npt.ArrayLike] = None,
 ) -> bool:
     """
     Create the group corresponding to the controls
     and add the image in the dataset, add the configuration
-    as attribute to the dataset; and returns True.
+    (and the number of frames and variance, if any) to the
+    group; and returns True.
     If the group already existed, then nothing is added
     and False is returned.
     """
@@ -35,10 +39,15 @@ def _add(
     controls: typing.OrderedDict[str, int] = OrderedDict()
     for controllable, p in zip(controllables, param):
         controls[controllable] = p
-    group, created = create_library._get_group(h5, controls, create)
+    group, created = create_library._get_group(h5file, controls, create)
     if group and created:
-        group.create_dataset("image", data=image)
+        dataset = group.create_dataset("image", data=image)
         group.attrs["camera_config"] = repr(config)
+        if nb_frames is not None:
+            group.attrs["nb_frames"] = nb_frames
+        if variance is not None:
+            group.create_dataset("variance", data=variance)
+        h5.index_add(h5file, tuple(param), dataset, nb_frames)
         return True
     return False
 
@@ -63,13 +72,16 @@ def _fuse_libraries(
                     controllable: value
                     for controllable, value in zip(controllables, param)
                 }
-                image, config = lib.get(c)
+                image, config, variance = lib.get(c, with_variance=True)
+                nb_frames = lib.nb_frames(c)
             except ImageNotFoundError:
                 _logger.error(
                     f"failed to find the image corresponding to {c} in {path}, skipping"
                 )
             else:
-                added = _add(target, controllables, param, image, config)
+                added = _add(
+                    target, controllables, param, image, config, nb_frames, variance
+                )
                 if not added:
                     _logger.debug("controls already added, skipping")
                 else:
@@ -116,6 +128,7 @@ def fuse_libraries(
     # params is the list of controls used, in order (it matters)
     # (ImageLibrary.params returns an OrderedDict)
     with h5py.File(target, "a") as h5target:
+        h5.ensure_index(h5target, len(libs[0].controllables()))
         _fuse_libraries(h5target, libraries, libs)
         h5target.attrs["controls"] = repr([lib.ranges() for lib in libs])
         h5target.attrs["name"] = name
@@ -2,6 +2,7 @@ import typing
 import h5py
 from numpy import typing as npt
 import numpy as np
+from .h5 import is_param_key
 
 
 class ImageNotFoundError(Exception):
@@ -47,7 +48,7 @@ def get_image(
         else:
             if index >= len(values):
                 raise ImageNotFoundError()
-            keys = list([int(k) for k in hdf5_file.keys()])
+            keys = list([int(k) for k in hdf5_file.keys() if is_param_key(k)])
             value: int
             if values[index] not in keys:
                 if closest:
@@ -2,7 +2,233 @@ import typing
 import h5py
 import numpy as np
 from numpy import typing as npt
-from .h5types import Param, ParamImage
+from .h5types import Param, Params, ParamImage
+
+INDEX = "index"
+"""
+Name of the root level group hosting the index of the library, i.e.
+the dataset 'params' (one row per darkframe), the dataset 'images'
+(the corresponding references to the darkframes datasets) and the
+dataset 'nb_frames' (the numbers of frames the darkframes have been
+computed from, -1 if unknown).
+"""
+
+
+def is_param_key(key: str) -> bool:
+    """
+    Returns True if the key is the name of a group corresponding
+    to a controllable value (e.g. '-15' or '2000'), False for other
+    entries (e.g. the index group).
+    """
+    return key.lstrip("-").isdigit()
+
+
+def walk(
+    h5: h5py.Group, depth: int
+) -> typing.Generator[typing.Tuple[Param, h5py.Group], None, None]:
+    """
+    Iterates over the groups of the file hosting a darkframe, and yields
+    for each the corresponding parameter and the group.
+    'depth' is the number of controllables.
+    """
+
+    def _walk(group: h5py.Group, current: Param):
+        if len(current) >= depth:
+            if "image" in group.keys():
+                yield current, group
+            return
+        for key in sorted(group.keys()):
+            if is_param_key(key):
+                yield from _walk(group[key], current + (int(key),))
+
+    yield from _walk(h5, tuple())
+
+
+def has_index(h5: h5py.File) -> bool:
+    """
+    Returns True if the file hosts an index of its darkframes.
+    """
+    return INDEX in h5.keys()
+
+
+def read_index(
+    h5: h5py.File,
+) -> typing.Optional[typing.Tuple[Params, typing.List[h5py.Reference]]]:
+    """
+    Returns the list of parameters and the corresponding darkframe
+    datasets references, as stored in the index of the file,
+    or None if the file has no index (i.e. it has been created
+    with an older version of h5darkframes).
+    """
+    if not has_index(h5):
+        return None
+    index = h5[INDEX]
+    points = index["params"][()]
+    refs = index["images"][()]
+    params: Params = [tuple(int(v) for v in row) for row in points]
+    return params, list(refs)
+
+
+def read_index_nb_frames(
+    h5: h5py.File,
+) -> typing.Optional[typing.Dict[Param, typing.Optional[int]]]:
+    """
+    Returns the numbers of frames the darkframes have been computed
+    from (None for unknown numbers), as stored in the index of the
+    file, or None if the file has no index or if its index does
+    not store these numbers (i.e. it has been created with an
+    older version of h5darkframes).
+    """
+    if not has_index(h5) or "nb_frames" not in h5[INDEX]:
+        return None
+    index = h5[INDEX]
+    points = index["params"][()]
+    nb_frames = index["nb_frames"][()]
+    return {
+        tuple(int(v) for v in row): (None if count < 0 else int(count))
+        for row, count in zip(points, nb_frames)
+    }
+
+
+def write_index(
+    h5: h5py.File,
+    depth: int,
+    params: Params,
+    refs: typing.List[h5py.Reference],
+    nb_frames: typing.Optional[typing.List[typing.Optional[int]]] = None,
+) -> None:
+    """
+    (Re)creates the index of the file, i.e. the root level datasets
+    listing all the parameters for which a darkframe is stored,
+    along with the references to the corresponding datasets and
+    the numbers of frames of the darkframes (if known).
+    """
+    if has_index(h5):
+        del h5[INDEX]
+    index = h5.create_group(INDEX)
+    points = np.array(params, dtype=np.int64).reshape(len(params), depth)
+    index.create_dataset(
+        "params",
+        data=points,
+        maxshape=(None, depth),
+        chunks=(256, depth),
+    )
+    images = index.create_dataset(
+        "images",
+        shape=(len(refs),),
+        maxshape=(None,),
+        chunks=(256,),
+        dtype=h5py.ref_dtype,
+    )
+    if refs:
+        images[:] = refs
+    if nb_frames is None:
+        nb_frames = [None] * len(params)
+    index.create_dataset(
+        "nb_frames",
+        data=np.array([-1 if n is None else n for n in nb_frames], dtype=np.int64),
+        maxshape=(None,),
+        chunks=(256,),
+    )
+
+
+def rebuild_index(h5: h5py.File, depth: int) -> Params:
+    """
+    Walks through the file to find all the darkframes it contains
+    and (re)writes the index accordingly. Returns the list of
+    indexed parameters.
+    """
+    params: Params = []
+    refs: typing.List[h5py.Reference] = []
+    nb_frames: typing.List[typing.Optional[int]] = []
+    for param, group in walk(h5, depth):
+        params.append(param)
+        refs.append(group["image"].ref)
+        count = group.attrs.get("nb_frames")
+        nb_frames.append(None if count is None else int(count))
+    write_index(h5, depth, params, refs, nb_frames)
+    return params
+
+
+def ensure_index(h5: h5py.File, depth: int) -> None:
+    """
+    Creates the index of the file if it does not have one yet
+    (or if its index does not store the numbers of frames).
+    """
+    if not has_index(h5) or "nb_frames" not in h5[INDEX]:
+        rebuild_index(h5, depth)
+
+
+def _index_row(points: h5py.Dataset, param: Param) -> typing.Optional[int]:
+    if points.shape[0] == 0:
+        return None
+    rows = np.flatnonzero(np.all(points[()] == np.array(param), axis=1))
+    if rows.size == 0:
+        return None
+    return int(rows[0])
+
+
+def index_add(
+    h5: h5py.File,
+    param: Param,
+    image: h5py.Dataset,
+    nb_frames: typing.Optional[int] = None,
+) -> None:
+    """
+    Adds the darkframe dataset (and the number of frames it has been
+    computed from, if known) to the index of the file, or updates it if
+    the index already lists the param (if the file has an index; does
+    nothing otherwise).
+    """
+    if not has_index(h5):
+        return
+    index = h5[INDEX]
+    points, images = index["params"], index["images"]
+    counts: typing.Optional[h5py.Dataset] = index.get("nb_frames")
+    row = _index_row(points, param)
+    if row is None:
+        row = points.shape[0]
+        points.resize(row + 1, axis=0)
+        images.resize(row + 1, axis=0)
+        if counts is not None:
+            counts.resize(row + 1, axis=0)
+        points[row] = param
+    images[row] = image.ref
+    if counts is not None:
+        counts[row] = -1 if nb_frames is None else nb_frames
+
+
+def index_rm(h5: h5py.File, param: Param) -> None:
+    """
+    Removes the parameter from the index of the file (if the file
+    has an index; does nothing otherwise).
+    """
+    if not has_index(h5):
+        return
+    index = h5[INDEX]
+    points, images = index["params"], index["images"]
+    row = _index_row(points, param)
+    if row is None:
+        return
+    counts: typing.Optional[h5py.Dataset] = index.get("nb_frames")
+    last = points.shape[0] - 1
+    if row < last:
+        points[row:last] = points[row + 1 :]
+        images[row:last] = images[row + 1 :]
+        if counts is not None:
+            counts[row:last] = counts[row + 1 :]
+    points.resize(last, axis=0)
+    images.resize(last, axis=0)
+    if counts is not None:
+        counts.resize(last, axis=0)
+
+
+def group_path(param: Param) -> str:
+    """
+    Returns the path of the group hosting the darkframe
+    corresponding to the parameter, e.g. '-15/2000'.
+    """
+    return "/".join(str(p) for p in param)
 
 
 def get_group(
@@ -51,8 +277,9 @@ def add(
     if not group:
         return False
 
-    group.create_dataset("image", data=img)
+    image = group.create_dataset("image", data=img)
     group.attrs["camera_config"] = repr(camera_config)
+    index_add(h5, param, image)
 
     return True
 
@@ -84,6 +311,11 @@ def rm(h5: h5py.File, param: Param) -> typing.Optional[ParamImage]:
 
     del group["image"]
     del group.attrs["camera_config"]
+    if "variance" in group:
+        del group["variance"]
+    if "nb_frames" in group.attrs:
+        del group.attrs["nb_frames"]
+    index_rm(h5, param)
 
     groups.reverse()
     for group in groups:
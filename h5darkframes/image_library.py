@@ -1,19 +1,26 @@
+import os
+import time
 import typing
 import h5py
-import copy
 import numpy as np
 from numpy import typing as npt
 from pathlib import Path
 from collections import OrderedDict  # noqa: F401
-from .h5types import Controllables, Ranges, Param, Params, ParamImage
-from .get_image import get_image
+from .h5types import Controllables, Ranges, Param, Params, ParamImage, ParamImages
+from .get_image import ImageNotFoundError
 from .neighbors import (
-    get_neighbors,
-    closest_neighbors,
+    AxisIndex,
+    _normalize,
+    normalize_points,
+    get_neighbors_many,
+    select_neighbors,
     average_neighbors,
-    interpolation_neighbors,
 )
 from .control_range import ControlRange  # noqa: F401
+from .cache import DarkframeCache, CacheStats
+from .shared_cache import SharedDarkframeCache
+from .spatial import KDTree, Neighbor
+from .engine import TiledEngine
 from . import h5
 
 
@@ -28,36 +35,30 @@ def _get_controllables(ranges: Ranges) -> typing.Tuple[str, ...]:
 
 
 def _get_params(
-    h5: h5py.File,
+    h5file: h5py.File,
     controllables: Controllables,
 ) -> Params:
     """
     Return the list of all configurations to which a corresponding
-    image is stored in the library.
+    image is stored in the library, by walking through the groups
+    of the file (used for files without index).
     """
+    return [param for param, _ in h5.walk(h5file, len(controllables))]
 
-    def _append_configs(
-        controllables: Controllables,
-        h5: h5py.File,
-        index: int,
-        current: typing.List[int],
-        c: Params,
-    ):
-        if index >= len(controllables):
-            if "image" in h5.keys():
-                c.append(tuple(current))
-            return
-        for key in sorted(h5.keys()):
-            current_ = copy.deepcopy(current)
-            current_.append(int(key))
-            _append_configs(controllables, h5[key], index + 1, current_, c)
 
-    index: int = 0
-    current: typing.List[int] = []
-    c: Params = []
-    _append_configs(controllables, h5, index, current, c)
+_Cache = typing.Union[DarkframeCache, SharedDarkframeCache]
+
+_T = typing.TypeVar("_T")
+
+# errors raised by h5py when reading a file while another process
+# writes it, and how many times (and after which delay in seconds)
+# reading a live library is attempted (see ImageLibrary._retry)
+_LIVE_ERRORS = (KeyError, OSError, RuntimeError, ValueError)
+_LIVE_ATTEMPTS = 5
+_LIVE_DELAY = 0.05
 
-    return c
+# group hosting a darkframe, darkframe dataset and camera configuration
+_Entry = typing.Tuple[h5py.Group, h5py.Dataset, typing.Dict]
 
 
 class ImageLibrary:
@@ -67,38 +68,230 @@ class ImageLibrary:
     Allows to access images in the library.
     """
 
-    def __init__(self, hdf5_path: Path, edit: bool = False) -> None:
+    def __init__(
+        self,
+        hdf5_path: Path,
+        edit: bool = False,
+        cache_size: int = 0,
+        interpolation_cache_size: int = 0,
+        cache: typing.Optional[_Cache] = None,
+        interpolation_cache: typing.Optional[_Cache] = None,
+        live: bool = False,
+    ) -> None:
 
         # path to the library file darkframes.hdf5
         self._path = hdf5_path
 
-        # handle to the content of the file
+        # handle to the content of the file (see the _file method),
+        # and the id of the process which opened it. Live libraries
+        # are open without file locking, so that they can be read
+        # while being created (see the refresh and _retry methods).
+        if edit and live:
+            raise ValueError(
+                "darkframes library: a library can not be both live and editable"
+            )
         self._edit = edit
-        if not edit:
-            self._h5 = h5py.File(hdf5_path, "r")
-        else:
-            self._h5 = h5py.File(hdf5_path, "a")
+        self._live = live
+        self._h5: typing.Optional[h5py.File] = None
+        self._pid: typing.Optional[int] = None
 
-        # List of control ranges used to create the file.
-        self._ranges: Ranges = eval(self._h5.attrs["controls"])
+        # darkframe groups, datasets and parsed camera configurations
+        # (populated lazily, see the _entry method)
+        self._entries: typing.Dict[Param, _Entry] = {}
 
-        # list of controllables covered by the library
-        self._controllables: Controllables = _get_controllables(self._ranges)
+        # number of frames of each darkframe of a live library, for
+        # detecting the darkframes updated in place by the process
+        # creating the library (see create_library.library and refresh)
+        self._frame_counts: typing.Dict[Param, typing.Optional[int]] = {}
 
-        # list of parameters for which a darframe is stored
-        self._params: Params = _get_params(self._h5, self._controllables)
+        # (the file is closed if the library can not be initialized)
+        try:
+            # List of control ranges used to create the file.
+            self._ranges: Ranges = eval(
+                self._retry(lambda: self._file().attrs["controls"])
+            )
 
-        # same as above, but as a matrix (row as params)
-        self._params_points: npt.ArrayLike = np.array(self._params)
+            # list of controllables covered by the library
+            self._controllables: Controllables = _get_controllables(self._ranges)
+
+            # list of parameters for which a darframe is stored
+            # (see _read_params)
+            self._params: Params = self._read_params()
+
+            # optional in memory cache of the darkframes (numpy arrays),
+            # cache_size being its budget in bytes (0: no cache), unless
+            # a cache is provided (e.g. a SharedDarkframeCache, for sharing
+            # darkframes between processes)
+            self._cache: typing.Optional[_Cache] = cache
+            if cache is None and cache_size > 0:
+                self._cache = DarkframeCache(cache_size)
+
+            # optional in memory cache of the darkframes generated
+            # by interpolation (see generate_darkframe), with its budget
+            # in bytes (0: no cache), unless a cache is provided
+            self._interpolation_cache: typing.Optional[_Cache] = interpolation_cache
+            if interpolation_cache is None and interpolation_cache_size > 0:
+                self._interpolation_cache = DarkframeCache(interpolation_cache_size)
+
+            # matrix version of the params, normalized params,
+            # spatial index and axis indexes (see _set_points)
+            self._params_points: npt.NDArray
+            self._min_params: typing.Tuple[int, ...]
+            self._max_params: typing.Tuple[int, ...]
+            self._normalized_points: npt.NDArray
+            self._tree: KDTree
+            self._axis_indexes: typing.Dict[int, AxisIndex]
+            self._set_points()
+
+            if live:
+                self._frame_counts = self._retry(self._read_frame_counts)
+        except BaseException:
+            self.close()
+            raise
+
+    def _set_points(self) -> None:
+        """
+        (Re)computes the matrix versions of the list of params
+        and the spatial indexes over them.
+        """
 
-        # min and max values for each controllables
-        self._min_params: typing.Tuple[int, ...] = tuple(
-            self._params_points.min(axis=0)
+        # same as above, but as a matrix (row as params)
+        self._params_points = np.array(self._params).reshape(
+            len(self._params), len(self._controllables)
         )
-        self._max_params: typing.Tuple[int, ...] = tuple(
-            self._params_points.max(axis=0)
+
+        # min and max values for each controllables (for a library
+        # which darkframes all have the same value for a controllable,
+        # e.g. a library being created, see the 'live' argument, max
+        # is set to min+1; for a library with no darkframe yet, min
+        # and max are 0 and 1)
+        if not self._params:
+            self._min_params = (0,) * len(self._controllables)
+            self._max_params = (1,) * len(self._controllables)
+        else:
+            self._min_params = tuple(self._params_points.min(axis=0))
+            self._max_params = tuple(
+                max_ if max_ > min_ else min_ + 1
+                for min_, max_ in zip(self._min_params, self._params_points.max(axis=0))
+            )
+
+        # same as _params_points, but normalized
+        # (see neighbors.normalize_points)
+        self._normalized_points = normalize_points(
+            self._params_points, self._min_params, self._max_params
         )
 
+        # spatial index over the normalized params, for
+        # nearest neighbors queries
+        self._tree = KDTree.build(self._params, self._normalized_points)
+
+        # for each controllable, index of the params for interpolation
+        # along this controllable (built lazily, see _axis_index)
+        self._axis_indexes = {}
+
+    def _open(self) -> None:
+        """
+        Opens the library file.
+        """
+        if self._live:
+            self._h5 = h5py.File(self._path, "r", locking=False)
+        else:
+            self._h5 = h5py.File(self._path, "a" if self._edit else "r")
+        self._pid = os.getpid()
+        # groups and datasets are bound to the previous handle
+        self._entries = {}
+
+    def _retry(self, read: typing.Callable[[], _T]) -> _T:
+        """
+        Returns read(). The file of a live library is written by another
+        process while being read, so that its content may be inconsistent
+        (hdf5 single writer / multiple readers mode does not support the
+        creation of new groups, i.e. new darkframes): for live libraries,
+        read is retried on the reopened file if it fails.
+        """
+        attempt = 1
+        while True:
+            try:
+                return read()
+            except _LIVE_ERRORS:
+                if not self._live or attempt == _LIVE_ATTEMPTS:
+                    raise
+            self.close()
+            time.sleep(_LIVE_DELAY)
+            attempt += 1
+
+    def _read_params(self) -> Params:
+        """
+        Returns the params for which a darkframe is stored, read from
+        the index of the file, or if the file has no index, by walking
+        through the groups of the file. For live libraries, darkframes
+        not fully written yet are ignored (they are added by a further
+        refresh).
+        """
+
+        def _read() -> Params:
+            index = h5.read_index(self._file())
+            if index is not None:
+                return index[0]
+            return _get_params(self._file(), self._controllables)
+
+        params = self._retry(_read)
+        if not self._live:
+            return params
+        complete: Params = []
+        for param in dict.fromkeys(params):
+            if param in self._frame_counts:
+                # already read by a previous refresh
+                complete.append(param)
+                continue
+            try:
+                self._entry(param)
+            except (ImageNotFoundError,) + _LIVE_ERRORS:
+                continue
+            complete.append(param)
+        return complete
+
+    def _file(self) -> h5py.File:
+        """
+        Returns the handle to the library file, (re)opening it if
+        required, i.e. after unpickling or in a forked process
+        (hdf5 handles can not be shared between processes).
+        """
+        self._check_process()
+        if self._h5 is None:
+            self._open()
+        return self._h5  # type: ignore
+
+    def _check_process(self) -> None:
+        # in a forked process, the handle (and datasets) of the parent can
+        # not be used, and its caches (which locks may have been held at
+        # fork time) are replaced by empty ones (shared caches handle
+        # forks on their own)
+        if self._pid is None or self._pid == os.getpid():
+            return
+        self._h5 = None
+        self._pid = None
+        self._entries = {}
+        if isinstance(self._cache, DarkframeCache):
+            self._cache = DarkframeCache(self._cache.max_bytes())
+        if isinstance(self._interpolation_cache, DarkframeCache):
+            self._interpolation_cache = DarkframeCache(
+                self._interpolation_cache.max_bytes()
+            )
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        # the file is reopened lazily by the process unpickling the library
+        if self._edit:
+            raise TypeError("can not pickle a darkframes library open in editable mode")
+        state = self.__dict__.copy()
+        state["_h5"] = None
+        state["_pid"] = None
+        state["_entries"] = {}
+        return state
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+        self.__dict__.update(state)
+
     def add(
         self,
         param: Param,
@@ -111,9 +304,14 @@ class ImageLibrary:
                 "can not add image to the darkframes library: it has not "
                 "been open in editable mode"
             )
-        r = h5.add(self._h5, param, img, camera_config, overwrite)
+        r = h5.add(self._file(), param, img, camera_config, overwrite)
         if r:
             self._params.append(param)
+            self._forget(param)
+            self._update_points()
+            self._tree.insert(
+                param, _normalize(param, self._min_params, self._max_params)
+            )
         return r
 
     def rm(self, param: Param) -> typing.Optional[ParamImage]:
@@ -122,11 +320,156 @@ class ImageLibrary:
                 "can not delete image to the darkframes library: it has not "
                 "been open in editable mode"
             )
-        r = h5.rm(self._h5, param)
+        r = h5.rm(self._file(), param)
         if r is not None:
             self._params.remove(param)
+            self._forget(param)
+            self._update_points()
+            self._tree.remove(param)
         return r
 
+    def _update_points(self) -> None:
+        """
+        Updates the matrix versions of the list of params
+        (to be called when a param is added or removed).
+        """
+        self._params_points = np.array(self._params).reshape(
+            len(self._params), len(self._controllables)
+        )
+        self._normalized_points = normalize_points(
+            self._params_points, self._min_params, self._max_params
+        )
+        self._axis_indexes.clear()
+
+    def _axis_index(self, free_index: int) -> AxisIndex:
+        try:
+            return self._axis_indexes[free_index]
+        except KeyError:
+            pass
+        axis_index = AxisIndex(self._params_points, free_index)
+        self._axis_indexes[free_index] = axis_index
+        return axis_index
+
+    def _forget(self, param: Param) -> None:
+        """
+        Discards what is known about the darkframe dataset
+        corresponding to param (to be called when the dataset
+        is added or removed).
+        """
+        self._entries.pop(param, None)
+        self._discard_cached(param)
+
+    def _discard_cached(self, param: Param) -> None:
+        """
+        Discards the cached arrays computed from the darkframe
+        corresponding to param.
+        """
+        if self._cache is not None:
+            self._cache.discard(param)
+            self._cache.discard(("variance", param))
+        if self._interpolation_cache is not None:
+            self._interpolation_cache.discard_if(lambda key: param in key[1])
+
+    def _entry(self, param: Param) -> _Entry:
+        """
+        Returns the group hosting the darkframe corresponding to param,
+        the darkframe dataset and the related camera configuration. The
+        first call for a given param opens the group by its path and
+        parses the camera configuration, further calls are a dictionary
+        lookup.
+        """
+        self._check_process()
+        try:
+            return self._entries[param]
+        except KeyError:
+            pass
+        # (not via the references of the index: h5py searches the
+        # whole file for the path of an object reached through a
+        # reference, e.g. when accessing its parent group)
+        try:
+            group = self._file()[h5.group_path(param)]
+            dataset = group["image"]
+        except KeyError:
+            if param in self._frame_counts:
+                # darkframe of a live library not found in the file
+                # being written (see _retry)
+                raise
+            raise ImageNotFoundError()
+        try:
+            config = eval(group.attrs["camera_config"])
+        except KeyError:
+            if self._live:
+                # darkframe of a live library not fully written yet
+                raise
+            config = {}
+        entry = (group, dataset, config)
+        self._entries[param] = entry
+        return entry
+
+    def rebuild_index(self) -> int:
+        """
+        (Re)writes the index of the library, i.e. the root level
+        datasets listing the parameters and the darkframes they
+        correspond to. Useful for files created with an older version
+        of h5darkframes, which are slower to open. Returns the number
+        of indexed darkframes.
+        """
+        if not self._edit:
+            raise RuntimeError(
+                "can not index the darkframes library: it has not "
+                "been open in editable mode"
+            )
+        self._params = h5.rebuild_index(self._file(), len(self._controllables))
+        return len(self._params)
+
+    def refresh(self) -> Params:
+        """
+        Reopens the library file and adds the params for which
+        darkframes have been added since the file was open (e.g. by
+        the process creating the library, see create_library.library).
+        Returns these new params. For live libraries, darkframes not
+        fully written yet are ignored (until a further refresh), and the
+        cached darkframes which have been updated since (see the top_up
+        argument of create_library.library) are discarded.
+        """
+        if self._edit:
+            raise RuntimeError(
+                "can not refresh the darkframes library: it has been "
+                "open in editable mode"
+            )
+        self.close()
+        params = self._read_params()
+        known = set(self._params)
+        new_params = [param for param in params if param not in known]
+        if new_params:
+            self._params.extend(new_params)
+            self._set_points()
+            # the normalization of the params may have changed
+            if self._interpolation_cache is not None:
+                self._interpolation_cache.clear()
+        if self._live:
+            # darkframes topped up since the previous refresh
+            frame_counts = self._retry(self._read_frame_counts)
+            for param, count in frame_counts.items():
+                if param in self._frame_counts and self._frame_counts[param] != count:
+                    self._discard_cached(param)
+            self._frame_counts = frame_counts
+        return new_params
+
+    def _read_frame_counts(self) -> typing.Dict[Param, typing.Optional[int]]:
+        # read from the index of the file, or if the index does not
+        # store them (older versions of h5darkframes), from the groups
+        # of the darkframes
+        indexed = h5.read_index_nb_frames(self._file())
+        if indexed is not None:
+            return {param: indexed.get(param) for param in self._params}
+        frame_counts: typing.Dict[Param, typing.Optional[int]] = {}
+        for param in self._params:
+            group, _, _ = self._entry(param)
+            count = group.attrs.get("nb_frames")
+            frame_counts[param] = None if count is None else int(count)
+        return frame_counts
+
     def params(self) -> Params:
         return self._params
 
@@ -154,93 +497,356 @@ class ImageLibrary:
         library.
         """
         try:
-            return self._h5.attrs["name"]
+            return self._file().attrs["name"]
         except KeyError:
             return "(not named)"
 
+    def _param(self, controls: typing.Union[Param, typing.Dict[str, int]]) -> Param:
+        """
+        Returns the controls as a param, i.e. a tuple of values ordered
+        as the controllables of the library.
+        """
+        if isinstance(controls, dict):
+            return tuple(
+                [controls[controllable] for controllable in self._controllables]
+            )
+        return tuple(controls)
+
+    def cache_stats(self) -> typing.Optional[CacheStats]:
+        """
+        Returns the hits/misses/evictions counters of the darkframes
+        cache, or None if the library has been open without cache.
+        """
+        self._check_process()
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    def interpolation_cache_stats(self) -> typing.Optional[CacheStats]:
+        """
+        Returns the hits/misses/evictions counters of the generated
+        darkframes cache, or None if the library has been open
+        without such cache.
+        """
+        self._check_process()
+        if self._interpolation_cache is None:
+            return None
+        return self._interpolation_cache.stats()
+
+    def _read(
+        self, key: typing.Hashable, dataset: h5py.Dataset, nparray: bool
+    ) -> npt.ArrayLike:
+        # converting the h5py dataset to a (possibly cached) numpy array
+        if not nparray:
+            return dataset
+        if self._cache is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+        array = np.empty(dataset.shape, dataset.dtype)
+        dataset.read_direct(array)
+        if self._cache is not None:
+            array = self._cache.put(key, array)
+        return array
+
+    @typing.overload
+    def get(
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        nparray: bool = ...,
+        with_variance: typing.Literal[False] = ...,
+    ) -> typing.Tuple[npt.ArrayLike, typing.Dict]:
+        pass
+
+    @typing.overload
+    def get(
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        nparray: bool = ...,
+        *,
+        with_variance: typing.Literal[True],
+    ) -> typing.Tuple[npt.ArrayLike, typing.Dict, typing.Optional[npt.ArrayLike]]:
+        pass
+
     def get(
         self,
         controls: typing.Union[Param, typing.Dict[str, int]],
         nparray: bool = True,
-    ) -> typing.Tuple[npt.ArrayLike, typing.Dict]:
+        with_variance: bool = False,
+    ) -> typing.Union[
+        typing.Tuple[npt.ArrayLike, typing.Dict],
+        typing.Tuple[npt.ArrayLike, typing.Dict, typing.Optional[npt.ArrayLike]],
+    ]:
+        """
+        Returns the darkframe corresponding to the controls and the
+        configuration of the camera when it was taken. If nparray is
+        False, the darkframe is returned as a h5py dataset.
+        If the library has been open with a cache, the returned
+        arrays are read-only.
+        If with_variance is True, the per-pixel variance of the frames
+        the darkframe has been computed from is returned as well (None
+        if the library does not store it, see stacking.Stacking).
+        """
 
-        if isinstance(controls, dict):
-            params = tuple(
-                [controls[controllable] for controllable in self._controllables]
-            )
-        else:
-            params = controls
+        param = self._param(controls)
+        return self._retry(lambda: self._get(param, nparray, with_variance))
+
+    def _get(
+        self, param: Param, nparray: bool, with_variance: bool
+    ) -> typing.Union[
+        typing.Tuple[npt.ArrayLike, typing.Dict],
+        typing.Tuple[npt.ArrayLike, typing.Dict, typing.Optional[npt.ArrayLike]],
+    ]:
+        group, dataset, config = self._entry(param)
+        image = self._read(param, dataset, nparray)
+        if not with_variance:
+            return image, dict(config)
+        try:
+            variance = group["variance"]
+        except KeyError:
+            return image, dict(config), None
+        return image, dict(config), self._read(("variance", param), variance, nparray)
 
-        closest = False
-        return get_image(params, self._h5, nparray, closest)
+    def nb_frames(
+        self, controls: typing.Union[Param, typing.Dict[str, int]]
+    ) -> typing.Optional[int]:
+        """
+        Returns the number of frames the darkframe corresponding to
+        the controls has been computed from (None for libraries created
+        by older versions of h5darkframes, which do not store it).
+        """
+        group, _, _ = self._entry(self._param(controls))
+        try:
+            return int(group.attrs["nb_frames"])
+        except KeyError:
+            return None
 
     def get_closest(
         self,
         controls: typing.Union[Param, typing.Dict[str, int]],
     ) -> Param:
-        if isinstance(controls, dict):
-            params = tuple(
-                [controls[controllable] for controllable in self._controllables]
-            )
-        else:
-            params = controls
+        """
+        Returns the param of the library the closest to the controls.
+        """
+        return self.get_k_closest(controls, 1)[0]
 
-        return closest_neighbors(
-            self._params, self._min_params, self._max_params, params, nb_closest=1
-        )[0]
+    def get_k_closest(
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        k: int,
+    ) -> Params:
+        """
+        Returns the (up to) k params of the library the closest to the
+        controls, closest first. If the library has a darkframe for the
+        controls, only the corresponding param is returned.
+        """
+        params = self._param(controls)
+        if params in self._tree:
+            return [params]
+        ntarget = _normalize(params, self._min_params, self._max_params)
+        return [param for param, _ in self._tree.nearest(ntarget, k=k)]
+
+    def get_within(
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        radius: float,
+    ) -> Params:
+        """
+        Returns the params of the library which distance to the controls
+        is lower or equal to radius, closest first. Distances are computed
+        over normalized values (i.e. the min and max value of each
+        controllable are mapped to 0 and 1).
+        """
+        params = self._param(controls)
+        ntarget = _normalize(params, self._min_params, self._max_params)
+        return [param for param, _ in self._tree.within(ntarget, radius)]
 
     def get_neighbors(
         self, controls: typing.Union[Param, typing.Dict[str, int]]
     ) -> Params:
-
-        if isinstance(controls, dict):
-            params = tuple(
-                [controls[controllable] for controllable in self._controllables]
-            )
-        else:
-            params = controls
-
-        neighbors: Params = get_neighbors(
-            self._params, self._min_params, self._max_params, params
-        )
+        """
+        Returns the params of the library framing the controls along one
+        of the controllables (see neighbors.get_neighbors).
+        """
+        params = self._param(controls)
+        if params in self._tree:
+            return [params]
+
+        ntarget = _normalize(params, self._min_params, self._max_params)
+        candidate_sets: typing.List[typing.List[Neighbor]] = []
+        for index in range(len(params)):
+            candidate_set: typing.List[Neighbor] = []
+            for upper in (True, False):
+                candidate_set.extend(
+                    self._tree.nearest(ntarget, k=1, axis=index, upper=upper)
+                )
+            candidate_sets.append(candidate_set)
+
+        neighbors: Params = select_neighbors(candidate_sets)
 
         return neighbors
 
     def get_interpolation_neighbors(
-        self, controls: typing.Union[Param, typing.Dict[str, int]], fixed_index: int = 1
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        fixed_index: int = 1,
+        free_index: typing.Optional[int] = None,
     ) -> Params:
-        if isinstance(controls, dict):
-            params = tuple(
-                [controls[controllable] for controllable in self._controllables]
-            )
-        else:
-            params = controls
+        """
+        Returns the params which values are the same as the controls for
+        all controllables but the one of index free_index, and which
+        value for this controllable is the closest above and below
+        the one of the controls. For two dimensional libraries,
+        free_index may be left to None, in which case the controllable
+        of index fixed_index is kept fixed and the other one is free.
+        Raises a ValueError if there is no such params.
+        """
+        params = self._param(controls)
+
+        if free_index is None:
+            if len(params) != 2:
+                raise ValueError(
+                    "darkframes: 'interpolation neighbors' requires "
+                    f"two dimentional parameters, not {len(params)} "
+                    "(unless the index of the free controllable is specified)"
+                )
+            free_index = 0 if fixed_index == 1 else 1
 
-        neighbors: Params = interpolation_neighbors(self._params, params, fixed_index)
+        neighbors: Params = self._axis_index(free_index).neighbors(params)
 
         return neighbors
 
+    def get_neighbors_many(self, params_array: npt.ArrayLike) -> typing.List[Params]:
+        """
+        Same as get_neighbors, for several params at once (one per row
+        of params_array, in the order of the controllables). Returns
+        the list of neighbors of each row.
+        """
+        targets = np.asarray(params_array, dtype=np.int64).reshape(
+            -1, len(self._controllables)
+        )
+        unique_targets, inverse = np.unique(targets, axis=0, return_inverse=True)
+        neighbors = get_neighbors_many(
+            self._params_points,
+            self._normalized_points,
+            self._min_params,
+            self._max_params,
+            unique_targets,
+        )
+        return [neighbors[index] for index in inverse.reshape(-1)]
+
+    def generate_darkframes_many(
+        self,
+        params_array: npt.ArrayLike,
+        dtype: typing.Optional[npt.DTypeLike] = None,
+    ) -> typing.Generator[typing.Tuple[Param, npt.ArrayLike], None, None]:
+        """
+        Generates the darkframes for several params at once (one per row
+        of params_array, in the order of the controllables), using their
+        neighbors (see get_neighbors). Identical params are processed
+        only once, and each darkframe of the library is read only once.
+        Yields the params (in increasing order) and the corresponding
+        darkframes. Darkframes read from the library are kept in memory
+        only as long as some of the remaining params need them.
+        """
+        targets = np.asarray(params_array, dtype=np.int64).reshape(
+            -1, len(self._controllables)
+        )
+        unique_targets = np.unique(targets, axis=0)
+        neighbors = get_neighbors_many(
+            self._params_points,
+            self._normalized_points,
+            self._min_params,
+            self._max_params,
+            unique_targets,
+        )
+
+        # number of remaining params requiring each darkframe
+        nb_uses: typing.Dict[Param, int] = {}
+        for target_neighbors in neighbors:
+            for neighbor in target_neighbors:
+                nb_uses[neighbor] = nb_uses.get(neighbor, 0) + 1
+
+        loaded: ParamImages = {}
+        nparray = True
+
+        for row, target_neighbors in zip(unique_targets, neighbors):
+            params = tuple([int(v) for v in row])
+            for neighbor in target_neighbors:
+                if neighbor not in loaded:
+                    loaded[neighbor] = self.get(neighbor, nparray)
+            if target_neighbors == [params]:
+                image, _ = loaded[params]
+                if dtype is not None:
+                    darkframe = image.astype(dtype)  # type: ignore
+                elif nb_uses[params] > 1:
+                    # the darkframe is used for generating the next ones,
+                    # the caller may modify the yielded one
+                    darkframe = np.array(image)
+                else:
+                    darkframe = image
+            else:
+                darkframe = average_neighbors(
+                    params,
+                    self._min_params,
+                    self._max_params,
+                    {neighbor: loaded[neighbor] for neighbor in target_neighbors},
+                    dtype=dtype,
+                )
+            for neighbor in target_neighbors:
+                nb_uses[neighbor] -= 1
+                if nb_uses[neighbor] == 0:
+                    del loaded[neighbor]
+            yield params, darkframe
+
     def generate_darkframe(
-        self, controls: typing.Union[Param, typing.Dict[str, int]], neighbors: Params
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        neighbors: Params,
+        dtype: typing.Optional[npt.DTypeLike] = None,
+        engine: typing.Optional[TiledEngine] = None,
     ) -> npt.ArrayLike:
+        """
+        Returns the average of the darkframes of the neighbors,
+        weighted by their distance to the controls. The darkframe
+        is of type dtype (if None, of the type of the darkframes
+        of the library). If the library has been open with an
+        interpolation cache, the returned array is read-only.
+        If an engine is provided, the average is computed over
+        several threads.
+        """
 
-        if isinstance(controls, dict):
-            params = tuple(
-                [controls[controllable] for controllable in self._controllables]
-            )
-        else:
-            params = controls
+        params = self._param(controls)
+
+        key = (
+            params,
+            tuple(sorted(tuple(n) for n in neighbors)),
+            None if dtype is None else np.dtype(dtype).str,
+        )
+        self._check_process()
+        if self._interpolation_cache is not None:
+            cached = self._interpolation_cache.get(key)
+            if cached is not None:
+                return cached
 
         nparray = True
         neighbor_images = {
             neighbor: self.get(neighbor, nparray) for neighbor in neighbors
         }
-        return average_neighbors(
-            params, self._min_params, self._max_params, neighbor_images
+        average = average_neighbors if engine is None else engine.average_neighbors
+        darkframe = average(
+            params, self._min_params, self._max_params, neighbor_images, dtype=dtype
         )
 
+        if self._interpolation_cache is not None:
+            darkframe = self._interpolation_cache.put(key, darkframe)
+        return darkframe
+
     def close(self) -> None:
-        self._h5.close()
+        # a handle inherited from the parent process is not closed
+        if self._h5 is not None and self._pid == os.getpid():
+            self._h5.close()
+        self._h5 = None
 
     def __enter__(self):
         return self
@@ -14,6 +14,9 @@ from .image_stats import ImageStats
 from . import executables
 from .fuse_libraries import fuse_libraries
 from . import validation
+from . import calibrate
+from . import watch
+from . import server
 from .substract import substract
 
 
@@ -98,6 +101,18 @@ def asi_zwo_darkframes_library():
         ),
     )
 
+    # the user may require the darkframes of an existing
+    # library to be computed from more images
+    parser.add_argument(
+        "--top-up",
+        action="store_true",
+        help=str(
+            "add to the darkframes of the existing library the pictures "
+            "required to reach the 'average_over' value of the configuration "
+            "file (see the 'top_up' argument of h5darkframes.library)"
+        ),
+    )
+
     args = parser.parse_args()
 
     if args.fileformat:
@@ -116,7 +131,13 @@ def asi_zwo_darkframes_library():
     # creating the library
     progress_bar = True
     path = executables.darkframes_library(
-        camera_class, args.name, progress_bar, directory, fileformat, **camera_kwargs
+        camera_class,
+        args.name,
+        progress_bar,
+        directory,
+        fileformat,
+        top_up=args.top_up,
+        **camera_kwargs,
     )
 
     # informing user
@@ -301,6 +322,16 @@ def darkframes_info():
             _darkframes_info_pretty(library)
 
 
+@execute
+def darkframes_index():
+
+    path = executables.get_darkframes_path()
+    with ImageLibrary(path, edit=True) as il:
+        nb_pics = il.rebuild_index()
+
+    print(f"indexed {nb_pics} darkframe(s) in {path}")
+
+
 @execute
 def darkframes_neighbors():
 
@@ -396,6 +427,209 @@ def darkframes_substract():
     print(f"darkframe substracted image saved in {sub_path}")
 
 
+@execute
+def darkframes_calibrate():
+
+    parser = argparse.ArgumentParser(
+        description=str(
+            "substracts darkframes (from the library darkframes.hdf5 of the "
+            "current directory) from all light frames (npy or tiff files) "
+            "of a directory"
+        )
+    )
+    parser.add_argument(
+        "--input", type=str, required=True, help="directory of the light frames"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=False,
+        help="directory into which calibrated frames are written "
+        "(default: subfolder 'calibrated' of the input directory)",
+    )
+    parser.add_argument(
+        "--pattern",
+        type=str,
+        required=False,
+        help=str(
+            "regular expression for reading the controllable values from the "
+            "frame file names, with the controllables as named groups, e.g. "
+            "'TargetTemp_(?P<TargetTemp>-?\\d+)_Exposure_(?P<Exposure>\\d+)' "
+            "(the default). Ignored for frames with a toml sidecar file."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        help="number of threads substracting the darkframes",
+    )
+    args = parser.parse_args()
+
+    input_dir = Path(args.input)
+    if not input_dir.is_dir():
+        raise FileNotFoundError(f"failed to find the directory {input_dir}")
+    output_dir = Path(args.output) if args.output else input_dir / "calibrated"
+    if output_dir.resolve() == input_dir.resolve():
+        raise ValueError("the output directory must differ from the input directory")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    frames = calibrate.list_frames(input_dir)
+    if not frames:
+        raise FileNotFoundError(f"failed to find any frame file in {input_dir}")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(levelname)s] %(asctime)s | %(name)s |  %(message)s",
+        datefmt="%d-%b-%y %H:%M:%S",
+    )
+
+    with ImageLibrary(executables.get_darkframes_path()) as il:
+        report = calibrate.calibrate(
+            il, frames, output_dir, pattern=args.pattern, workers=args.workers
+        )
+
+    print(report)
+    print(f"calibrated frames saved in {output_dir}")
+
+
+@execute
+def darkframes_watch():
+
+    parser = argparse.ArgumentParser(
+        description=str(
+            "watches a directory and substracts darkframes (from the library "
+            "darkframes.hdf5 of the current directory) from the light frames "
+            "(npy or tiff files) as soon as they are written into it"
+        )
+    )
+    parser.add_argument("--input", type=str, required=True, help="directory to watch")
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=False,
+        help="directory into which calibrated frames are written "
+        "(default: subfolder 'calibrated' of the input directory)",
+    )
+    parser.add_argument(
+        "--pattern",
+        type=str,
+        required=False,
+        help=str(
+            "regular expression for reading the controllable values from the "
+            "frame file names (see darkframes-calibrate)"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        required=False,
+        default=2,
+        help="number of threads calibrating the frames (default: 2)",
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        required=False,
+        default=0.5,
+        help="time (in seconds) between two scans of the directory (default: 0.5)",
+    )
+    parser.add_argument(
+        "--cache",
+        type=int,
+        required=False,
+        default=512,
+        help="memory (in MB) for caching darkframes (default: 512)",
+    )
+    parser.add_argument(
+        "--report",
+        type=float,
+        required=False,
+        default=60.0,
+        help="time (in seconds) between two reports of latency and queue depth",
+    )
+    args = parser.parse_args()
+
+    input_dir = Path(args.input)
+    if not input_dir.is_dir():
+        raise FileNotFoundError(f"failed to find the directory {input_dir}")
+    output_dir = Path(args.output) if args.output else input_dir / "calibrated"
+    if output_dir.resolve() == input_dir.resolve():
+        raise ValueError("the output directory must differ from the input directory")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(levelname)s] %(asctime)s | %(name)s |  %(message)s",
+        datefmt="%d-%b-%y %H:%M:%S",
+    )
+
+    # half of the memory for darkframes read from the library,
+    # the other half for generated ones
+    cache_size = args.cache * 1024 * 1024 // 2
+    with ImageLibrary(
+        executables.get_darkframes_path(),
+        cache_size=cache_size,
+        interpolation_cache_size=cache_size,
+    ) as il:
+        watcher = watch.WatchFolder(
+            il,
+            input_dir,
+            output_dir,
+            pattern=args.pattern,
+            workers=args.workers,
+            poll_period=args.poll,
+            report_period=args.report,
+        )
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            print("stopped")
+
+
+@execute
+def darkframes_serve():
+
+    parser = argparse.ArgumentParser(
+        description=str(
+            "serves the darkframes of the library darkframes.hdf5 of the "
+            "current directory to other processes (see "
+            "h5darkframes.server.DarkframeClient)"
+        )
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        required=False,
+        default="darkframes.sock",
+        help="path to the Unix domain socket (default: darkframes.sock)",
+    )
+    parser.add_argument(
+        "--cache",
+        type=int,
+        required=False,
+        default=512,
+        help="memory (in MB) for the shared darkframes (default: 512)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(levelname)s] %(asctime)s | %(name)s |  %(message)s",
+        datefmt="%d-%b-%y %H:%M:%S",
+    )
+
+    with ImageLibrary(executables.get_darkframes_path()) as il:
+        with server.DarkframeServer(
+            il, Path(args.socket), args.cache * 1024 * 1024
+        ) as darkframe_server:
+            print(f"serving darkframes on {args.socket}")
+            try:
+                darkframe_server.serve_forever()
+            except KeyboardInterrupt:
+                print("stopped")
+
+
 @execute
 def darkframes_display():
 
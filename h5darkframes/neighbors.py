@@ -1,5 +1,6 @@
 import math
 import typing
+import numpy as np
 from numpy import typing as npt
 from .h5types import ParamImages, Param, NParam, Params, ParamMap
 
@@ -19,9 +20,78 @@ def _distance(v1: NParam, v2: NParam) -> float:
     return math.sqrt(sum([(a - b) ** 2 for a, b in zip(v1, v2)]))
 
 
+class AxisIndex:
+    """
+    Index of params for interpolation along one of the controllables
+    (the 'free' controllable): maps the values of all the other
+    controllables to the sorted array of the values of the free
+    controllable for which there is a param. Allows to find the
+    interpolation neighbors of a target with a binary search.
+    """
+
+    def __init__(self, points: npt.NDArray, free_index: int) -> None:
+        self._free_index = free_index
+        self._others = [i for i in range(points.shape[1]) if i != free_index]
+        self._values: typing.Dict[Param, npt.NDArray] = {}
+        if points.shape[0] == 0:
+            return
+        # sorting by the other controllables, then by the free one
+        keys = [points[:, i] for i in reversed(self._others)]
+        order = np.lexsort([points[:, free_index]] + keys)
+        others = points[order][:, self._others]
+        values = points[order][:, free_index]
+        # splitting where the values of the other controllables change
+        changes = np.flatnonzero(np.any(others[1:] != others[:-1], axis=1)) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.concatenate((changes, [others.shape[0]]))
+        for start, end in zip(starts, ends):
+            key = tuple([int(v) for v in others[start]])
+            self._values[key] = values[start:end]
+
+    def _param(self, key: Param, value: int) -> Param:
+        param = list(key)
+        param.insert(self._free_index, int(value))
+        return tuple(param)
+
+    def neighbors(self, target_values: Param) -> Params:
+        """
+        Returns the params which values for all the controllables but
+        the free one are the same as the target, and which value for the
+        free controllable is the closest above (first) and below (second)
+        the one of the target. If the target is a param, only the
+        target is returned.
+        """
+        key = tuple([target_values[i] for i in self._others])
+        try:
+            values = self._values[key]
+        except KeyError:
+            raise ValueError(
+                f"failed to find neighbors for {target_values}, no existing darkframe "
+                f"associated to value(s) {key}"
+            )
+        target = target_values[self._free_index]
+        index = int(np.searchsorted(values, target, side="left"))
+        if index < values.shape[0] and values[index] == target:
+            return [tuple(target_values)]
+        if values.shape[0] == 1:
+            return [self._param(key, values[0])]
+        neighbors: Params = []
+        if index < values.shape[0]:
+            neighbors.append(self._param(key, values[index]))
+        if index > 0:
+            neighbors.append(self._param(key, values[index - 1]))
+        return neighbors
+
+
 def interpolation_neighbors(
     params: Params, target_values: Param, fixed_index: int
 ) -> Params:
+    """
+    Returns the params which value for the controllable of index
+    fixed_index is the same as the target, and which value for the
+    other controllable is the closest above and below the one of the
+    target (two dimensional params only, see AxisIndex).
+    """
 
     if len(target_values) != 2:
         raise ValueError(
@@ -29,43 +99,9 @@ def interpolation_neighbors(
             f"two dimentional parameters, not {len(target_values)}"
         )
 
-    try:
-        index = params.index(target_values)
-    except ValueError:
-        pass
-    else:
-        return [params[index]]
-
-    subset = [p for p in params if p[fixed_index] == target_values[fixed_index]]
-
-    if not subset:
-        raise ValueError(
-            f"failed to find neighbors for {target_values}, no existing darkframe "
-            f"associated to value {target_values[fixed_index]}"
-        )
-
-    if len(subset) == 1:
-        return subset
-
-    other_index = 0 if fixed_index == 1 else 1
-
-    neighbors: Params = []
-
-    sup = sorted(
-        [s for s in subset if s[other_index] >= target_values[other_index]],
-        key=lambda p: abs(p[other_index] - target_values[other_index]),
-    )
-    if sup:
-        neighbors.append(sup[0])
-
-    sdown = sorted(
-        [s for s in subset if s[other_index] < target_values[other_index]],
-        key=lambda p: abs(p[other_index] - target_values[other_index]),
-    )
-    if sdown:
-        neighbors.append(sdown[0])
-
-    return neighbors
+    free_index = 0 if fixed_index == 1 else 1
+    points = np.array(params, dtype=np.int64).reshape(len(params), 2)
+    return AxisIndex(points, free_index).neighbors(target_values)
 
 
 def closest_neighbors(
@@ -157,47 +193,247 @@ def get_neighbors(
     return _select_set(candidate_sets, distances)
 
 
-def average_neighbors(
-    target_values: typing.Tuple[int, ...],
-    min_values: typing.Tuple[int, ...],
-    max_values: typing.Tuple[int, ...],
-    images: ParamImages,
-) -> npt.ArrayLike:
-    def _normalize(
-        values: typing.Tuple[int, ...],
-        min_values: typing.Tuple[int, ...],
-        max_values: typing.Tuple[int, ...],
-    ) -> typing.Tuple[float, ...]:
-        return tuple(
-            [
-                ((v - min_) / (max_ - min_))
-                for v, min_, max_ in zip(values, min_values, max_values)
-            ]
+def normalize_points(
+    points: npt.NDArray, min_values: Param, max_values: Param
+) -> npt.NDArray:
+    """
+    Array version of _normalize: returns the normalized version of the
+    points (one param per row).
+    """
+    min_ = np.array(min_values)
+    range_ = np.array(max_values) - min_
+    if np.any(range_ == 0):
+        raise ZeroDivisionError(
+            "darkframes: can not normalize parameters, the min and max values "
+            f"of a controllable are equal (min: {min_values}, max: {max_values})"
+        )
+    return (points - min_) / range_
+
+
+def _distances(npoints: npt.NDArray, ntarget_values: NParam) -> npt.NDArray:
+    """
+    Array version of _distance: returns the distances between
+    each normalized point and the normalized target.
+    """
+    # accumulating column by column, in the same order as
+    # _distance, so that the results are identical
+    squared = np.zeros(npoints.shape[0], dtype=np.float64)
+    for index, target in enumerate(ntarget_values):
+        squared += (npoints[:, index] - target) ** 2
+    return np.sqrt(squared)
+
+
+def _row_param(points: npt.NDArray, row: int) -> Param:
+    return tuple([int(v) for v in points[row]])
+
+
+def get_neighbors_many(
+    points: npt.NDArray,
+    npoints: npt.NDArray,
+    min_values: Param,
+    max_values: Param,
+    targets: npt.NDArray,
+    chunk_size: int = 1_000_000,
+) -> typing.List[Params]:
+    """
+    Same as get_neighbors, but based on the params as a matrix (one
+    row per param) and its normalized version (see normalize_points),
+    for several targets (one per row of targets). Distances are computed
+    for chunks of targets at once, chunk_size being the max number of
+    (target, param) distances computed in one go.
+    """
+
+    if points.shape[0] == 0:
+        return [[] for _ in range(targets.shape[0])]
+
+    ntargets = normalize_points(targets, min_values, max_values)
+    rows_per_chunk = max(1, chunk_size // max(1, points.shape[0]))
+
+    r: typing.List[Params] = []
+
+    for start in range(0, targets.shape[0], rows_per_chunk):
+
+        chunk = targets[start : start + rows_per_chunk]
+        nchunk = ntargets[start : start + rows_per_chunk]
+
+        # targets for which the library has a darkframe
+        equal = np.all(points[np.newaxis, :, :] == chunk[:, np.newaxis, :], axis=2)
+        found = equal.any(axis=1)
+        found_rows = equal.argmax(axis=1)
+
+        # distances between all targets of the chunk and all params
+        # (accumulated in the same order as _distances)
+        squared = np.zeros((chunk.shape[0], points.shape[0]), dtype=np.float64)
+        for index in range(points.shape[1]):
+            squared += (
+                npoints[np.newaxis, :, index] - nchunk[:, index, np.newaxis]
+            ) ** 2
+        distances = np.sqrt(squared)
+
+        # for each controllable, the closest params above and below the targets
+        # (for each target: whether such a param exists, and its row)
+        sides: typing.List[
+            typing.Tuple[npt.NDArray[np.bool_], npt.NDArray[np.intp]]
+        ] = []
+        for index in range(points.shape[1]):
+            for sign in (True, False):
+                if sign is True:
+                    mask = npoints[np.newaxis, :, index] >= nchunk[:, index, np.newaxis]
+                else:
+                    mask = npoints[np.newaxis, :, index] < nchunk[:, index, np.newaxis]
+                masked = np.where(mask, distances, np.inf)
+                exists: npt.NDArray[np.bool_] = np.any(mask, axis=1)
+                closest: npt.NDArray[np.intp] = np.argmin(masked, axis=1)
+                sides.append((exists, closest))
+
+        for row in range(chunk.shape[0]):
+            if found[row]:
+                r.append([_row_param(points, int(found_rows[row]))])
+                continue
+            candidate_sets: typing.List[typing.List[typing.Tuple[Param, float]]] = []
+            for index in range(points.shape[1]):
+                candidate_set: typing.List[typing.Tuple[Param, float]] = []
+                for exists, closest in sides[2 * index : 2 * index + 2]:
+                    if exists[row]:
+                        prow = int(closest[row])
+                        candidate_set.append(
+                            (_row_param(points, prow), distances[row, prow])
+                        )
+                candidate_sets.append(candidate_set)
+            r.append(select_neighbors(candidate_sets))
+
+    return r
+
+
+def select_neighbors(
+    candidate_sets: typing.Sequence[typing.Sequence[typing.Tuple[Param, float]]],
+) -> Params:
+    """
+    Given for each controllable the set of neighbors (and their distances
+    to the target) framing the target along this controllable,
+    returns the largest set (if several, the one which neighbors are
+    the closest to the target on average). See get_neighbors.
+    """
+    max_length = max([len(cs) for cs in candidate_sets])
+    lsets = [cs for cs in candidate_sets if len(cs) == max_length]
+    if len(lsets) > 1:
+        lsets = sorted(
+            lsets, key=lambda cs: sum([distance for _, distance in cs]) / len(cs)
         )
+    return [param for param, _ in lsets[0]]
+
+
+def inverse_distance_weights(
+    target_values: Param,
+    min_values: Param,
+    max_values: Param,
+    params: typing.Iterable[Param],
+) -> typing.Dict[Param, float]:
+    """
+    Returns for each param its weight for interpolating the target,
+    i.e. the inverse of its (normalized) distance to the target,
+    normalized so that the weights sum to one.
+    """
 
     normalized: typing.Dict[Param, NParam]
     normalized = {
-        values: _normalize(values, min_values, max_values) for values in images.keys()
+        values: _normalize(values, min_values, max_values) for values in params
     }
 
     normalized_target = _normalize(target_values, min_values, max_values)
 
-    inv_distances: typing.Dict[NParam, float]
+    inv_distances: typing.Dict[Param, float]
     inv_distances = {
-        values: 1.0 / _distance(normalized_target, normalized[values])
-        for values in images.keys()
+        values: 1.0 / _distance(normalized_target, nvalues)
+        for values, nvalues in normalized.items()
     }
 
     sum_distances = sum(inv_distances.values())
 
-    inv_distances = {values: d / sum_distances for values, d in inv_distances.items()}
+    return {values: d / sum_distances for values, d in inv_distances.items()}
 
-    r: npt.ArrayLike
 
-    for values, (image, _) in images.items():
-        d = inv_distances[values]
-        try:
-            r += d * image  # type: ignore
-        except NameError:
-            r = d * image  # type: ignore
-    return r.astype(image.dtype)  # type: ignore
+def average_neighbors(
+    target_values: typing.Tuple[int, ...],
+    min_values: typing.Tuple[int, ...],
+    max_values: typing.Tuple[int, ...],
+    images: ParamImages,
+    dtype: typing.Optional[npt.DTypeLike] = None,
+    out: typing.Optional[npt.NDArray] = None,
+    accumulator: typing.Optional[npt.DTypeLike] = None,
+) -> npt.NDArray:
+    """
+    Returns the average of the images, weighted by the inverse
+    of their (normalized) distance to the target. The returned
+    array is of type dtype (if None, of the type of out if provided,
+    of the type of the images otherwise). If out is provided, the
+    result is written into it (and out is returned).
+
+    The weighted sum is computed in place in an array of type
+    accumulator (if None, float32, or float64 if float32 can not
+    represent the values of the images). For integer types, the result
+    is rounded to the closest integer.
+
+    Peak memory: besides the images and the returned array, one array
+    of type accumulator (the sum) and, if there are several images,
+    one more (the weighted image being added). No extra memory is
+    used for the sum if out is of type accumulator.
+    For a 4144x2822 sensor and float32 accumulation, this is 2 x 47MB
+    for any number of images.
+    """
+
+    weights = inverse_distance_weights(
+        target_values, min_values, max_values, images.keys()
+    )
+
+    arrays = [(values, image) for values, (image, _) in images.items()]
+    shape = arrays[0][1].shape  # type: ignore
+
+    if dtype is None:
+        dtype = out.dtype if out is not None else arrays[0][1].dtype  # type: ignore
+    dtype = np.dtype(dtype)
+    if accumulator is None:
+        accumulator = np.result_type(np.float32, arrays[0][1].dtype)  # type: ignore
+    accumulator = np.dtype(accumulator)
+
+    if out is not None:
+        if out.shape != shape:
+            raise ValueError(
+                f"average neighbors: output array of shape {out.shape}, "
+                f"expected {shape}"
+            )
+        if out.dtype != dtype:
+            raise ValueError(
+                f"average neighbors: output array of type {out.dtype}, "
+                f"expected {dtype}"
+            )
+
+    r: npt.NDArray
+    if out is not None and out.dtype == accumulator:
+        r = out
+    else:
+        r = np.empty(shape, dtype=accumulator)
+
+    scalar = typing.cast(typing.Type[np.floating], accumulator.type)
+    weighted: typing.Optional[npt.NDArray] = None
+    for index, (values, image) in enumerate(arrays):
+        weight = scalar(weights[values])
+        if index == 0:
+            np.multiply(image, weight, out=r, casting="unsafe")
+        else:
+            if weighted is None:
+                weighted = np.empty_like(r)
+            np.multiply(image, weight, out=weighted, casting="unsafe")
+            np.add(r, weighted, out=r)
+
+    if r is out:
+        return out
+
+    if np.issubdtype(dtype, np.integer):
+        np.rint(r, out=r)
+
+    if out is None:
+        return r.astype(dtype, copy=False)
+
+    np.copyto(out, r, casting="unsafe")
+    return out
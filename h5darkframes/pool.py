@@ -0,0 +1,83 @@
+"""
+Module for reading darkframes libraries from several processes.
+"""
+
+import typing
+import pickle
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .h5types import Param
+from .image_library import ImageLibrary
+
+T = typing.TypeVar("T")
+
+# library of the worker process (set by _init_worker)
+_library: typing.Optional[ImageLibrary] = None
+
+
+def _init_worker(library: bytes) -> None:
+    global _library
+    _library = pickle.loads(library)
+
+
+def _call(f: typing.Callable[[ImageLibrary, Param], T], param: Param) -> T:
+    return f(typing.cast(ImageLibrary, _library), param)
+
+
+class ReaderPool:
+    """
+    Pool of processes, each with its own (read only) handle to
+    the library, for mapping functions over params on several
+    cores. The library is sent once to each process (which reopens
+    the file), and its caches, if any, are sent empty (unless they
+    are shared caches, see SharedDarkframeCache), whatever the start
+    method of the processes (the library is pickled even if the
+    processes are forked).
+
+    Arguments
+    ---------
+    library:
+      the library, which must not be open in editable mode.
+    workers:
+      number of processes (if None, the number of cores).
+    mp_context:
+      multiprocessing context (if None, the default one).
+    """
+
+    def __init__(
+        self,
+        library: ImageLibrary,
+        workers: typing.Optional[int] = None,
+        mp_context: typing.Optional[multiprocessing.context.BaseContext] = None,
+    ) -> None:
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(pickle.dumps(library),),
+        )
+
+    def map(
+        self,
+        f: typing.Callable[[ImageLibrary, Param], T],
+        params: typing.Iterable[Param],
+        chunksize: int = 1,
+    ) -> typing.Iterator[T]:
+        """
+        Returns the iterator over f(library, param) for each
+        of the params (in the same order), computed by the processes
+        of the pool. f must be picklable (e.g. a module level function).
+        """
+        return self._executor.map(
+            _call, itertools.repeat(f), params, chunksize=chunksize
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _, __, ___):
+        self.close()
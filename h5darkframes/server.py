@@ -0,0 +1,362 @@
+"""
+Module for sharing a darkframes library between processes of
+the same machine: a server owning the library answers requests
+sent over a Unix domain socket, and returns darkframes via
+shared memory blocks (rather than via the socket).
+"""
+
+import sys
+import json
+import socket
+import typing
+import logging
+import threading
+import socketserver
+import numpy as np
+from numpy import typing as npt
+from pathlib import Path
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from .h5types import Controllables, Param, Params
+from .get_image import ImageNotFoundError
+from .image_library import ImageLibrary
+
+_logger = logging.getLogger("server")
+
+_Key = typing.Tuple[typing.Any, ...]
+
+
+class _SharedBlocks:
+    """
+    Least recently used store of darkframes copied into shared
+    memory blocks, bounded by the total size of the blocks.
+    Evicted blocks are unlinked: clients which already mapped
+    them keep a valid mapping. Blocks larger than max_bytes are
+    not stored: the most recent of them is kept (until the next
+    one) only so that the requesting client can map it.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self._max_bytes = max_bytes
+        self._blocks: typing.OrderedDict[
+            _Key, typing.Tuple[SharedMemory, typing.Dict[str, typing.Any]]
+        ] = OrderedDict()
+        self._nbytes = 0
+        self._uncached: typing.Optional[SharedMemory] = None
+        self._lock = threading.Lock()
+
+    def get(self, key: _Key) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        with self._lock:
+            try:
+                _, header = self._blocks[key]
+            except KeyError:
+                return None
+            self._blocks.move_to_end(key)
+            return header
+
+    def put(
+        self, key: _Key, image: npt.NDArray, config: typing.Dict
+    ) -> typing.Dict[str, typing.Any]:
+        block = SharedMemory(create=True, size=max(1, image.nbytes))
+        shared: npt.NDArray = np.ndarray(image.shape, image.dtype, buffer=block.buf)
+        shared[...] = image
+        del shared
+        header = {
+            "shm": block.name,
+            "shape": list(image.shape),
+            "dtype": image.dtype.str,
+            "config": config,
+        }
+        with self._lock:
+            self._release(key)
+            if block.size > self._max_bytes:
+                self._release_uncached()
+                self._uncached = block
+                return header
+            while self._blocks and self._nbytes + block.size > self._max_bytes:
+                self._release(next(iter(self._blocks)))
+            self._blocks[key] = (block, header)
+            self._nbytes += block.size
+        return header
+
+    def _release(self, key: _Key) -> None:
+        try:
+            block, _ = self._blocks.pop(key)
+        except KeyError:
+            return
+        self._nbytes -= block.size
+        block.close()
+        block.unlink()
+
+    def _release_uncached(self) -> None:
+        if self._uncached is not None:
+            self._uncached.close()
+            self._uncached.unlink()
+            self._uncached = None
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._blocks.keys()):
+                self._release(key)
+            self._release_uncached()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # one json request per line, one json reply per line
+
+    def handle(self) -> None:
+        server = typing.cast(DarkframeServer, self.server)
+        for line in self.rfile:
+            try:
+                reply = server.answer(json.loads(line))
+            except Exception as e:
+                _logger.debug(f"failed to answer {line!r}: {e}")
+                reply = {"error": str(e), "type": e.__class__.__name__}
+            self.wfile.write(json.dumps(reply, default=str).encode() + b"\n")
+            self.wfile.flush()
+
+
+class DarkframeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Server answering darkframes requests (see DarkframeClient) sent
+    over the Unix domain socket socket_path, each connection being
+    served by its own thread. Darkframes (read from the library, or
+    generated) are copied into shared memory blocks, which are kept
+    for further requests as long as their total size does not
+    exceed max_bytes.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, library: ImageLibrary, socket_path: Path, max_bytes: int
+    ) -> None:
+        self._library = library
+        self._socket_path = socket_path
+        self._blocks = _SharedBlocks(max_bytes)
+        if socket_path.exists():
+            socket_path.unlink()
+        super().__init__(str(socket_path), _Handler)
+
+    def answer(self, request: typing.Dict[str, typing.Any]) -> typing.Any:
+        """
+        Returns the reply to the (json decoded) request.
+        """
+        library = self._library
+        command = request["command"]
+        if command == "controllables":
+            return list(library.controllables())
+        if command == "params":
+            return library.params()
+        controls = request["controls"]
+        if isinstance(controls, list):
+            controls = tuple(controls)
+        if command == "interpolation_neighbors":
+            return library.get_interpolation_neighbors(
+                controls, request["fixed_index"], request["free_index"]
+            )
+        param = library._param(controls)
+        if command == "get":
+            key: _Key = ("get", param)
+            header = self._blocks.get(key)
+            if header is None:
+                image, config = library.get(param)
+                header = self._blocks.put(key, image, config)  # type: ignore
+            return header
+        if command == "generate":
+            neighbors = tuple(sorted(tuple(n) for n in request["neighbors"]))
+            dtype = request["dtype"]
+            key = ("generate", param, neighbors, dtype)
+            header = self._blocks.get(key)
+            if header is None:
+                image = library.generate_darkframe(param, list(neighbors), dtype=dtype)
+                header = self._blocks.put(key, image, {})  # type: ignore
+            return header
+        raise ValueError(f"darkframe server: unknown command '{command}'")
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._blocks.clear()
+        if self._socket_path.exists():
+            self._socket_path.unlink()
+
+
+def _attach(name: str) -> SharedMemory:
+    # blocks are owned (and unlinked) by the server: by default, the
+    # resource tracker of the client would unlink them when the client exits
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)  # type: ignore
+    block = SharedMemory(name=name)
+    resource_tracker.unregister(block._name, "shared_memory")  # type: ignore
+    return block
+
+
+class DarkframeClient:
+    """
+    Client to a DarkframeServer, mirroring the API of ImageLibrary.
+    The returned darkframes are read-only numpy arrays mapping the
+    shared memory blocks of the server (i.e. no copy). The client maps
+    blocks up to max_bytes (least recently used blocks are unmapped
+    first, once the arrays returned for them are not used anymore).
+    """
+
+    def __init__(self, socket_path: Path, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(str(socket_path))
+        self._file = self._socket.makefile("rwb")
+        self._lock = threading.Lock()
+        self._max_bytes = max_bytes
+        self._blocks: typing.OrderedDict[str, SharedMemory] = OrderedDict()
+        self._nbytes = 0
+        # unmapped blocks which could not be closed yet
+        # (returned arrays still in use)
+        self._unclosed: typing.List[SharedMemory] = []
+        self._controllables: typing.Optional[Controllables] = None
+
+    def _request(self, **request) -> typing.Any:
+        with self._lock:
+            self._file.write(json.dumps(request).encode() + b"\n")
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise RuntimeError("darkframe client: connection closed by the server")
+        reply = json.loads(line)
+        if isinstance(reply, dict) and "error" in reply:
+            if reply["type"] == ImageNotFoundError.__name__:
+                raise ImageNotFoundError(reply["error"])
+            if reply["type"] in ("ValueError", "KeyError"):
+                raise ValueError(reply["error"])
+            raise RuntimeError(f"darkframe server: {reply['type']}: {reply['error']}")
+        return reply
+
+    def _close_unclosed(self) -> None:
+        remaining = []
+        for block in self._unclosed:
+            try:
+                block.close()
+            except BufferError:
+                remaining.append(block)
+        self._unclosed = remaining
+
+    def _map(self, name: str) -> SharedMemory:
+        # returns the (possibly already mapped) block, unmapping
+        # least recently used blocks if required
+        with self._lock:
+            block = self._blocks.get(name)
+            if block is not None:
+                self._blocks.move_to_end(name)
+                return block
+            block = _attach(name)
+            while self._blocks and self._nbytes + block.size > self._max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self._nbytes -= evicted.size
+                self._unclosed.append(evicted)
+            self._close_unclosed()
+            self._blocks[name] = block
+            self._nbytes += block.size
+            return block
+
+    def nbytes(self) -> int:
+        """
+        Number of bytes of the blocks mapped by the client.
+        """
+        return self._nbytes
+
+    def _image(self, **request) -> typing.Tuple[npt.NDArray, typing.Dict]:
+        for attempt in range(2):
+            header = self._request(**request)
+            try:
+                block = self._map(header["shm"])
+            except FileNotFoundError:
+                # the block has been evicted in the meantime,
+                # the server will create a new one
+                continue
+            # (unlike np.ndarray, np.frombuffer holds the buffer: the
+            # block can not be closed while the array is in use)
+            shape = tuple(header["shape"])
+            image: npt.NDArray = np.frombuffer(
+                typing.cast(memoryview, block.buf),
+                dtype=np.dtype(header["dtype"]),
+                count=int(np.prod(shape, dtype=np.int64)),
+            ).reshape(shape)
+            image.setflags(write=False)
+            return image, header["config"]
+        raise RuntimeError("darkframe client: failed to map the darkframe")
+
+    @staticmethod
+    def _controls(
+        controls: typing.Union[Param, typing.Dict[str, int]],
+    ) -> typing.Union[typing.List[int], typing.Dict[str, int]]:
+        if isinstance(controls, dict):
+            return controls
+        return list(controls)
+
+    def controllables(self) -> Controllables:
+        if self._controllables is None:
+            self._controllables = tuple(self._request(command="controllables"))
+        return self._controllables
+
+    def params(self) -> Params:
+        return [tuple(param) for param in self._request(command="params")]
+
+    def get(
+        self, controls: typing.Union[Param, typing.Dict[str, int]]
+    ) -> typing.Tuple[npt.NDArray, typing.Dict]:
+        """
+        Returns the darkframe corresponding to the controls and the
+        configuration of the camera when it was taken.
+        """
+        return self._image(command="get", controls=self._controls(controls))
+
+    def get_interpolation_neighbors(
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        fixed_index: int = 1,
+        free_index: typing.Optional[int] = None,
+    ) -> Params:
+        """
+        See ImageLibrary.get_interpolation_neighbors.
+        """
+        neighbors = self._request(
+            command="interpolation_neighbors",
+            controls=self._controls(controls),
+            fixed_index=fixed_index,
+            free_index=free_index,
+        )
+        return [tuple(neighbor) for neighbor in neighbors]
+
+    def generate_darkframe(
+        self,
+        controls: typing.Union[Param, typing.Dict[str, int]],
+        neighbors: Params,
+        dtype: typing.Optional[npt.DTypeLike] = None,
+    ) -> npt.NDArray:
+        """
+        See ImageLibrary.generate_darkframe.
+        """
+        image, _ = self._image(
+            command="generate",
+            controls=self._controls(controls),
+            neighbors=[list(neighbor) for neighbor in neighbors],
+            dtype=None if dtype is None else np.dtype(dtype).str,
+        )
+        return image
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+        with self._lock:
+            self._unclosed.extend(self._blocks.values())
+            self._blocks.clear()
+            self._nbytes = 0
+            # blocks still used by returned arrays are released
+            # when these arrays are garbage collected
+            self._close_unclosed()
+            self._unclosed.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _, __, ___):
+        self.close()
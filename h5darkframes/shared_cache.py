@@ -0,0 +1,453 @@
+"""
+Module for sharing decoded darkframes between processes
+via named shared memory segments.
+"""
+
+import os
+import sys
+import ast
+import json
+import atexit
+import contextlib
+import typing
+import hashlib
+import tempfile
+import threading
+import multiprocessing.util
+import numpy as np
+from numpy import typing as npt
+from pathlib import Path
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from .cache import CacheStats
+
+# layout of the header of the segments: reference count, state,
+# size of the metadata (json: dtype, shape and key) and metadata
+_REFCOUNT = 0
+_STATE = 1
+_META_SIZE = 2
+_HEADER = 1024
+_META_OFFSET = 24
+
+# states of a segment
+_WRITING = 0
+_READY = 1
+_STALE = 2
+
+# directory listing the shared memory segments (on Linux), for finding
+# the segments published by other processes (see discard_if)
+_SHM_DIR = Path("/dev/shm")
+
+
+def _open(name: str, create: bool, size: int = 0) -> SharedMemory:
+    # the lifetime of the segments is managed via their reference
+    # count, not by the resource tracker (which would unlink them
+    # when the process that created or attached them exits)
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, create=create, size=size, track=False)  # type: ignore
+    block = SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(block._name, "shared_memory")  # type: ignore
+    return block
+
+
+def _unlink(block: SharedMemory) -> None:
+    if sys.version_info < (3, 13):
+        # unlink unregisters the segment from the resource tracker
+        resource_tracker.register(block._name, "shared_memory")  # type: ignore
+    block.unlink()
+
+
+def _buffer(block: SharedMemory) -> memoryview:
+    # (the buffer is None only once the block is closed)
+    return typing.cast(memoryview, block.buf)
+
+
+def _header(block: SharedMemory) -> npt.NDArray:
+    # (unlike np.ndarray, np.frombuffer holds the buffer: the
+    # block can not be closed while the returned array is in use)
+    return np.frombuffer(_buffer(block), dtype=np.int64, count=3)
+
+
+class SharedDarkframeCache:
+    """
+    Darkframes cache (same API as cache.DarkframeCache, which it
+    can replace, see the 'cache' argument of ImageLibrary) shared by
+    all the processes using the same namespace. The first process
+    adding an array publishes it in a named shared memory segment,
+    the other processes map this segment (no copy, no reading from
+    the hdf5 file).
+
+    Each process maps segments up to max_bytes (least recently used
+    segments are unmapped first). Segments are reference counted
+    (the count being protected by a lock file), and unlinked once
+    no process maps them anymore. Caches should be closed (or used
+    as context managers), or are closed when the process exits
+    (including multiprocessing workers). A cache inherited by a forked
+    process starts empty in this process (segments mapped by the
+    parent are not unmapped by the child).
+
+    Removing an array (discard, discard_if) flags its segment as
+    stale, whether this process maps it or not, so that no process
+    returns it anymore (arrays already returned remain valid). Segments
+    not mapped by this process are found by listing /dev/shm: on other
+    platforms, discard_if only considers the segments mapped by this
+    process.
+
+    The segments being locked with fcntl, the cache is not
+    available on Windows.
+
+    Arguments
+    ---------
+    namespace:
+      prefix of the names of the segments, which should identify the
+      library (see 'for_library').
+    max_bytes:
+      budget for the segments mapped by this process.
+    """
+
+    def __init__(self, namespace: str, max_bytes: int) -> None:
+        if sys.platform == "win32":
+            raise RuntimeError("shared darkframe cache: not available on Windows")
+        if max_bytes < 0:
+            raise ValueError(
+                f"darkframe cache: the memory budget ({max_bytes}) can not be negative"
+            )
+        self._namespace = namespace
+        self._max_bytes = max_bytes
+        self._lock_path = Path(tempfile.gettempdir()) / f"{namespace}.lock"
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._init_process()
+        atexit.register(self.close)
+
+    def _init_process(self) -> None:
+        # state owned by the current process: flock locks belong to the
+        # open file description, so each process opens its own lock file
+        self._pid = os.getpid()
+        self._blocks: typing.OrderedDict[
+            typing.Hashable, typing.Tuple[SharedMemory, npt.NDArray]
+        ] = OrderedDict()
+        # unmapped segments which could not be closed yet
+        # (arrays returned by get or put still in use)
+        self._unclosed: typing.List[SharedMemory] = []
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._lock_file = open(self._lock_path, "a")
+        # multiprocessing workers exit via os._exit (atexit handlers
+        # are not called), but run the finalizers with an exit priority
+        self._finalizer = multiprocessing.util.Finalize(
+            self, self.close, exitpriority=10
+        )
+
+    def _check_process(self) -> None:
+        # a forked process inherits the segments mapped by its parent,
+        # which are not accounted for in this process: they are dropped
+        # (without updating their reference count), as are the lock file
+        # (shared with the parent) and the lock (possibly held at fork time)
+        if self._pid == os.getpid() or self._lock_file.closed:
+            return
+        inherited = self._lock_file
+        self._init_process()
+        inherited.close()
+
+    @classmethod
+    def for_library(cls, hdf5_path: Path, max_bytes: int) -> "SharedDarkframeCache":
+        """
+        Returns a cache which namespace is derived from the path and the
+        modification time of the library file, so that all processes
+        using the same library share the same segments.
+        """
+        path = Path(hdf5_path).resolve()
+        identity = f"{path}:{os.stat(path).st_mtime_ns}"
+        digest = hashlib.sha1(identity.encode()).hexdigest()[:12]
+        return cls(f"h5darkframes_{digest}", max_bytes)
+
+    def namespace(self) -> str:
+        return self._namespace
+
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    def nbytes(self) -> int:
+        """
+        Number of bytes of the segments mapped by this process.
+        """
+        self._check_process()
+        return self._nbytes
+
+    def _name(self, key: typing.Hashable) -> str:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+        return f"{self._namespace}_{digest}"
+
+    @contextlib.contextmanager
+    def _locked(self) -> typing.Generator[None, None, None]:
+        # excluding the other processes (the other threads
+        # being excluded by self._lock). fcntl is imported here,
+        # as it is not available on all platforms (e.g. Windows).
+        import fcntl
+
+        self._check_process()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _meta(block: SharedMemory) -> typing.Dict[str, typing.Any]:
+        size = int(_header(block)[_META_SIZE])
+        return json.loads(bytes(_buffer(block)[_META_OFFSET : _META_OFFSET + size]))
+
+    @classmethod
+    def _view(cls, block: SharedMemory) -> npt.NDArray:
+        meta = cls._meta(block)
+        shape = tuple(meta["shape"])
+        array: npt.NDArray = np.frombuffer(
+            _buffer(block),
+            dtype=np.dtype(meta["dtype"]),
+            count=int(np.prod(shape, dtype=np.int64)),
+            offset=_HEADER,
+        ).reshape(shape)
+        array.setflags(write=False)
+        return array
+
+    def _map(self, key: typing.Hashable, block: SharedMemory) -> npt.NDArray:
+        # keeping track of the segment, unmapping least recently
+        # used segments if required
+        array = self._view(block)
+        while self._blocks and self._nbytes + block.size > self._max_bytes:
+            evicted = next(iter(self._blocks))
+            self._unmap(evicted)
+            self.evictions += 1
+        self._blocks[key] = (block, array)
+        self._nbytes += block.size
+        return array
+
+    def _unmap(self, key: typing.Hashable) -> None:
+        # to be called with self._lock acquired
+        try:
+            block, array = self._blocks.pop(key)
+        except KeyError:
+            return
+        # the segment can be closed only once no array maps it
+        del array
+        self._nbytes -= block.size
+        with self._locked():
+            header = _header(block)
+            header[_REFCOUNT] -= 1
+            if header[_REFCOUNT] <= 0:
+                _unlink(block)
+            del header
+        self._unclosed.append(block)
+        self._close_unclosed()
+
+    def _close_unclosed(self) -> None:
+        remaining = []
+        for block in self._unclosed:
+            try:
+                block.close()
+            except BufferError:
+                remaining.append(block)
+        self._unclosed = remaining
+
+    def get(self, key: typing.Hashable) -> typing.Optional[npt.NDArray]:
+        """
+        Returns the (read-only) array cached for key, by this process
+        or by another one, or None.
+        """
+        self._check_process()
+        with self._lock:
+            try:
+                block, array = self._blocks[key]
+            except KeyError:
+                pass
+            else:
+                if _header(block)[_STATE] == _READY:
+                    self._blocks.move_to_end(key)
+                    self.hits += 1
+                    return array
+                # discarded by another process
+                del block, array
+                self._unmap(key)
+            with self._locked():
+                try:
+                    block = _open(self._name(key), False)
+                except FileNotFoundError:
+                    self.misses += 1
+                    return None
+                header = _header(block)
+                if header[_STATE] != _READY or block.size > self._max_bytes:
+                    del header
+                    block.close()
+                    self.misses += 1
+                    return None
+                header[_REFCOUNT] += 1
+                del header
+            self.hits += 1
+            return self._map(key, block)
+
+    def put(self, key: typing.Hashable, array: npt.NDArray) -> npt.NDArray:
+        """
+        Publishes the array (unless another process already did)
+        and returns the corresponding read-only array, mapping
+        the shared segment. Arrays larger than the budget are
+        not published (and returned as is).
+        """
+        meta = json.dumps(
+            {"dtype": array.dtype.str, "shape": list(array.shape), "key": repr(key)}
+        )
+        size = _HEADER + max(1, array.nbytes)
+        if size > self._max_bytes or len(meta) > _HEADER - _META_OFFSET:
+            return array
+        self._check_process()
+        with self._lock:
+            self._unmap(key)
+            with self._locked():
+                try:
+                    block = _open(self._name(key), True, size)
+                except FileExistsError:
+                    block = _open(self._name(key), False)
+                    header = _header(block)
+                    if header[_STATE] != _READY:
+                        # stale segment, still mapped by other processes
+                        del header
+                        block.close()
+                        return array
+                else:
+                    header = _header(block)
+                    _buffer(block)[
+                        _META_OFFSET : _META_OFFSET + len(meta)
+                    ] = meta.encode()
+                    header[_META_SIZE] = len(meta)
+                    shared: npt.NDArray = np.frombuffer(
+                        _buffer(block),
+                        dtype=array.dtype,
+                        count=array.size,
+                        offset=_HEADER,
+                    ).reshape(array.shape)
+                    shared[...] = array
+                    del shared
+                    header[_STATE] = _READY
+                header[_REFCOUNT] += 1
+                del header
+            return self._map(key, block)
+
+    def _flag_stale(self, name: str) -> None:
+        # flags the segment as stale (whether this process maps it or not)
+        with self._locked():
+            try:
+                block = _open(name, False)
+            except FileNotFoundError:
+                return
+            header = _header(block)
+            header[_STATE] = _STALE
+            del header
+            block.close()
+
+    def discard(self, key: typing.Hashable) -> None:
+        """
+        Flags the segment of key as stale, and unmaps it
+        (if mapped by this process).
+        """
+        self._check_process()
+        with self._lock:
+            self._flag_stale(self._name(key))
+            self._unmap(key)
+
+    def _published(self) -> typing.List[typing.Tuple[str, typing.Any]]:
+        # names and keys of the segments of the namespace not mapped
+        # by this process (empty if segments can not be listed)
+        if not _SHM_DIR.is_dir():
+            return []
+        mapped = {self._name(key) for key in self._blocks.keys()}
+        r: typing.List[typing.Tuple[str, typing.Any]] = []
+        for path in _SHM_DIR.glob(f"{self._namespace}_*"):
+            if path.name in mapped:
+                continue
+            with self._locked():
+                try:
+                    block = _open(path.name, False)
+                except (FileNotFoundError, ValueError):
+                    continue
+                try:
+                    if _header(block)[_STATE] == _READY:
+                        r.append(
+                            (path.name, ast.literal_eval(self._meta(block)["key"]))
+                        )
+                except (KeyError, ValueError, SyntaxError):
+                    # segment of another version, or key which
+                    # can not be parsed back
+                    pass
+                finally:
+                    block.close()
+        return r
+
+    def discard_if(self, predicate: typing.Callable[[typing.Any], bool]) -> None:
+        """
+        Same as discard, for all the keys satisfying the predicate
+        (of the segments mapped by this process and, where segments
+        can be listed, of the segments published by other processes).
+        """
+        self._check_process()
+        with self._lock:
+            for key in [key for key in self._blocks.keys() if predicate(key)]:
+                self._flag_stale(self._name(key))
+                self._unmap(key)
+            for name, key in self._published():
+                if predicate(key):
+                    self._flag_stale(name)
+
+    def clear(self) -> None:
+        """
+        Unmaps all the segments mapped by this process
+        (the counters are not reset).
+        """
+        self._check_process()
+        with self._lock:
+            for key in list(self._blocks.keys()):
+                self._unmap(key)
+
+    def close(self) -> None:
+        """
+        Unmaps all the segments: segments not used by any
+        process anymore are unlinked.
+        """
+        self._check_process()
+        if self._lock_file.closed:
+            return
+        self.clear()
+        with self._lock:
+            self._close_unclosed()
+        self._lock_file.close()
+        self._finalizer.cancel()
+        atexit.unregister(self.close)
+
+    def stats(self) -> CacheStats:
+        self._check_process()
+        with self._lock:
+            return CacheStats(
+                self.hits, self.misses, self.evictions, len(self._blocks), self._nbytes
+            )
+
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        # the process unpickling the cache maps its own segments
+        return {"namespace": self._namespace, "max_bytes": self._max_bytes}
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+        self.__init__(state["namespace"], state["max_bytes"])  # type: ignore
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        self._check_process()
+        return key in self._blocks
+
+    def __len__(self) -> int:
+        self._check_process()
+        return len(self._blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _, __, ___):
+        self.close()
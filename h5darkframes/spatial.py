@@ -0,0 +1,279 @@
+"""
+Module providing a KD-tree over the (normalized) params of a library,
+for fast nearest darkframes queries.
+"""
+
+import heapq
+import typing
+import numpy as np
+from numpy import typing as npt
+from .h5types import Param, NParam
+from .neighbors import _distances
+
+Neighbor = typing.Tuple[Param, float]
+"""
+A param and its (normalized) distance to a target
+"""
+
+
+class _Node:
+    """
+    Node of the KD-tree. Leaves host the ids of their points,
+    other nodes the splitting axis and value. All nodes keep the
+    bounding box of the points they (or their children) host.
+    """
+
+    __slots__ = ("lo", "hi", "axis", "split", "left", "right", "ids")
+
+    def __init__(self, lo: npt.NDArray, hi: npt.NDArray) -> None:
+        self.lo = lo
+        self.hi = hi
+        self.axis = 0
+        self.split = 0.0
+        self.left: typing.Optional[_Node] = None
+        self.right: typing.Optional[_Node] = None
+        self.ids: typing.Optional[typing.List[int]] = None
+
+    def mindist(self, target: npt.NDArray) -> float:
+        """
+        Minimal distance between the target and the bounding box.
+        """
+        delta = np.maximum(self.lo - target, 0.0) + np.maximum(target - self.hi, 0.0)
+        return float(np.sqrt(np.sum(delta**2)))
+
+
+class KDTree:
+    """
+    KD-tree over normalized params, supporting k-nearest and radius
+    queries as well as insertion and removal of params.
+
+    Ties (params at the same distance of the target) are resolved
+    according to the order in which the params have been added
+    to the tree, consistently with neighbors.closest_neighbors.
+
+    Arguments
+    ---------
+    dimension:
+      the number of controllables.
+    leaf_size:
+      the max number of params stored per leaf (leaves are split
+      when more than twice this number of params are added to them).
+    """
+
+    def __init__(self, dimension: int, leaf_size: int = 64) -> None:
+        self._dimension = dimension
+        self._leaf_size = leaf_size
+        self._points: npt.NDArray = np.empty((0, dimension), dtype=np.float64)
+        self._keys: typing.List[typing.Optional[Param]] = []
+        self._ids: typing.Dict[Param, int] = {}
+        self._root: typing.Optional[_Node] = None
+        self._nb_removed = 0
+
+    @classmethod
+    def build(
+        cls,
+        params: typing.Sequence[Param],
+        npoints: npt.NDArray,
+        leaf_size: int = 64,
+    ) -> "KDTree":
+        """
+        Returns the tree hosting the params, npoints being their
+        normalized values (one row per param).
+        """
+        tree = cls(npoints.shape[1], leaf_size=leaf_size)
+        tree._reset(list(params), npoints)
+        return tree
+
+    def _reset(self, params: typing.List[Param], npoints: npt.NDArray) -> None:
+        self._points = np.array(npoints, dtype=np.float64).reshape(
+            len(params), self._dimension
+        )
+        self._keys = list(params)
+        self._ids = {param: id_ for id_, param in enumerate(params)}
+        self._nb_removed = 0
+        if params:
+            self._root = self._build(np.arange(len(params)))
+        else:
+            self._root = None
+
+    def _build(self, ids: npt.NDArray) -> _Node:
+        points = self._points[ids]
+        node = _Node(points.min(axis=0), points.max(axis=0))
+        extent = node.hi - node.lo
+        if ids.shape[0] <= self._leaf_size or not np.any(extent > 0):
+            node.ids = np.sort(ids).tolist()
+            return node
+        axis = int(np.argmax(extent))
+        values = points[:, axis]
+        middle = ids.shape[0] // 2
+        split = float(np.partition(values, middle)[middle])
+        if not np.any(values < split):
+            # the median is also the min value, splitting
+            # on the next value instead
+            split = float(np.unique(values)[1])
+        node.axis = axis
+        node.split = split
+        node.left = self._build(ids[values < split])
+        node.right = self._build(ids[values >= split])
+        return node
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, param: Param) -> bool:
+        return param in self._ids
+
+    def insert(self, param: Param, npoint: NParam) -> None:
+        """
+        Adds the param, npoint being its normalized value.
+        """
+        if param in self._ids:
+            self.remove(param)
+        id_ = len(self._keys)
+        point = np.array(npoint, dtype=np.float64)
+        self._points = np.vstack((self._points, point))
+        self._keys.append(param)
+        self._ids[param] = id_
+        if self._root is None:
+            self._root = _Node(point.copy(), point.copy())
+            self._root.ids = [id_]
+            return
+        node = self._root
+        while True:
+            node.lo = np.minimum(node.lo, point)
+            node.hi = np.maximum(node.hi, point)
+            if node.ids is not None:
+                break
+            node = node.left if point[node.axis] < node.split else node.right  # type: ignore
+        node.ids.append(id_)
+        if len(node.ids) > 2 * self._leaf_size:
+            subtree = self._build(np.array(node.ids))
+            for attr in _Node.__slots__:
+                setattr(node, attr, getattr(subtree, attr))
+
+    def remove(self, param: Param) -> bool:
+        """
+        Removes the param, returns False if the tree did not host it.
+        """
+        try:
+            id_ = self._ids.pop(param)
+        except KeyError:
+            return False
+        point = self._points[id_]
+        node = self._root
+        while node is not None and node.ids is None:
+            node = node.left if point[node.axis] < node.split else node.right
+        if node is not None:
+            node.ids.remove(id_)  # type: ignore
+        self._keys[id_] = None
+        self._nb_removed += 1
+        # the removed params are still using memory, and the
+        # bounding boxes are not shrunk: rebuilding the tree
+        # once too many params have been removed
+        if self._nb_removed > max(len(self._ids), self._leaf_size):
+            alive = [id_ for id_, key in enumerate(self._keys) if key is not None]
+            self._reset(
+                [typing.cast(Param, self._keys[id_]) for id_ in alive],
+                self._points[alive],
+            )
+        return True
+
+    def _leaf_distances(
+        self,
+        node: _Node,
+        target: npt.NDArray,
+        axis: typing.Optional[int],
+        upper: bool,
+    ) -> typing.Tuple[npt.NDArray, npt.NDArray]:
+        ids = np.array(node.ids, dtype=np.int64)
+        points = self._points[ids]
+        if axis is not None:
+            if upper:
+                mask = points[:, axis] >= target[axis]
+            else:
+                mask = points[:, axis] < target[axis]
+            ids, points = ids[mask], points[mask]
+        return ids, _distances(points, tuple(target))
+
+    @staticmethod
+    def _excluded(
+        node: _Node, target: npt.NDArray, axis: typing.Optional[int], upper: bool
+    ) -> bool:
+        # True if none of the points of the node can be in the half space
+        if axis is None:
+            return False
+        if upper:
+            return bool(node.hi[axis] < target[axis])
+        return bool(node.lo[axis] >= target[axis])
+
+    def nearest(
+        self,
+        ntarget: NParam,
+        k: int = 1,
+        axis: typing.Optional[int] = None,
+        upper: bool = True,
+    ) -> typing.List[Neighbor]:
+        """
+        Returns the (up to) k params the closest to the normalized target,
+        closest first, with their distance to the target.
+        If axis is not None, only the params which normalized value
+        for this axis is greater or equal (if upper is True) or
+        strictly lower (if upper is False) than the one of the target
+        are considered.
+        """
+        if self._root is None or k <= 0:
+            return []
+        target = np.array(ntarget, dtype=np.float64)
+        counter = 0
+        nodes = [(self._root.mindist(target), counter, self._root)]
+        # max heap (via negated values) of the best (distance, id) so far
+        best: typing.List[typing.Tuple[float, int]] = []
+        while nodes:
+            mindist, _, node = heapq.heappop(nodes)
+            if len(best) == k and mindist > -best[0][0]:
+                break
+            if self._excluded(node, target, axis, upper):
+                continue
+            if node.ids is None:
+                for child in (node.left, node.right):
+                    counter += 1
+                    heapq.heappush(
+                        nodes, (child.mindist(target), counter, child)  # type: ignore
+                    )
+                continue
+            ids, distances = self._leaf_distances(node, target, axis, upper)
+            for id_, distance in zip(ids.tolist(), distances.tolist()):
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, -id_))
+                elif (distance, id_) < (-best[0][0], -best[0][1]):
+                    heapq.heapreplace(best, (-distance, -id_))
+        ordered = sorted((-d, -id_) for d, id_ in best)
+        return [
+            (typing.cast(Param, self._keys[id_]), distance) for distance, id_ in ordered
+        ]
+
+    def within(self, ntarget: NParam, radius: float) -> typing.List[Neighbor]:
+        """
+        Returns all the params which distance to the normalized target
+        is lower or equal to radius, closest first, with their distance
+        to the target.
+        """
+        if self._root is None:
+            return []
+        target = np.array(ntarget, dtype=np.float64)
+        found: typing.List[typing.Tuple[float, int]] = []
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            if node.mindist(target) > radius:
+                continue
+            if node.ids is None:
+                nodes.extend((node.left, node.right))  # type: ignore
+                continue
+            ids, distances = self._leaf_distances(node, target, None, True)
+            keep = distances <= radius
+            found.extend(zip(distances[keep].tolist(), ids[keep].tolist()))
+        return [
+            (typing.cast(Param, self._keys[id_]), distance)
+            for distance, id_ in sorted(found)
+        ]
@@ -0,0 +1,278 @@
+"""
+Module for combining the frames taken for a darkframe with
+outlier rejection (e.g. cosmic rays), out of core: frames are
+spilled to a temporary memory mapped file, and combined strip
+of rows by strip of rows.
+"""
+
+import os
+import typing
+import tempfile
+import numpy as np
+from numpy import typing as npt
+from pathlib import Path
+
+MODES = ("mean", "median", "sigma_clip", "minmax")
+"""
+Supported stacking modes
+"""
+
+
+class Stacking:
+    """
+    Configuration of the combination of the frames taken for
+    a darkframe.
+
+    Arguments
+    ---------
+    mode:
+      'mean' (streaming average, no outlier rejection), 'median',
+      'sigma_clip' (mean of the values within sigma standard deviations
+      of the mean, iteratively) or 'minmax' (mean of the values, the
+      'rejected' lowest and highest ones excluded).
+    sigma:
+      clipping threshold of the 'sigma_clip' mode.
+    iterations:
+      max number of clipping iterations of the 'sigma_clip' mode.
+    rejected:
+      number of lowest and of highest values excluded per pixel
+      by the 'minmax' mode.
+    memory_budget:
+      max memory (in bytes) used for combining the frames
+      (frames are combined by strips of rows fitting in this budget).
+    directory:
+      directory of the temporary memory mapped files hosting the
+      frames (if None, the default temporary directory).
+    variance:
+      if True, the per-pixel variance of the frames is computed
+      (whatever the mode, see RunningVariance) and stored alongside
+      the darkframe.
+    """
+
+    def __init__(
+        self,
+        mode: str = "mean",
+        sigma: float = 3.0,
+        iterations: int = 5,
+        rejected: int = 1,
+        memory_budget: int = 256 * 1024 * 1024,
+        directory: typing.Optional[Path] = None,
+        variance: bool = False,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(
+                f"unknown stacking mode '{mode}' (supported: {', '.join(MODES)})"
+            )
+        if sigma <= 0:
+            raise ValueError(f"stacking: sigma must be positive (got {sigma})")
+        if iterations < 1:
+            raise ValueError(
+                f"stacking: the number of iterations must be positive (got {iterations})"
+            )
+        if rejected < 0:
+            raise ValueError(
+                f"stacking: the number of rejected values can not be negative "
+                f"(got {rejected})"
+            )
+        if memory_budget <= 0:
+            raise ValueError(
+                f"stacking: the memory budget must be positive (got {memory_budget})"
+            )
+        self.mode = mode
+        self.sigma = sigma
+        self.iterations = iterations
+        self.rejected = rejected
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.variance = variance
+
+    def __repr__(self) -> str:
+        return str(
+            f"Stacking(mode={self.mode!r}, sigma={self.sigma}, "
+            f"iterations={self.iterations}, rejected={self.rejected}, "
+            f"memory_budget={self.memory_budget}, variance={self.variance})"
+        )
+
+
+class RunningVariance:
+    """
+    Per-pixel mean and variance of frames, updated frame by frame
+    (Welford's algorithm), i.e. without keeping the frames. Requires
+    three float64 arrays of the size of a frame.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._mean: typing.Optional[npt.NDArray] = None
+        self._m2: typing.Optional[npt.NDArray] = None
+        self._delta: typing.Optional[npt.NDArray] = None
+
+    def add(self, frame: npt.NDArray) -> None:
+        if self._mean is None:
+            self._mean = np.zeros(frame.shape, dtype=np.float64)
+            self._m2 = np.zeros(frame.shape, dtype=np.float64)
+            self._delta = np.empty(frame.shape, dtype=np.float64)
+        m2 = typing.cast(npt.NDArray, self._m2)
+        delta = typing.cast(npt.NDArray, self._delta)
+        self.count += 1
+        n = self.count
+        # mean += (frame - mean) / n
+        np.subtract(frame, self._mean, out=delta)
+        np.divide(delta, n, out=delta)
+        np.add(self._mean, delta, out=self._mean)
+        # m2 += (frame - previous mean) * (frame - mean),
+        # i.e. n * (n-1) * delta**2
+        np.multiply(delta, delta, out=delta)
+        np.multiply(delta, n * (n - 1), out=delta)
+        np.add(m2, delta, out=m2)
+
+    def mean(self) -> npt.NDArray:
+        if self._mean is None:
+            raise ValueError("running variance: no frame added")
+        return self._mean
+
+    def variance(self) -> npt.NDArray:
+        """
+        Returns the (unbiased) per-pixel variance as a float32 array
+        (zeros if a single frame has been added).
+        """
+        if self._m2 is None:
+            raise ValueError("running variance: no frame added")
+        if self.count < 2:
+            return np.zeros(self._m2.shape, dtype=np.float32)
+        return (self._m2 / (self.count - 1)).astype(np.float32)
+
+
+def _median(strip: npt.NDArray, stacking: Stacking) -> npt.NDArray:
+    return np.median(strip, axis=0)
+
+
+def _sigma_clip(strip: npt.NDArray, stacking: Stacking) -> npt.NDArray:
+    # clipped values are replaced by nan
+    clipped = np.zeros(strip.shape, dtype=bool)
+    for _ in range(stacking.iterations):
+        mean = np.nanmean(strip, axis=0)
+        std = np.nanstd(strip, axis=0)
+        outliers = np.abs(strip - mean) > stacking.sigma * std
+        outliers &= ~clipped
+        if not outliers.any():
+            break
+        strip[outliers] = np.nan
+        clipped |= outliers
+    return np.nanmean(strip, axis=0)
+
+
+def _minmax(strip: npt.NDArray, stacking: Stacking) -> npt.NDArray:
+    strip.sort(axis=0)
+    rejected = stacking.rejected
+    return strip[rejected : strip.shape[0] - rejected].mean(axis=0)
+
+
+_REDUCTIONS: typing.Dict[str, typing.Callable[[npt.NDArray, Stacking], npt.NDArray]]
+_REDUCTIONS = {"median": _median, "sigma_clip": _sigma_clip, "minmax": _minmax}
+
+
+class FrameStack:
+    """
+    Stack of frames spilled to a temporary memory mapped file
+    (deleted when the stack is closed), combined according to
+    the stacking configuration (see the combine method).
+
+    Arguments
+    ---------
+    stacking:
+      the stacking configuration (not of the 'mean' mode, which
+      does not require to keep the frames).
+    nb_frames:
+      the number of frames that will be added to the stack.
+    """
+
+    def __init__(self, stacking: Stacking, nb_frames: int) -> None:
+        if stacking.mode not in _REDUCTIONS:
+            raise ValueError(
+                f"stacking mode '{stacking.mode}' does not require a frame stack"
+            )
+        if stacking.mode == "minmax" and nb_frames <= 2 * stacking.rejected:
+            raise ValueError(
+                f"stacking: can not reject the {stacking.rejected} lowest and "
+                f"highest values of {nb_frames} frames"
+            )
+        self._stacking = stacking
+        self._nb_frames = nb_frames
+        self._nb_added = 0
+        self._stack: typing.Optional[np.memmap] = None
+        self._path: typing.Optional[str] = None
+
+    def add(self, frame: npt.NDArray) -> None:
+        """
+        Writes the frame into the stack.
+        """
+        if self._stack is None:
+            fd, self._path = tempfile.mkstemp(
+                suffix=".stack", dir=self._stacking.directory
+            )
+            os.close(fd)
+            self._stack = np.memmap(
+                self._path,
+                dtype=frame.dtype,
+                mode="w+",
+                shape=(self._nb_frames,) + frame.shape,
+            )
+        if self._nb_added >= self._nb_frames:
+            raise ValueError(f"frame stack: already hosts {self._nb_frames} frames")
+        self._stack[self._nb_added] = frame
+        self._nb_added += 1
+
+    def _strip_rows(self) -> int:
+        # number of rows per strip so that a strip (converted to float64,
+        # along with a mask and the temporaries of the reductions)
+        # fits in the memory budget
+        stack = typing.cast(np.memmap, self._stack)
+        row_size = int(np.prod(stack.shape[2:], dtype=np.int64)) * self._nb_added
+        bytes_per_row = row_size * (3 * np.dtype(np.float64).itemsize + 1)
+        return max(1, self._stacking.memory_budget // max(1, bytes_per_row))
+
+    def combine(self) -> npt.NDArray:
+        """
+        Combines the frames, strip of rows by strip of rows, and returns
+        the darkframe (of the type of the frames, rounded to the nearest
+        integer for integer types).
+        """
+        if self._stack is None or self._nb_added == 0:
+            raise ValueError("frame stack: no frame to combine")
+        if (
+            self._stacking.mode == "minmax"
+            and self._nb_added <= 2 * self._stacking.rejected
+        ):
+            raise ValueError(
+                f"stacking: can not reject the {self._stacking.rejected} lowest and "
+                f"highest values of {self._nb_added} frames"
+            )
+        stack = self._stack[: self._nb_added]
+        result = np.empty(stack.shape[1:], dtype=stack.dtype)
+        reduction = _REDUCTIONS[self._stacking.mode]
+        integer = stack.dtype.kind in ("u", "i", "b")
+        rows = self._strip_rows()
+        for start in range(0, stack.shape[1], rows):
+            strip = np.array(stack[:, start : start + rows], dtype=np.float64)
+            combined = reduction(strip, self._stacking)
+            if integer:
+                np.rint(combined, out=combined)
+            result[start : start + rows] = combined
+        return result
+
+    def close(self) -> None:
+        """
+        Deletes the temporary file.
+        """
+        # the file is unmapped once no array refers to it anymore
+        self._stack = None
+        if self._path is not None:
+            os.unlink(self._path)
+            self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _, __, ___):
+        self.close()
@@ -27,19 +27,126 @@ class DarkframeError(Exception):
         return self._error
 
 
-def substract(img: npt.NDArray, darkframe: npt.NDArray) -> npt.NDArray:
-
+def _check(img: npt.NDArray, darkframe: npt.NDArray) -> None:
     # checking the darkframe is of suitable type/shape
     if not darkframe.dtype == img.dtype:  # type: ignore
         raise DarkframeError(img, dtype=darkframe.dtype)  # type: ignore
     if not darkframe.shape == img.shape:  # type: ignore
         raise DarkframeError(img, shape=darkframe.shape)  # type: ignore
 
-    # substracting
+
+def _substract(
+    img: npt.NDArray, darkframe: npt.NDArray, out: typing.Optional[npt.NDArray]
+) -> npt.NDArray:
+
+    if np.issubdtype(img.dtype, np.unsignedinteger):
+        # saturating substraction without temporary arrays:
+        # max(img, dark) - dark is img - dark where img > dark, 0 elsewhere
+        # (out may be img itself)
+        if out is None:
+            out = np.empty_like(img)
+        np.maximum(img, darkframe, out=out)
+        np.subtract(out, darkframe, out=out)
+        return out
+
+    # other types: computing in int64 and clipping negative values
     im64 = img.astype(np.int64)
     dark64 = darkframe.astype(np.int64)  # type: ignore
     sub64 = im64 - dark64
     sub64[sub64 < 0] = 0
+    if out is None:
+        return sub64.astype(img.dtype)
+    np.copyto(out, sub64, casting="unsafe")
+    return out
+
+
+def substract(
+    img: npt.NDArray,
+    darkframe: npt.NDArray,
+    out: typing.Optional[npt.NDArray] = None,
+) -> npt.NDArray:
+    """
+    Returns the image minus the darkframe, negative values
+    being set to 0. The darkframe must be of the same type and shape
+    as the image, or a DarkframeError is raised.
+    If out is provided (which may be the image itself, for an in
+    place substraction), the result is written into it. For unsigned
+    integer types, no temporary array is allocated.
+    """
+
+    _check(img, darkframe)
+    if out is not None and (out.dtype != img.dtype or out.shape != img.shape):
+        raise ValueError(
+            f"darkframe substraction: output array of type {out.dtype} and shape "
+            f"{out.shape}, expected {img.dtype} and {img.shape}"
+        )
+
+    return _substract(img, darkframe, out)
+
+
+def _strip_rows(img: npt.NDArray, strip_bytes: int) -> int:
+    # number of rows of a strip of (about) strip_bytes bytes
+    row_bytes = max(1, img.dtype.itemsize * int(np.prod(img.shape[1:])))
+    return max(1, strip_bytes // row_bytes)
+
+
+def substract_stack(
+    frames: npt.NDArray,
+    darkframe: npt.NDArray,
+    out: typing.Optional[npt.NDArray] = None,
+    inplace: bool = False,
+    strip_bytes: int = 1 << 20,
+) -> npt.NDArray:
+    """
+    Substracts the darkframe from each frame of the stack frames, of
+    shape (N, H, W), (H, W) being the shape of the darkframe, negative
+    values being set to 0 (see substract). The darkframe is validated
+    only once.
+
+    The result is written into out if provided (of the same shape and
+    type as frames), into frames if inplace is True, in a new stack
+    otherwise. Frames are processed in strips of rows of about
+    strip_bytes bytes, so that each strip is still in cache for all
+    the steps of the substraction.
+    """
+
+    if frames.ndim != 3:
+        raise ValueError(
+            f"darkframe substraction: expected a stack of frames of shape (N, H, W), "
+            f"got an array of shape {frames.shape}"
+        )
+    if frames.shape[0] > 0:
+        _check(frames[0], darkframe)
+
+    if inplace:
+        out = frames
+    elif out is None:
+        out = np.empty_like(frames)
+    elif out.dtype != frames.dtype or out.shape != frames.shape:
+        raise ValueError(
+            f"darkframe substraction: output array of type {out.dtype} and shape "
+            f"{out.shape}, expected {frames.dtype} and {frames.shape}"
+        )
+
+    rows = _strip_rows(darkframe, strip_bytes)
+    for index in range(frames.shape[0]):
+        for start in range(0, darkframe.shape[0], rows):
+            strip = slice(start, start + rows)
+            _substract(frames[index, strip], darkframe[strip], out[index, strip])
+
+    return out
+
 
-    # returning
-    return sub64.astype(img.dtype)
+def substract_frames(
+    frames: typing.Iterable[npt.NDArray],
+    darkframe: npt.NDArray,
+    inplace: bool = False,
+) -> typing.Generator[npt.NDArray, None, None]:
+    """
+    Substracts the darkframe from each of the frames (see substract),
+    yielding the results. If inplace is True, the results are written
+    into the frames.
+    """
+    for img in frames:
+        _check(img, darkframe)
+        yield _substract(img, darkframe, img if inplace else None)
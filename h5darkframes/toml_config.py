@@ -3,6 +3,8 @@ import typing
 from collections import OrderedDict
 from pathlib import Path
 from .control_range import ControlRange
+from .stacking import Stacking
+from .adaptive import AdaptiveFrames
 
 
 def read_config(path: Path) -> typing.Tuple[typing.OrderedDict[str, ControlRange], int]:
@@ -63,3 +65,115 @@ def read_config(path: Path) -> typing.Tuple[typing.OrderedDict[str, ControlRange
         d,
         avg_over,
     )
+
+
+def read_stacking(path: Path) -> Stacking:
+    """
+    Returns the stacking configuration of the (optional) table
+    'darkframes.stacking' of the configuration file, e.g.
+
+    ```toml
+    [darkframes.stacking]
+    mode = "sigma_clip"
+    sigma = 3.0
+    iterations = 5
+    memory_budget = 256 # MB
+    variance = true
+    ```
+
+    (see stacking.Stacking). If the file has no such table,
+    the default configuration (mean) is returned.
+    """
+    if not path.is_file():
+        raise FileNotFoundError(str(path))
+    content = toml.load(str(path))
+    try:
+        config = content["darkframes"]["stacking"]
+    except KeyError:
+        return Stacking()
+    types: typing.Dict[str, typing.Callable[[typing.Any], typing.Any]] = {
+        "mode": str,
+        "sigma": float,
+        "iterations": int,
+        "rejected": int,
+        "memory_budget": int,
+        "variance": bool,
+    }
+    kwargs: typing.Dict[str, typing.Any] = {}
+    for key, value in config.items():
+        if key not in types:
+            raise ValueError(
+                f"error with darkframes configuration file {path}, "
+                f"key 'darkframes.stacking': unknown key '{key}' "
+                f"(supported: {', '.join(types.keys())})"
+            )
+        try:
+            kwargs[key] = types[key](value)
+        except ValueError as e:
+            raise ValueError(
+                f"error with darkframes configuration file {path}, "
+                f"key 'darkframes.stacking': failed to cast value of '{key}' ({e})"
+            )
+    if "memory_budget" in kwargs:
+        kwargs["memory_budget"] *= 1024 * 1024
+    try:
+        return Stacking(**kwargs)
+    except ValueError as e:
+        raise ValueError(f"error with darkframes configuration file {path}: {e}")
+
+
+def read_adaptive(path: Path) -> typing.Optional[AdaptiveFrames]:
+    """
+    Returns the adaptive number of frames configuration of the (optional)
+    table 'darkframes.adaptive' of the configuration file, e.g.
+
+    ```toml
+    [darkframes.adaptive]
+    target_error = 0.5
+    min_frames = 3
+    subsample = 8
+    read_noise = 2.0 # optional, for duration estimates
+    dark_noise = 0.3 # optional, for duration estimates
+    ```
+
+    (see adaptive.AdaptiveFrames), in which case 'average_over' is the
+    max number of frames. If the file has no such table, None is returned.
+    """
+    if not path.is_file():
+        raise FileNotFoundError(str(path))
+    content = toml.load(str(path))
+    try:
+        config = content["darkframes"]["adaptive"]
+    except KeyError:
+        return None
+    types: typing.Dict[str, typing.Callable[[typing.Any], typing.Any]] = {
+        "target_error": float,
+        "min_frames": int,
+        "subsample": int,
+        "read_noise": float,
+        "dark_noise": float,
+    }
+    kwargs: typing.Dict[str, typing.Any] = {}
+    for key, value in config.items():
+        if key not in types:
+            raise ValueError(
+                f"error with darkframes configuration file {path}, "
+                f"key 'darkframes.adaptive': unknown key '{key}' "
+                f"(supported: {', '.join(types.keys())})"
+            )
+        try:
+            kwargs[key] = types[key](value)
+        except ValueError as e:
+            raise ValueError(
+                f"error with darkframes configuration file {path}, "
+                f"key 'darkframes.adaptive': failed to cast value of '{key}' ({e})"
+            )
+    if "target_error" not in kwargs:
+        raise ValueError(
+            f"error with darkframes configuration file {path}, "
+            "key 'darkframes.adaptive': missing key 'target_error'"
+        )
+    try:
+        return AdaptiveFrames(**kwargs)
+    except ValueError as e:
+        raise ValueError(f"error with darkframes configuration file {path}: {e}")
@@ -0,0 +1,234 @@
+"""
+Module for substracting darkframes from light frames as soon as
+they are written into a directory.
+"""
+
+import time
+import typing
+import logging
+import threading
+import collections
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from .image_library import ImageLibrary
+from .substract import substract
+from .calibrate import (
+    FRAME_FORMATS,
+    frame_param,
+    read_frame,
+    write_frame,
+    get_darkframe,
+)
+
+_logger = logging.getLogger("watch")
+
+
+class LatencyStats:
+    """
+    Keeps the latencies (time between the detection of a frame and
+    the writing of the calibrated frame) of the most recent frames.
+    """
+
+    def __init__(self, size: int = 1000) -> None:
+        self._latencies: typing.Deque[float] = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.nb_frames = 0
+        self.nb_failures = 0
+
+    def add(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self.nb_frames += 1
+
+    def failure(self) -> None:
+        with self._lock:
+            self.nb_failures += 1
+
+    def percentiles(
+        self, percentiles: typing.Sequence[float] = (50, 90, 99)
+    ) -> typing.Optional[typing.Tuple[float, ...]]:
+        """
+        Returns the percentiles of the latencies (in seconds),
+        None if no latency has been recorded yet.
+        """
+        with self._lock:
+            if not self._latencies:
+                return None
+            latencies = np.array(self._latencies)
+        return tuple(float(v) for v in np.percentile(latencies, percentiles))
+
+
+class WatchFolder:
+    """
+    Watches a directory and substracts the suitable darkframe
+    (see calibrate.get_darkframe) from each new light frame (npy or tiff
+    file), writing the result into the output directory. The controllable
+    values of each frame are read from a sidecar file or from the file
+    name (see calibrate.frame_param).
+
+    The library should be open with a cache (see the 'cache_size' and
+    'interpolation_cache_size' arguments of ImageLibrary), so that
+    darkframes are not read or generated for each frame.
+
+    Arguments
+    ---------
+    library:
+      the darkframes library.
+    input_dir:
+      the directory to watch.
+    output_dir:
+      the directory into which calibrated frames are written.
+    pattern:
+      see calibrate.frame_param.
+    workers:
+      number of threads processing the frames.
+    max_pending:
+      maximum number of frames submitted to the workers but not
+      processed yet. Polling the directory is paused when reached.
+    poll_period:
+      time (in seconds) between two scans of the directory. A frame
+      is processed only once its size did not change between two scans.
+    report_period:
+      time (in seconds) between two logs of the latency percentiles
+      and queue depth.
+    """
+
+    def __init__(
+        self,
+        library: ImageLibrary,
+        input_dir: Path,
+        output_dir: Path,
+        pattern: typing.Optional[str] = None,
+        workers: int = 2,
+        max_pending: int = 16,
+        poll_period: float = 0.5,
+        report_period: float = 60.0,
+    ) -> None:
+        self._library = library
+        self._input_dir = input_dir
+        self._output_dir = output_dir
+        self._pattern = pattern
+        self._poll_period = poll_period
+        self._report_period = report_period
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._nb_pending = 0
+        self._lock = threading.Lock()
+        # file name: (size at last scan, time of first detection)
+        self._candidates: typing.Dict[str, typing.Tuple[int, float]] = {}
+        # frames being processed, or which processing failed
+        # (removed once processed or deleted)
+        self._submitted: typing.Set[str] = set()
+        self.stats = LatencyStats()
+
+    def queue_depth(self) -> int:
+        """
+        Number of frames submitted to the workers but not processed yet.
+        """
+        with self._lock:
+            return self._nb_pending
+
+    def _process(self, path: Path, detected: float) -> None:
+        try:
+            param = frame_param(path, self._library.controllables(), self._pattern)
+            image = read_frame(path)
+            darkframe = get_darkframe(self._library, param)
+            substract(image, darkframe, out=image)
+            write_frame(self._output_dir / path.name, image)
+        except Exception as e:
+            _logger.error(f"failed to calibrate {path}: {e}")
+            self.stats.failure()
+        else:
+            latency = time.time() - detected
+            _logger.debug(f"calibrated {path} ({latency:.3f} seconds)")
+            self.stats.add(latency)
+            # the calibrated frame now exists, so poll skips this file
+            with self._lock:
+                self._submitted.discard(path.name)
+        finally:
+            with self._lock:
+                self._nb_pending -= 1
+            self._pending.release()
+
+    def poll(self) -> int:
+        """
+        Scans the directory and submits the new frames (which size did not
+        change since the previous scan) to the workers. Returns the number
+        of submitted frames.
+        """
+        now = time.time()
+        submitted = 0
+        paths = sorted(self._input_dir.iterdir())
+        names = set(path.name for path in paths)
+        # forgetting the deleted files
+        self._candidates = {
+            name: candidate
+            for name, candidate in self._candidates.items()
+            if name in names
+        }
+        with self._lock:
+            self._submitted &= names
+            skipped = set(self._submitted)
+        for path in paths:
+            name = path.name
+            if name in skipped or path.suffix.lower() not in FRAME_FORMATS:
+                continue
+            if (self._output_dir / name).exists():
+                # already processed (possibly before a restart)
+                continue
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue
+            previous = self._candidates.get(name)
+            if previous is None or previous[0] != size or size == 0:
+                # new file, or still being written
+                detected = now if previous is None else previous[1]
+                self._candidates[name] = (size, detected)
+                continue
+            # blocks while max_pending frames are waiting
+            self._pending.acquire()
+            with self._lock:
+                self._nb_pending += 1
+                self._submitted.add(name)
+            del self._candidates[name]
+            self._executor.submit(self._process, path, previous[1])
+            submitted += 1
+        return submitted
+
+    def report(self) -> None:
+        """
+        Logs the latency percentiles and the queue depth.
+        """
+        percentiles = self.stats.percentiles()
+        latencies = (
+            "no frame processed yet"
+            if percentiles is None
+            else "latency p50: {:.3f}s p90: {:.3f}s p99: {:.3f}s".format(*percentiles)
+        )
+        _logger.info(
+            f"{self.stats.nb_frames} frame(s) calibrated, "
+            f"{self.stats.nb_failures} failure(s), {latencies}, "
+            f"queue depth: {self.queue_depth()}"
+        )
+
+    def run(self, stop: typing.Optional[threading.Event] = None) -> None:
+        """
+        Watches the directory until stop is set (or forever if stop
+        is None), then waits for the submitted frames to be processed.
+        """
+        if stop is None:
+            stop = threading.Event()
+        _logger.info(f"watching {self._input_dir}")
+        last_report = time.time()
+        try:
+            while not stop.is_set():
+                self.poll()
+                if time.time() - last_report > self._report_period:
+                    self.report()
+                    last_report = time.time()
+                stop.wait(self._poll_period)
+        finally:
+            self._executor.shutdown(wait=True)
+            self.report()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the averaging of the frames taken for a darkframe: peak
+memory and duration of the former implementation (uint64 conversion of
+each frame, float64 division) and of the current one (in place
+accumulation in the narrowest safe type, rounding integer division),
+for frames of the size of the asi zwo 294MC pro sensor.
+"""
+
+import time
+import typing
+import tracemalloc
+import numpy as np
+from numpy import typing as npt
+from h5darkframes.camera import ImageTaker
+from h5darkframes.create_library import _take_and_average_images
+
+_shape = (2822, 4144)
+_avg_over = 10
+_nb_runs = 3
+
+
+class _Camera(ImageTaker):
+    # returns the same (preallocated) frame, so that
+    # only the memory used for averaging is measured
+
+    def __init__(self, frame: npt.NDArray) -> None:
+        self._frame = frame
+
+    def picture(self) -> npt.ArrayLike:
+        return self._frame
+
+
+def _average_former(camera: ImageTaker, avg_over: int) -> npt.ArrayLike:
+    images_sum: typing.Optional[npt.NDArray] = None
+    images_type = None
+    for _ in range(avg_over):
+        original_image = typing.cast(npt.NDArray, camera.picture())
+        if images_type is None:
+            images_type = original_image.dtype
+        image_ = original_image.astype(np.uint64)
+        if images_sum is None:
+            images_sum = image_
+        else:
+            images_sum += image_
+    return (images_sum / avg_over).astype(images_type)  # type: ignore
+
+
+def _measure(f: typing.Callable[[], typing.Any]) -> typing.Tuple[float, float]:
+    # returns the peak memory (MB) and the average duration (ms)
+    start = time.perf_counter()
+    for _ in range(_nb_runs):
+        f()
+    duration = (time.perf_counter() - start) / _nb_runs
+    tracemalloc.start()
+    f()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6, duration * 1e3
+
+
+def run() -> None:
+
+    rng = np.random.default_rng(0)
+    camera = _Camera(rng.integers(0, 65535, _shape, dtype=np.uint16))
+
+    results = {
+        "former": _measure(lambda: _average_former(camera, _avg_over)),
+        "current": _measure(lambda: _take_and_average_images(camera, _avg_over)),
+    }
+
+    print(f"averaging {_avg_over} frames of shape {_shape} (uint16)")
+    print(f"{'':>10} {'peak memory (MB)':>17} {'duration (ms)':>14}")
+    for name, (memory, duration) in results.items():
+        print(f"{name:>10} {memory:>17.1f} {duration:>14.1f}")
+
+
+if __name__ == "__main__":
+
+    run()
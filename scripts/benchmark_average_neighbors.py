@@ -0,0 +1,88 @@
+"""
+Benchmark of the generation of darkframes by interpolation
+(neighbors.average_neighbors): peak memory and duration of the
+former implementation (float64 temporaries) and of the current one
+(in place float32 accumulation), for darkframes of the size of the
+asi zwo 294MC pro sensor.
+"""
+
+import time
+import typing
+import tracemalloc
+import numpy as np
+from numpy import typing as npt
+from h5darkframes.neighbors import average_neighbors, inverse_distance_weights
+from h5darkframes.h5types import Param, ParamImages
+
+_shape = (2822, 4144)
+
+
+def _average_neighbors_former(
+    target_values: Param,
+    min_values: Param,
+    max_values: Param,
+    images: ParamImages,
+) -> npt.NDArray:
+    weights = inverse_distance_weights(
+        target_values, min_values, max_values, images.keys()
+    )
+    r: npt.NDArray
+    for values, (image, _) in images.items():
+        d = weights[values]
+        try:
+            r += d * image  # type: ignore
+        except NameError:
+            r = d * image  # type: ignore
+    return r.astype(image.dtype)  # type: ignore
+
+
+def _measure(f: typing.Callable[[], typing.Any]) -> typing.Tuple[float, float]:
+    # returns the peak memory (MB) and the duration (ms)
+    tracemalloc.start()
+    start = time.perf_counter()
+    f()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6, duration * 1e3
+
+
+def run() -> None:
+
+    rng = np.random.default_rng(0)
+    min_values, max_values = (-15, 1000), (15, 30000000)
+    target = (-1, 2500000)
+
+    print(
+        f"{'neighbors':>9} {'former (MB)':>12} {'current (MB)':>13} "
+        f"{'former (ms)':>12} {'current (ms)':>13} {'out= (MB)':>10}"
+    )
+
+    for nb_neighbors in (1, 2, 4):
+
+        params = [(-3 + 3 * i, 1000000 * (i + 1)) for i in range(nb_neighbors)]
+        images: ParamImages = {
+            param: (rng.integers(0, 4000, _shape, dtype=np.uint16), {})
+            for param in params
+        }
+        out = np.empty(_shape, dtype=np.uint16)
+
+        former_mem, former_time = _measure(
+            lambda: _average_neighbors_former(target, min_values, max_values, images)
+        )
+        current_mem, current_time = _measure(
+            lambda: average_neighbors(target, min_values, max_values, images)
+        )
+        out_mem, _ = _measure(
+            lambda: average_neighbors(target, min_values, max_values, images, out=out)
+        )
+
+        print(
+            f"{nb_neighbors:>9} {former_mem:>12.1f} {current_mem:>13.1f} "
+            f"{former_time:>12.1f} {current_time:>13.1f} {out_mem:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+
+    run()
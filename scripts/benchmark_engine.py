@@ -0,0 +1,68 @@
+"""
+Benchmark of the tiled engine: duration of the generation of a darkframe
+by interpolation (two neighbors) followed by its substraction from a
+frame, for frames of the size of the asi zwo 294MC pro sensor, using the
+single threaded functions and the tiled engine with 1 to N threads.
+"""
+
+import os
+import time
+import typing
+import numpy as np
+from h5darkframes import substract, TiledEngine
+from h5darkframes.neighbors import average_neighbors
+from h5darkframes.h5types import ParamImages
+
+_shape = (2822, 4144)
+_nb_runs = 10
+
+
+def _measure(f: typing.Callable[[], typing.Any]) -> float:
+    # average duration (ms)
+    f()
+    start = time.perf_counter()
+    for _ in range(_nb_runs):
+        f()
+    return 1e3 * (time.perf_counter() - start) / _nb_runs
+
+
+def run() -> None:
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 65535, _shape, dtype=np.uint16)
+    images: ParamImages = {
+        (-3, 1000000): (rng.integers(0, 4000, _shape, dtype=np.uint16), {}),
+        (0, 2000000): (rng.integers(0, 4000, _shape, dtype=np.uint16), {}),
+    }
+    target, min_values, max_values = (-1, 1500000), (-15, 1000), (15, 30000000)
+    darkframe = np.empty(_shape, dtype=np.uint16)
+    out = np.empty(_shape, dtype=np.uint16)
+
+    def _single_threaded():
+        average_neighbors(target, min_values, max_values, images, out=darkframe)
+        substract(img, darkframe, out=out)
+
+    reference = _measure(_single_threaded)
+    print(f"{'single threaded':>16}: {reference:7.1f} ms")
+
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with TiledEngine(workers=workers) as engine:
+
+            def _tiled():
+                engine.average_neighbors(
+                    target, min_values, max_values, images, out=darkframe
+                )
+                engine.substract(img, darkframe, out=out)
+
+            duration = _measure(_tiled)
+        print(
+            f"{workers:>8} threads: {duration:7.1f} ms "
+            f"(speed up: {reference / duration:.2f})"
+        )
+        workers *= 2
+
+
+if __name__ == "__main__":
+
+    run()
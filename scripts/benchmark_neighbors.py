@@ -0,0 +1,77 @@
+"""
+Benchmark of the nearest darkframes queries, as a function of the
+size of the library: original implementation (python lists)
+and kd-tree.
+"""
+
+import time
+import typing
+import numpy as np
+from h5darkframes import neighbors
+from h5darkframes.spatial import KDTree
+from h5darkframes.h5types import Param, Params
+
+_nb_queries = 50
+
+
+def _library(size: int, rng: np.random.Generator) -> Params:
+    # temperature, exposure, gain, offset
+    points = np.column_stack(
+        (
+            rng.integers(-20, 30, size),
+            rng.integers(1000, 60_000_000, size),
+            rng.integers(0, 500, size),
+            rng.integers(0, 100, size),
+        )
+    )
+    return list(dict.fromkeys(tuple(int(v) for v in row) for row in points))
+
+
+def _time(f: typing.Callable[[Param], typing.Any], targets: Params) -> float:
+    start = time.perf_counter()
+    for target in targets:
+        f(target)
+    return 1e3 * (time.perf_counter() - start) / len(targets)
+
+
+def run() -> None:
+
+    rng = np.random.default_rng(0)
+
+    print(
+        f"{'size':>8} {'python (ms)':>12} {'kd-tree (ms)':>13} {'build (ms)':>11}"
+    )
+
+    for size in (100, 1_000, 10_000, 100_000):
+
+        params = _library(size, rng)
+        points = np.array(params)
+        min_values = tuple(points.min(axis=0))
+        max_values = tuple(points.max(axis=0))
+        npoints = neighbors.normalize_points(points, min_values, max_values)
+
+        start = time.perf_counter()
+        tree = KDTree.build(params, npoints)
+        build = 1e3 * (time.perf_counter() - start)
+
+        targets = _library(_nb_queries, rng)
+
+        python = _time(
+            lambda t: neighbors.closest_neighbors(
+                params, min_values, max_values, t, nb_closest=1
+            ),
+            targets[:5] if size >= 100_000 else targets,
+        )
+        kdtree = _time(
+            lambda t: tree.nearest(
+                neighbors._normalize(t, min_values, max_values), k=1
+            ),
+            targets,
+        )
+
+        print(f"{len(params):>8} {python:>12.3f} {kdtree:>13.3f} {build:>11.1f}")
+
+
+if __name__ == "__main__":
+
+    run()
@@ -0,0 +1,62 @@
+"""
+Benchmark of the darkframe substraction: peak memory and duration of
+the former implementation (int64 conversions) and of the current one
+(saturating substraction for unsigned integer types), for frames of
+the size of the asi zwo 294MC pro sensor.
+"""
+
+import time
+import typing
+import tracemalloc
+import numpy as np
+from numpy import typing as npt
+from h5darkframes import substract
+
+_shape = (2822, 4144)
+_nb_runs = 10
+
+
+def _substract_former(img: npt.NDArray, darkframe: npt.NDArray) -> npt.NDArray:
+    im64 = img.astype(np.int64)
+    dark64 = darkframe.astype(np.int64)
+    sub64 = im64 - dark64
+    sub64[sub64 < 0] = 0
+    return sub64.astype(img.dtype)
+
+
+def _measure(f: typing.Callable[[], typing.Any]) -> typing.Tuple[float, float]:
+    # returns the peak memory (MB) and the average duration (ms)
+    f()
+    start = time.perf_counter()
+    for _ in range(_nb_runs):
+        f()
+    duration = (time.perf_counter() - start) / _nb_runs
+    tracemalloc.start()
+    f()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6, duration * 1e3
+
+
+def run() -> None:
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 65535, _shape, dtype=np.uint16)
+    darkframe = rng.integers(0, 4000, _shape, dtype=np.uint16)
+    out = np.empty_like(img)
+
+    results = {
+        "former": _measure(lambda: _substract_former(img, darkframe)),
+        "current": _measure(lambda: substract(img, darkframe)),
+        "current (out=)": _measure(lambda: substract(img, darkframe, out=out)),
+        "current (in place)": _measure(lambda: substract(out, darkframe, out=out)),
+    }
+
+    print(f"{'':>20} {'peak memory (MB)':>17} {'duration (ms)':>14}")
+    for name, (memory, duration) in results.items():
+        print(f"{name:>20} {memory:>17.1f} {duration:>14.1f}")
+
+
+if __name__ == "__main__":
+
+    run()
@@ -0,0 +1,50 @@
+import typing
+import pytest
+import h5py
+import numpy as np
+import h5darkframes as dark
+from collections import OrderedDict
+from pathlib import Path
+
+Param = typing.Tuple[int, ...]
+
+
+def _sum(param: Param) -> int:
+    return sum(param) % 65535
+
+
+def _write_library(
+    path: Path,
+    params: typing.Optional[typing.Iterable[Param]] = None,
+    shape: typing.Tuple[int, ...] = (10, 10),
+    controls: typing.Optional[typing.OrderedDict[str, dark.ControlRange]] = None,
+    value: typing.Callable[[Param], int] = _sum,
+) -> None:
+    # writing a library in which all darkframes have the same shape,
+    # the value of all pixels being value(param) (by default the sum of
+    # the param values). If params is None, all the params of the
+    # control ranges are written.
+    if controls is None:
+        controls = OrderedDict()
+        controls["temperature"] = dark.ControlRange(-15, 15, 3)
+        controls["exposure"] = dark.ControlRange(1000, 30000, 5000)
+    if params is None:
+        params = [
+            tuple(c.values()) for c in dark.ControlRange.iterate_controls(controls)
+        ]
+    with h5py.File(path, "a") as h5file:
+        h5file.attrs["name"] = "testlib"
+        h5file.attrs["controls"] = repr(controls)
+        dark.h5.ensure_index(h5file, len(controls))
+        for param in params:
+            image = np.full(shape, value(param), dtype=np.uint16)
+            dark.h5.add(h5file, param, image, {"param": param}, False)
+
+
+@pytest.fixture
+def write_library() -> typing.Callable[..., None]:
+    """
+    Function writing a test library (arguments: path, and optionally
+    params, shape, controls and value).
+    """
+    return _write_library
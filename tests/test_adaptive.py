@@ -0,0 +1,85 @@
+import tempfile
+import pytest
+import numpy as np
+import h5darkframes as dark
+from collections import OrderedDict
+from pathlib import Path
+from h5darkframes.create_library import _take_images
+from h5darkframes.duration_estimate import estimate_total_duration
+from h5darkframes.toml_config import read_adaptive
+
+
+class _NoisyFrames(dark.ImageTaker):
+    # image taker returning frames of value 100 with
+    # gaussian noise (standard deviation: sigma)
+
+    def __init__(self, sigma: float) -> None:
+        self._rng = np.random.default_rng(0)
+        self._sigma = sigma
+        self.nb_pictures = 0
+
+    def picture(self):
+        self.nb_pictures += 1
+        return self._rng.normal(100.0, self._sigma, (64, 48)).astype(np.float32)
+
+
+def test_adaptive_frames():
+
+    with pytest.raises(ValueError):
+        dark.AdaptiveFrames(0.0)
+    with pytest.raises(ValueError):
+        dark.AdaptiveFrames(0.5, min_frames=1)
+
+    # standard error: 2 / sqrt(n) <= 0.5 for n >= 16
+    adaptive = dark.AdaptiveFrames(0.5, subsample=4)
+    camera = _NoisyFrames(2.0)
+    _, _, nb_images = _take_images(camera, 100, standard_error=adaptive.tracker())
+    assert nb_images == camera.nb_pictures
+    assert 10 <= nb_images <= 25
+
+    # max number of frames
+    camera = _NoisyFrames(2.0)
+    _, _, nb_images = _take_images(camera, 5, standard_error=adaptive.tracker())
+    assert nb_images == 5
+
+
+def test_estimate_total_duration():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 80, 20)
+    controls["height"] = dark.ControlRange(10, 11, 1, timeout=2.0)
+
+    with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+        _, nb_pics = estimate_total_duration(camera, controls, 30)
+        assert nb_pics == 4 * 30
+        # no noise model: max number of frames
+        adaptive = dark.AdaptiveFrames(0.5)
+        _, nb_pics = estimate_total_duration(camera, controls, 30, adaptive)
+        assert nb_pics == 4 * 30
+        adaptive = dark.AdaptiveFrames(0.5, read_noise=2.0)
+        _, nb_pics = estimate_total_duration(camera, controls, 30, adaptive)
+        assert nb_pics == 4 * 16
+
+
+def test_library_adaptive():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 80, 20)
+    controls["height"] = dark.ControlRange(10, 11, 1, timeout=2.0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = Path(tmp) / "config.toml"
+        config.write_text("[darkframes.adaptive]\ntarget_error = 0.5\nmin_frames = 4\n")
+        adaptive = read_adaptive(config)
+        assert adaptive is not None
+        assert adaptive.min_frames == 4
+        config.write_text("[darkframes]\naverage_over = 5\n")
+        assert read_adaptive(config) is None
+
+        path = Path(tmp) / "test.hdf5"
+        # constant frames: the standard error is null
+        with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+            dark.library("testlib", camera, controls, 10, path, adaptive=adaptive)
+        with dark.ImageLibrary(path) as il:
+            for param in il.params():
+                assert il.nb_frames(param) == 4
@@ -0,0 +1,59 @@
+import asyncio
+import tempfile
+import threading
+import pytest
+import numpy as np
+import h5darkframes as dark
+from pathlib import Path
+
+
+class _CountingLibrary(dark.ImageLibrary):
+    # counts the reads, which block until released
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.nb_reads = 0
+        self.release = threading.Event()
+
+    def get(self, controls, nparray=True):
+        self.nb_reads += 1
+        self.release.wait(5)
+        return super().get(controls, nparray)
+
+
+def test_async_library(write_library):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / "lib.hdf5"
+        write_library(path, ((0, 10), (10, 10), (0, 20)), (4, 5))
+
+        async def _run(library: _CountingLibrary) -> None:
+            with dark.AsyncImageLibrary(library, workers=2) as al:
+
+                # concurrent requests for the same darkframe: read once
+                tasks = [asyncio.create_task(al.get((10, 10))) for _ in range(3)]
+                await asyncio.sleep(0.05)
+                # cancelling one request does not cancel the others
+                tasks[0].cancel()
+                library.release.set()
+                with pytest.raises(asyncio.CancelledError):
+                    await tasks[0]
+                for task in tasks[1:]:
+                    image, _ = await task
+                    assert np.all(image == 20)
+                assert library.nb_reads == 1
+
+                neighbors = await al.get_interpolation_neighbors((5, 10))
+                darkframe = await al.generate_darkframe(
+                    (5, 10), neighbors, dtype=np.float32
+                )
+                assert np.allclose(darkframe, 15)
+
+                darkframe = await al.generate_darkframe((5, 10), neighbors)
+                light = np.full((4, 5), 100, dtype=np.uint16)
+                calibrated = await al.substract(light, np.asarray(darkframe))
+                assert np.all(calibrated == 85)
+
+        with _CountingLibrary(path) as library:
+            asyncio.run(_run(library))
@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import typing
+import pytest
+import multiprocessing
+import tempfile
+import subprocess
+import numpy as np
+import h5darkframes as dark
+from collections import OrderedDict
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+
+def test_darkframe_cache():
+
+    # budget for two 10x10 uint16 arrays
+    cache = dark.DarkframeCache(400)
+
+    a = cache.put("a", np.zeros((10, 10), dtype=np.uint16))
+    cache.put("b", np.ones((10, 10), dtype=np.uint16))
+
+    # cached arrays are read-only
+    with pytest.raises(ValueError):
+        a[0, 0] = 1
+
+    # "a" is now the most recently used
+    assert cache.get("a") is a
+    assert cache.get("c") is None
+
+    # adding "c" evicts "b"
+    cache.put("c", np.ones((10, 10), dtype=np.uint16))
+    assert "b" not in cache
+    assert "a" in cache
+    assert cache.nbytes() == 400
+
+    # too large to be cached
+    large = cache.put("d", np.ones((20, 20), dtype=np.uint16))
+    assert large.flags.writeable
+    assert "d" not in cache
+
+    stats = cache.stats()
+    assert stats.hits == 1
+    assert stats.misses == 1
+    assert stats.evictions == 1
+    assert stats.items == 2
+
+
+def test_library_cache():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 100, 20)
+    controls["height"] = dark.ControlRange(10, 13, 1, timeout=2.0)
+
+    avg_over = 3
+
+    with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            path = Path(tmp) / "test.hdf5"
+            dark.library("testlib", camera, controls, avg_over, path, progress=None)
+
+            with dark.ImageLibrary(path, edit=True, cache_size=int(1e6)) as il:
+                param = (80, 11)
+                image1, _ = il.get(param)
+                image2, _ = il.get(param)
+                assert image1 is image2
+                assert not image1.flags.writeable
+                stats = il.cache_stats()
+                assert stats.hits == 1
+                assert stats.misses == 1
+
+                # the cache is kept coherent when removing images
+                il.rm(param)
+                with pytest.raises(dark.ImageNotFoundError):
+                    il.get(param)
+
+
+def test_interpolation_cache():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 100, 20)
+    controls["height"] = dark.ControlRange(10, 13, 1, timeout=2.0)
+
+    avg_over = 3
+
+    with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            path = Path(tmp) / "test.hdf5"
+            dark.library("testlib", camera, controls, avg_over, path, progress=None)
+
+            with dark.ImageLibrary(
+                path, edit=True, interpolation_cache_size=int(1e6)
+            ) as il:
+                # (images of the dummy camera are of shape (width, height),
+                # so only a single neighbor can be used)
+                param = (70, 11)
+                neighbors = [(60, 11)]
+                darkframe1 = il.generate_darkframe(param, neighbors)
+                darkframe2 = il.generate_darkframe(param, neighbors)
+                assert darkframe1 is darkframe2
+                assert not darkframe1.flags.writeable
+                darkframe3 = il.generate_darkframe(param, neighbors, dtype=np.float32)
+                assert darkframe3.dtype == np.float32
+                stats = il.interpolation_cache_stats()
+                assert stats.hits == 1
+                assert stats.misses == 2
+
+                # removing a neighbor invalidates the generated darkframes
+                il.rm((60, 11))
+                assert il.interpolation_cache_stats().items == 0
+
+
+def test_import_without_fcntl():
+
+    # fcntl (used by SharedDarkframeCache) is not available on Windows
+    code = "import sys; sys.modules['fcntl'] = None; import h5darkframes"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def _shared_cache_sum(namespace: str) -> typing.Optional[int]:
+    with dark.SharedDarkframeCache(namespace, 1 << 20) as cache:
+        array = cache.get((1, 2))
+        return None if array is None else int(array.sum())
+
+
+def test_shared_darkframe_cache():
+
+    namespace = f"h5darkframes_test_{os.getpid()}"
+
+    with dark.SharedDarkframeCache(namespace, 1 << 20) as cache:
+        assert cache.get((1, 2)) is None
+        published = cache.put((1, 2), np.ones((10, 10), dtype=np.uint16))
+        assert not published.flags.writeable
+        assert cache.get((1, 2)) is published
+
+        # the other processes map the published array
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+            assert list(executor.map(_shared_cache_sum, [namespace] * 3)) == [100] * 3
+
+        # stale: not mapped by other processes anymore
+        cache.discard((1, 2))
+        assert _shared_cache_sum(namespace) is None
+        # the segment remains mapped while the array is in use
+        assert published.sum() == 100
+        del published
+
+    # all segments unlinked
+    assert not [f for f in os.listdir("/dev/shm") if f.startswith(namespace)]
+
+    # discarding segments not mapped by the discarding process
+    # (the two caches standing for two processes)
+    with dark.SharedDarkframeCache(namespace, 1 << 20) as cache:
+        with dark.SharedDarkframeCache(namespace, 1 << 20) as other:
+            cache.put((1, 2), np.full((10, 10), 7, dtype=np.uint16))
+            key = ((5, 10), ((0, 10), (10, 10)), None)
+            cache.put(key, np.ones((10, 10), dtype=np.float32))
+            other.discard((1, 2))
+            assert cache.get((1, 2)) is None
+            assert _shared_cache_sum(namespace) is None
+            other.discard_if(lambda key: len(key) == 3 and (0, 10) in key[1])
+            assert cache.get(key) is None
+            assert len(cache) == 0
+
+    assert not [f for f in os.listdir("/dev/shm") if f.startswith(namespace)]
+
+
+# cache inherited by the forked workers (see test_shared_cache_fork)
+_forked_cache: typing.Optional[dark.SharedDarkframeCache] = None
+
+
+def _hold_lock(_: int) -> typing.Tuple[float, float]:
+    cache = typing.cast(dark.SharedDarkframeCache, _forked_cache)
+    with cache._locked():
+        start = time.time()
+        time.sleep(0.3)
+        return start, time.time()
+
+
+def _use_forked_cache(index: int) -> int:
+    # the cache is not closed by the worker
+    cache = typing.cast(dark.SharedDarkframeCache, _forked_cache)
+    array = cache.get((1, 2))
+    cache.put((index,), np.full((10, 10), index, dtype=np.uint16))
+    return 0 if array is None else int(array.sum())
+
+
+def test_shared_cache_fork():
+
+    global _forked_cache
+    namespace = f"h5darkframes_test_fork_{os.getpid()}"
+    context = multiprocessing.get_context("fork")
+
+    _forked_cache = dark.SharedDarkframeCache(namespace, 1 << 20)
+    try:
+        _forked_cache.put((1, 2), np.ones((10, 10), dtype=np.uint16))
+
+        # each process has its own lock
+        with ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+            (start1, end1), (start2, end2) = executor.map(_hold_lock, [0, 1])
+        assert end1 <= start2 or end2 <= start1
+
+        # workers do not close their (inherited) cache
+        with ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+            assert list(executor.map(_use_forked_cache, [10, 11, 12])) == [100] * 3
+        assert len(_forked_cache) == 1
+    finally:
+        _forked_cache.close()
+        _forked_cache = None
+
+    # all segments unlinked
+    assert not [f for f in os.listdir("/dev/shm") if f.startswith(namespace)]
@@ -0,0 +1,141 @@
+import time
+import tempfile
+import threading
+import numpy as np
+import h5darkframes as dark
+from collections import OrderedDict
+from pathlib import Path
+from h5darkframes import calibrate, watch
+
+
+def _write_calibration_library(write_library, path: Path) -> None:
+    # darkframes of value 100 for temperature 0, of value 200 for temperature 10
+    controls = OrderedDict()
+    controls["TargetTemp"] = dark.ControlRange(0, 10, 10)
+    controls["Exposure"] = dark.ControlRange(1000, 3000, 2000)
+    write_library(
+        path, shape=(10, 20), controls=controls, value=lambda p: 100 + 10 * p[0]
+    )
+
+
+def test_frame_param():
+
+    controllables = ("TargetTemp", "Exposure")
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / "TargetTemp_-10_Exposure_2000_3.npy"
+        assert calibrate.frame_param(path, controllables) == (-10, 2000)
+
+        path = Path(tmp) / "light_t5_e300.npy"
+        pattern = r"t(?P<TargetTemp>-?\d+)_e(?P<Exposure>\d+)"
+        assert calibrate.frame_param(path, controllables, pattern) == (5, 300)
+
+        # the sidecar file has priority over the file name
+        (Path(tmp) / "light_t5_e300.toml").write_text(
+            "TargetTemp = 7\nExposure = 400\n"
+        )
+        assert calibrate.frame_param(path, controllables, pattern) == (7, 400)
+
+
+def test_calibrate(write_library):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        library_path = Path(tmp) / "darkframes.hdf5"
+        _write_calibration_library(write_library, library_path)
+
+        input_dir = Path(tmp) / "lights"
+        output_dir = Path(tmp) / "calibrated"
+        input_dir.mkdir()
+        output_dir.mkdir()
+
+        # temperature 5: interpolation between the darkframes
+        # for temperature 0 and 10
+        for index in range(6):
+            temperature = (0, 5, 10)[index % 3]
+            path = input_dir / f"TargetTemp_{temperature}_Exposure_1000_{index}.npy"
+            np.save(path, np.full((10, 20), 1000, dtype=np.uint16))
+        np.save(input_dir / "unknown.npy", np.zeros((10, 20), dtype=np.uint16))
+
+        frames = calibrate.list_frames(input_dir)
+        assert len(frames) == 7
+
+        with dark.ImageLibrary(library_path) as il:
+            report = calibrate.calibrate(il, frames, output_dir, workers=2)
+
+        assert report.nb_frames == 6
+        assert report.nb_failures == 1
+
+        expected = {0: 900, 5: 850, 10: 800}
+        for index in range(6):
+            temperature = (0, 5, 10)[index % 3]
+            path = output_dir / f"TargetTemp_{temperature}_Exposure_1000_{index}.npy"
+            image = np.load(path)
+            assert np.all(image == expected[temperature])
+
+
+def test_watch(write_library):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        library_path = Path(tmp) / "darkframes.hdf5"
+        _write_calibration_library(write_library, library_path)
+
+        input_dir = Path(tmp) / "lights"
+        output_dir = Path(tmp) / "calibrated"
+        input_dir.mkdir()
+        output_dir.mkdir()
+
+        with dark.ImageLibrary(
+            library_path, cache_size=1 << 20, interpolation_cache_size=1 << 20
+        ) as il:
+            watcher = watch.WatchFolder(
+                il, input_dir, output_dir, workers=2, poll_period=0.01
+            )
+
+            # frames are submitted only once their size is stable
+            path = input_dir / "TargetTemp_5_Exposure_1000_0.npy"
+            np.save(path, np.full((10, 20), 1000, dtype=np.uint16))
+            assert watcher.poll() == 0
+            assert watcher.poll() == 1
+            assert watcher.poll() == 0
+
+            # processed and deleted files are forgotten
+            failing = input_dir / "TargetTemp_5_Exposure_1000_failing.npy"
+            failing.write_bytes(b"not a frame")
+            assert watcher.poll() == 0
+            deleted = input_dir / "TargetTemp_5_Exposure_1000_deleted.npy"
+            deleted.write_bytes(b"being written")
+            assert watcher.poll() == 1
+            for _ in range(500):
+                if watcher.stats.nb_failures == 1 and watcher.queue_depth() == 0:
+                    break
+                time.sleep(0.01)
+            assert watcher._submitted == {failing.name}
+            assert set(watcher._candidates) == {deleted.name}
+            failing.unlink()
+            deleted.unlink()
+            assert watcher.poll() == 0
+            assert not watcher._submitted
+            assert not watcher._candidates
+
+            stop = threading.Event()
+            thread = threading.Thread(target=watcher.run, args=(stop,))
+            thread.start()
+            for index in range(1, 4):
+                path = input_dir / f"TargetTemp_5_Exposure_1000_{index}.npy"
+                np.save(path, np.full((10, 20), 1000, dtype=np.uint16))
+            for _ in range(500):
+                if len(list(output_dir.iterdir())) == 4:
+                    break
+                stop.wait(0.01)
+            stop.set()
+            thread.join()
+
+        assert watcher.stats.nb_frames == 4
+        assert watcher.queue_depth() == 0
+        assert watcher.stats.percentiles() is not None
+        for index in range(4):
+            image = np.load(output_dir / f"TargetTemp_5_Exposure_1000_{index}.npy")
+            assert np.all(image == 850)
@@ -1,11 +1,17 @@
 import pytest
 import typing
+import pickle
 import tempfile
+import multiprocessing
 import time
+import h5py
 import numpy as np
+from numpy import typing as npt
 import h5darkframes as dark
 from collections import OrderedDict
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from h5darkframes.cache import CacheStats
 
 
 def test_control_range_get_values():
@@ -160,6 +166,38 @@ def test_update_library():
                     (width, height) in params
 
 
+def test_create_library_pipelined():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 100, 20)
+    controls["height"] = dark.ControlRange(10, 13, 1, timeout=2.0)
+
+    avg_over = 3
+
+    with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            sequential = Path(tmp) / "sequential.hdf5"
+            dark.library("testlib", camera, controls, avg_over, sequential)
+
+            pipelined = Path(tmp) / "pipelined.hdf5"
+            times = dark.library(
+                "testlib", camera, controls, avg_over, pipelined, pipelined=True
+            )
+            assert times.total > 0
+            assert times.durations["write"] > 0
+
+            with dark.ImageLibrary(sequential) as il1:
+                with dark.ImageLibrary(pipelined) as il2:
+                    assert sorted(il1.params()) == sorted(il2.params())
+                    for param in il1.params():
+                        image1, config1 = il1.get(param)
+                        image2, config2 = il2.get(param)
+                        assert np.array_equal(image1, image2)
+                        assert config1 == config2
+
+
 def test_add_rm():
 
     controls = OrderedDict()
@@ -245,3 +283,336 @@ def test_neighbors():
                 neighbors = il.get_neighbors(params)
                 assert (80, 11) in neighbors
                 assert (60, 11) in neighbors
+
+
+def test_index():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 100, 20)
+    controls["height"] = dark.ControlRange(10, 13, 1, timeout=2.0)
+
+    avg_over = 3
+
+    with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            path = Path(tmp) / "test.hdf5"
+            dark.library("testlib", camera, controls, avg_over, path, progress=None)
+
+            # the index lists the same params as the groups of the file
+            with h5py.File(path, "r") as h5file:
+                index = dark.h5.read_index(h5file)
+                assert index is not None
+                indexed, refs = index
+                walked = [p for p, _ in dark.h5.walk(h5file, len(controls))]
+                assert sorted(indexed) == sorted(walked)
+                for param, ref in zip(indexed, refs):
+                    assert h5file[ref].parent.attrs["camera_config"]
+                # the index also stores the numbers of frames
+                nb_frames = dark.h5.read_index_nb_frames(h5file)
+                assert nb_frames == {param: avg_over for param in indexed}
+
+            # the index is kept up to date when removing / adding images
+            param = (100, 11)
+            with dark.ImageLibrary(path, edit=True) as il:
+                img, config = il.get(param)
+                il.rm(param)
+            with dark.ImageLibrary(path) as il:
+                assert param not in il.params()
+                assert il.nb_pics() == 11
+            with dark.ImageLibrary(path, edit=True) as il:
+                il.add(param, img, config, True)
+            with dark.ImageLibrary(path) as il:
+                assert param in il.params()
+                assert il.nb_pics() == 12
+
+            # files without index can still be read, and be indexed
+            with h5py.File(path, "a") as h5file:
+                del h5file[dark.h5.INDEX]
+            with dark.ImageLibrary(path) as il:
+                assert il.nb_pics() == 12
+            with dark.ImageLibrary(path, edit=True) as il:
+                assert il.rebuild_index() == 12
+            with h5py.File(path, "r") as h5file:
+                assert dark.h5.has_index(h5file)
+
+
+def test_generate_darkframes_many(write_library):
+
+    params = [
+        (temperature, exposure)
+        for temperature in range(-15, 16, 3)
+        for exposure in range(1000, 30000, 5000)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / "test.hdf5"
+        write_library(path, params)
+
+        # duplicated targets, and targets in the library
+        targets = np.array(
+            [(-14, 3000), (0, 8000), (-14, 3000), (-15, 1000), (20, 40000)]
+        )
+
+        with dark.ImageLibrary(path) as il:
+
+            all_neighbors = il.get_neighbors_many(targets)
+            assert len(all_neighbors) == len(targets)
+            for target, neighbors in zip(targets, all_neighbors):
+                assert neighbors == il.get_neighbors(tuple(target))
+
+            darkframes = list(il.generate_darkframes_many(targets))
+            assert len(darkframes) == 4
+            assert [p for p, _ in darkframes] == sorted(set(map(tuple, targets)))
+            for param, darkframe in darkframes:
+                neighbors = il.get_neighbors(param)
+                if neighbors == [param]:
+                    expected, _ = il.get(param)
+                else:
+                    expected = il.generate_darkframe(param, neighbors)
+                assert darkframe.dtype == expected.dtype
+                assert np.array_equal(darkframe, expected)
+
+            # modifying a yielded darkframe does not alter the next ones
+            targets = np.array([(-15, 1000), (-14, 1000)])
+            assert (-15, 1000) in il.get_neighbors((-14, 1000))
+            expected = il.generate_darkframe((-14, 1000), il.get_neighbors((-14, 1000)))
+            generated = il.generate_darkframes_many(targets)
+            _, darkframe = next(generated)
+            darkframe[...] = 0  # type: ignore
+            _, darkframe = next(generated)
+            assert np.array_equal(darkframe, expected)
+
+
+def _darkframe_value(library: dark.ImageLibrary, param) -> int:
+    image, _ = library.get(param)
+    return int(typing.cast(npt.NDArray, image)[0, 0])
+
+
+def _cached_items(library: dark.ImageLibrary, _) -> int:
+    return typing.cast(CacheStats, library.cache_stats()).items
+
+
+# library inherited by forked processes
+_inherited: typing.Optional[dark.ImageLibrary] = None
+
+
+def _inherited_value(param) -> int:
+    return _darkframe_value(typing.cast(dark.ImageLibrary, _inherited), param)
+
+
+def test_pickle_and_reader_pool(write_library):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / "lib.hdf5"
+        params = [(t, e) for t in (-10, 0, 10) for e in (1000, 2000)]
+        write_library(path, params, (4, 4))
+
+        with dark.ImageLibrary(path, cache_size=1 << 20) as il:
+            il.get(params[0])
+
+            # the unpickled library reopens the file
+            copy = pickle.loads(pickle.dumps(il))
+            assert copy.params() == il.params()
+            assert _darkframe_value(copy, (10, 2000)) == 2010
+            assert copy.cache_stats().items == 1
+            copy.close()
+
+            # the forked processes reopen the file
+            global _inherited
+            _inherited = il
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+                values = list(executor.map(_inherited_value, params))
+            _inherited = None
+            assert values == [sum(param) for param in params]
+
+            for method in ("fork", "spawn"):
+                context = multiprocessing.get_context(method)
+                with dark.ReaderPool(il, workers=2, mp_context=context) as pool:
+                    # the workers do not share the cache of the parent
+                    assert list(pool.map(_cached_items, [params[0]])) == [0]
+                    values = list(pool.map(_darkframe_value, params))
+                assert values == [sum(param) for param in params]
+
+        with dark.ImageLibrary(path, edit=True) as il:
+            with pytest.raises(TypeError):
+                pickle.dumps(il)
+
+
+def test_live_library():
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / "lib.hdf5"
+        controls = OrderedDict()
+        controls["temperature"] = dark.ControlRange(-15, 15, 3)
+        controls["exposure"] = dark.ControlRange(1000, 30000, 5000)
+
+        # the library is read while being written (in the same process,
+        # hdf5 requires the same file locking flags for the writer)
+        with h5py.File(path, "a", locking=False) as writer:
+            writer.attrs["name"] = "testlib"
+            writer.attrs["controls"] = repr(controls)
+            dark.h5.ensure_index(writer, len(controls))
+
+            def _add(param) -> None:
+                image = np.full((4, 4), sum(param), dtype=np.uint16)
+                dark.h5.add(writer, param, image, {}, False)
+                writer.flush()
+
+            # no darkframe yet
+            with dark.ImageLibrary(path, live=True) as il:
+                assert il.params() == []
+                assert il.get_k_closest((0, 1000), 2) == []
+                _add((-15, 1000))
+                assert il.refresh() == [(-15, 1000)]
+                assert il.get_closest((0, 1000)) == (-15, 1000)
+
+            _add((-15, 6000))
+
+            with dark.ImageLibrary(path, live=True) as il:
+                # all darkframes have the same temperature
+                assert il.get_closest((0, 1000)) == (-15, 1000)
+
+                _add((0, 1000))
+                _add((0, 6000))
+                assert il.refresh() == [(0, 1000), (0, 6000)]
+                assert il.refresh() == []
+                assert il.get_closest((1, 1000)) == (0, 1000)
+                image, _ = il.get((0, 6000))
+                assert np.all(image == 6000)
+                neighbors = il.get_interpolation_neighbors((-5, 1000))
+                assert sorted(neighbors) == [(-15, 1000), (0, 1000)]
+
+    with pytest.raises(ValueError):
+        dark.ImageLibrary(path, edit=True, live=True)
+
+    # darkframes updated in place (see the top_up mode
+    # of create_library.library) are not served from the cache
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "lib.hdf5"
+        with h5py.File(path, "a", locking=False) as writer:
+            writer.attrs["name"] = "testlib"
+            writer.attrs["controls"] = repr(controls)
+            dark.h5.ensure_index(writer, len(controls))
+            dark.h5.add(writer, (0, 1000), np.zeros((4, 4), np.uint16), {}, False)
+            writer["0"]["1000"].attrs["nb_frames"] = 1
+            writer.flush()
+            with dark.ImageLibrary(path, live=True, cache_size=1 << 20) as il:
+                image, _ = il.get((0, 1000))
+                assert np.all(image == 0)
+                # (as done by create_library._merge_darkframe)
+                group = writer["0"]["1000"]
+                group["image"][...] = 2
+                group.attrs["nb_frames"] = 2
+                dark.h5.index_add(writer, (0, 1000), group["image"], 2)
+                writer.flush()
+                il.refresh()
+                image, _ = il.get((0, 1000))
+                assert np.all(image == 2)
+                assert il.nb_frames((0, 1000)) == 2
+
+    # the file is closed if the library fails to initialize
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "lib.hdf5"
+        with h5py.File(path, "a") as h5:
+            h5.attrs["name"] = "testlib"
+        with pytest.raises(KeyError):
+            dark.ImageLibrary(path, live=True)
+        with h5py.File(path, "a") as h5:
+            h5.attrs["controls"] = repr(controls)
+
+
+def _write_live(path: Path, params, ready) -> None:
+    # adding darkframes the way create_library.library does
+    # (see test_live_library_concurrent)
+    controls = OrderedDict()
+    controls["temperature"] = dark.ControlRange(-15, 15, 3)
+    controls["exposure"] = dark.ControlRange(1000, 30000, 5000)
+    with h5py.File(path, "a") as h5file:
+        h5file.attrs["name"] = "testlib"
+        h5file.attrs["controls"] = repr(controls)
+        dark.h5.ensure_index(h5file, len(controls))
+        h5file.flush()
+        ready.set()
+        for param in params:
+            image = np.full((32, 32), sum(param), dtype=np.uint16)
+            dark.h5.add(h5file, param, image, {"param": param}, False)
+            h5file[dark.h5.group_path(param)].attrs["nb_frames"] = 1
+            h5file.flush()
+
+
+def test_live_library_concurrent():
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / "lib.hdf5"
+        params = [(t, e) for t in range(20) for e in range(1000, 21000, 1000)]
+
+        context = multiprocessing.get_context("spawn")
+        ready = context.Event()
+        writer = context.Process(target=_write_live, args=(path, params, ready))
+        writer.start()
+        try:
+            assert ready.wait(30)
+            with dark.ImageLibrary(path, live=True) as il:
+                while True:
+                    done = not writer.is_alive()
+                    il.refresh()
+                    # only darkframes fully written are listed
+                    for param in il.params():
+                        image, config = il.get(param)
+                        assert np.all(image == sum(param))
+                        assert config == {"param": param}
+                    if done:
+                        break
+                assert sorted(il.params()) == sorted(params)
+        finally:
+            writer.join()
+        assert writer.exitcode == 0
+
+
+class _Frames(dark.ImageTaker):
+    # image taker returning the frames of a list
+
+    def __init__(self, frames) -> None:
+        self._frames = iter(frames)
+
+    def picture(self):
+        return next(self._frames)
+
+
+def test_take_and_average_images():
+
+    from h5darkframes.create_library import (
+        _accumulator_type,
+        _take_and_average_images,
+    )
+
+    assert _accumulator_type(np.uint16, 10) == np.uint32
+    assert _accumulator_type(np.uint16, 1 << 16) == np.uint32
+    assert _accumulator_type(np.uint16, 1 << 17) == np.uint64
+    assert _accumulator_type(np.uint8, 100) == np.uint16
+    assert _accumulator_type(np.int16, 10) == np.int32
+    assert _accumulator_type(np.float32, 10) == np.float64
+    assert _accumulator_type(np.uint64, 10) == np.float64
+
+    # rounding to the nearest integer: (1 + 2) / 2 = 1.5 -> 2
+    frames = [np.full((3, 4), v, dtype=np.uint16) for v in (1, 2)]
+    average = _take_and_average_images(_Frames(frames), 2)
+    assert average.dtype == np.uint16
+    assert np.all(average == 2)
+
+    # no overflow
+    frames = [np.full((3, 4), 65535, dtype=np.uint16) for _ in range(5)]
+    average = _take_and_average_images(_Frames(frames), 5)
+    assert np.all(average == 65535)
+
+    frames = [np.full((3, 4), v, dtype=np.float32) for v in (1.0, 2.0)]
+    average = _take_and_average_images(_Frames(frames), 2)
+    assert average.dtype == np.float32
+    assert np.allclose(average, 1.5)
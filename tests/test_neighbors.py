@@ -0,0 +1,211 @@
+import pytest
+import random
+import numpy as np
+from h5darkframes import neighbors
+from h5darkframes.spatial import KDTree
+
+
+def test_kdtree():
+
+    # checking the kd-tree returns the same results as the
+    # original neighbors search, including after insertions
+    # and removals
+
+    random.seed(2)
+
+    params = [
+        (temperature, exposure, gain, offset)
+        for temperature in range(-15, 16, 3)
+        for exposure in range(1000, 30000, 5000)
+        for gain in (100, 200, 400)
+        for offset in (8, 16)
+    ]
+    random.shuffle(params)
+    removed = params[:50]
+
+    points = np.array(params)
+    min_values = tuple(points.min(axis=0))
+    max_values = tuple(points.max(axis=0))
+    npoints = neighbors.normalize_points(points, min_values, max_values)
+
+    tree = KDTree.build(params, npoints, leaf_size=4)
+    for param in removed:
+        assert tree.remove(param)
+    params = params[50:]
+    for param in removed[:20]:
+        tree.insert(param, neighbors._normalize(param, min_values, max_values))
+    params = params + removed[:20]
+    assert len(tree) == len(params)
+
+    points = np.array(params)
+    npoints = neighbors.normalize_points(points, min_values, max_values)
+
+    for _ in range(200):
+        target = (
+            random.randint(-20, 20),
+            random.randint(0, 35000),
+            random.choice((50, 100, 150, 200, 300, 400, 500)),
+            random.choice((4, 8, 12, 16, 20)),
+        )
+        ntarget = neighbors._normalize(target, min_values, max_values)
+        for k in (1, 3):
+            expected = neighbors.closest_neighbors(
+                params, min_values, max_values, target, nb_closest=k
+            )
+            obtained = [param for param, _ in tree.nearest(ntarget, k=k)]
+            assert obtained == expected
+        radius = 0.3
+        expected = [
+            params[row]
+            for row in np.flatnonzero(neighbors._distances(npoints, ntarget) <= radius)
+        ]
+        obtained = [param for param, _ in tree.within(ntarget, radius)]
+        assert sorted(obtained) == sorted(expected)
+
+
+def test_neighbors_many():
+
+    # checking the batch neighbors search returns the same results
+    # as the original implementation, including in case of ties
+    # (params on a grid)
+
+    random.seed(3)
+
+    params = [
+        (temperature, exposure)
+        for temperature in range(-15, 16, 3)
+        for exposure in range(1000, 30000, 5000)
+    ]
+    random.shuffle(params)
+    params = params[: int(len(params) * 0.8)]
+
+    points = np.array(params)
+    min_values = tuple(points.min(axis=0))
+    max_values = tuple(points.max(axis=0))
+    npoints = neighbors.normalize_points(points, min_values, max_values)
+
+    targets = params[:10] + [
+        (random.randint(-20, 20), random.randint(0, 35000)) for _ in range(200)
+    ]
+
+    # small chunk size, to have several chunks
+    obtained = neighbors.get_neighbors_many(
+        points, npoints, min_values, max_values, np.array(targets), chunk_size=1000
+    )
+    for target, target_neighbors in zip(targets, obtained):
+        expected = neighbors.get_neighbors(params, min_values, max_values, target)
+        assert target_neighbors == expected
+
+    # no params (e.g. a live library with no darkframe yet)
+    empty = np.zeros((0, 2), dtype=np.int64)
+    obtained = neighbors.get_neighbors_many(
+        empty, empty.astype(np.float64), (0, 0), (1, 1), np.array(targets[:3])
+    )
+    assert obtained == [[], [], []]
+
+
+def _interpolation_neighbors(params, target, fixed_index):
+    # brute force version of the (two dimensional) interpolation
+    # neighbors search: closest param above, then below the target
+    if target in params:
+        return [target]
+    free_index = 0 if fixed_index == 1 else 1
+    subset = [p for p in params if p[fixed_index] == target[fixed_index]]
+    if not subset:
+        raise ValueError(f"no param with the fixed value of {target}")
+    if len(subset) == 1:
+        return subset
+    above = [p for p in subset if p[free_index] >= target[free_index]]
+    below = [p for p in subset if p[free_index] < target[free_index]]
+    return [
+        min(side, key=lambda p: abs(p[free_index] - target[free_index]))
+        for side in (above, below)
+        if side
+    ]
+
+
+def test_axis_index():
+
+    # checking the axis index (and interpolation_neighbors, which
+    # relies on it) returns the same results as a brute force
+    # (two dimensional) interpolation neighbors search
+
+    random.seed(4)
+
+    params = [
+        (temperature, exposure)
+        for temperature in range(-15, 16, 3)
+        for exposure in range(1000, 30000, 5000)
+    ]
+    random.shuffle(params)
+    params = params[: int(len(params) * 0.7)]
+    points = np.array(params)
+
+    targets = params[:10] + [
+        (random.choice(range(-15, 16, 3)), random.randint(0, 35000)) for _ in range(100)
+    ]
+
+    for fixed_index, free_index in ((1, 0), (0, 1)):
+        axis_index = neighbors.AxisIndex(points, free_index)
+        for target in targets:
+            try:
+                expected = _interpolation_neighbors(params, target, fixed_index)
+            except ValueError:
+                with pytest.raises(ValueError):
+                    axis_index.neighbors(target)
+                with pytest.raises(ValueError):
+                    neighbors.interpolation_neighbors(params, target, fixed_index)
+            else:
+                assert axis_index.neighbors(target) == expected
+                assert (
+                    neighbors.interpolation_neighbors(params, target, fixed_index)
+                    == expected
+                )
+
+    # more than two controllables: all but the free one are fixed
+    params3 = [
+        (temperature, exposure, gain)
+        for temperature in range(-15, 16, 3)
+        for exposure in range(1000, 30000, 5000)
+        for gain in (100, 200)
+    ]
+    axis_index = neighbors.AxisIndex(np.array(params3), 1)
+    assert axis_index.neighbors((-15, 3000, 200)) == [
+        (-15, 6000, 200),
+        (-15, 1000, 200),
+    ]
+    assert axis_index.neighbors((-15, 6000, 200)) == [(-15, 6000, 200)]
+
+
+def test_average_neighbors():
+
+    min_values, max_values = (0, 0), (10, 10)
+    images = {
+        (0, 0): (np.full((4, 5), 100, dtype=np.uint16), {}),
+        (10, 10): (np.full((4, 5), 200, dtype=np.uint16), {}),
+    }
+
+    # target at equal distance of both neighbors
+    target = (5, 5)
+    r = neighbors.average_neighbors(target, min_values, max_values, images)
+    assert r.dtype == np.uint16
+    assert np.all(r == 150)
+
+    # target closer to the first neighbor
+    target = (2, 2)
+    r = neighbors.average_neighbors(
+        target, min_values, max_values, images, dtype=np.float64
+    )
+    assert r.dtype == np.float64
+    assert np.allclose(r, 120)
+
+    # writing into a provided array
+    out = np.zeros((4, 5), dtype=np.uint16)
+    r = neighbors.average_neighbors(target, min_values, max_values, images, out=out)
+    assert r is out
+    assert np.all(out == 120)
+
+    with pytest.raises(ValueError):
+        neighbors.average_neighbors(
+            target, min_values, max_values, images, out=np.zeros((2, 2))
+        )
@@ -0,0 +1,82 @@
+import tempfile
+import threading
+import pytest
+import numpy as np
+import h5darkframes as dark
+from pathlib import Path
+from h5darkframes import server
+
+
+def test_server(write_library):
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        path = Path(tmp) / "lib.hdf5"
+        write_library(path, ((0, 10), (10, 10), (0, 20)), (4, 5))
+        socket_path = Path(tmp) / "darkframes.sock"
+
+        with dark.ImageLibrary(path) as il:
+            with server.DarkframeServer(il, socket_path, 1 << 20) as srv:
+                thread = threading.Thread(target=srv.serve_forever)
+                thread.start()
+                try:
+                    with server.DarkframeClient(socket_path) as client:
+                        assert client.controllables() == il.controllables()
+                        assert sorted(client.params()) == sorted(il.params())
+
+                        image, config = client.get((10, 10))
+                        expected, _ = il.get((10, 10))
+                        assert np.array_equal(image, expected)
+                        assert not image.flags.writeable
+
+                        again, _ = client.get({"temperature": 10, "exposure": 10})
+                        assert np.array_equal(image, again)
+
+                        neighbors = client.get_interpolation_neighbors((5, 10))
+                        assert sorted(neighbors) == [(0, 10), (10, 10)]
+                        generated = client.generate_darkframe(
+                            (5, 10), neighbors, dtype=np.float32
+                        )
+                        assert np.allclose(
+                            generated,
+                            il.generate_darkframe((5, 10), neighbors, dtype=np.float32),
+                        )
+
+                        with pytest.raises(dark.ImageNotFoundError):
+                            client.get((100, 100))
+                        # so that the client can unmap the blocks
+                        del image, again, generated
+
+                    # the client does not keep all the blocks mapped
+                    with server.DarkframeClient(socket_path, 1) as client:
+                        image, _ = client.get((10, 10))
+                        for _ in range(3):
+                            for param in ((0, 10), (10, 10), (0, 20)):
+                                client.get(param)
+                        assert len(client._blocks) == 1
+                        # arrays in use remain valid
+                        assert np.array_equal(image, expected)
+                        del image
+                        client.get((0, 10))
+                        assert not client._unclosed
+                finally:
+                    srv.shutdown()
+                    thread.join()
+
+            # darkframes larger than the budget of the server are not stored
+            with server.DarkframeServer(il, socket_path, 30) as srv:
+                thread = threading.Thread(target=srv.serve_forever)
+                thread.start()
+                try:
+                    with server.DarkframeClient(socket_path) as client:
+                        client.get((0, 10))
+                        assert srv._blocks._nbytes == 0
+                        assert not srv._blocks._blocks
+                        image, _ = client.get((10, 10))
+                        expected, _ = il.get((10, 10))
+                        assert np.array_equal(image, expected)
+                        del image
+                finally:
+                    srv.shutdown()
+                    thread.join()
+        assert not socket_path.exists()
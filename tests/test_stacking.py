@@ -0,0 +1,185 @@
+import tempfile
+import pytest
+import h5py
+import numpy as np
+import h5darkframes as dark
+from collections import OrderedDict
+from pathlib import Path
+from h5darkframes.stacking import FrameStack, RunningVariance
+from h5darkframes.toml_config import read_stacking
+
+
+def _frames() -> np.ndarray:
+    # 7 frames of value 100 (+/- 1), with a "cosmic ray" per frame
+    rng = np.random.default_rng(0)
+    frames = rng.integers(99, 102, (7, 20, 6)).astype(np.uint16)
+    for index in range(7):
+        frames[index, 3 * index, index % 6] = 60000
+    return frames
+
+
+@pytest.mark.parametrize("mode", ["median", "sigma_clip", "minmax"])
+def test_frame_stack(mode: str):
+
+    frames = _frames()
+
+    # budget small enough for several strips of rows
+    stacking = dark.Stacking(mode=mode, sigma=2.0, memory_budget=2000)
+    with FrameStack(stacking, frames.shape[0]) as stack:
+        for frame in frames:
+            stack.add(frame)
+        assert stack._strip_rows() < frames.shape[1]
+        darkframe = stack.combine()
+
+    assert darkframe.dtype == np.uint16
+    assert darkframe.shape == frames.shape[1:]
+    # the outliers are rejected
+    assert np.all((darkframe >= 99) & (darkframe <= 101))
+
+    # mean does not reject outliers
+    assert np.any(np.rint(frames.mean(axis=0)) > 101)
+
+
+def test_running_variance():
+
+    frames = _frames()
+    running = RunningVariance()
+    for frame in frames:
+        running.add(frame)
+    assert running.count == frames.shape[0]
+    assert np.allclose(running.mean(), frames.mean(axis=0))
+    variance = running.variance()
+    assert variance.dtype == np.float32
+    assert np.allclose(variance, frames.astype(np.float64).var(axis=0, ddof=1))
+
+
+def test_stacking_config():
+
+    with pytest.raises(ValueError):
+        dark.Stacking(mode="unknown")
+    with pytest.raises(ValueError):
+        FrameStack(dark.Stacking(mode="minmax", rejected=2), 4)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "config.toml"
+        path.write_text("[darkframes]\naverage_over = 5\n")
+        assert read_stacking(path).mode == "mean"
+        path.write_text(
+            "[darkframes]\naverage_over = 5\n"
+            "[darkframes.stacking]\nmode = 'sigma_clip'\n"
+            "sigma = 2.5\nmemory_budget = 16\n"
+        )
+        stacking = read_stacking(path)
+        assert stacking.mode == "sigma_clip"
+        assert stacking.sigma == 2.5
+        assert stacking.memory_budget == 16 * 1024 * 1024
+        path.write_text("[darkframes.stacking]\nmod = 'median'\n")
+        with pytest.raises(ValueError):
+            read_stacking(path)
+
+
+def test_library_stacking():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 80, 20)
+    controls["height"] = dark.ControlRange(10, 11, 1, timeout=2.0)
+
+    with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+        with tempfile.TemporaryDirectory() as tmp:
+            for pipelined in (False, True):
+                path = Path(tmp) / f"test_{pipelined}.hdf5"
+                dark.library(
+                    "testlib",
+                    camera,
+                    controls,
+                    3,
+                    path,
+                    pipelined=pipelined,
+                    stacking=dark.Stacking(mode="median", directory=Path(tmp)),
+                )
+                with dark.ImageLibrary(path) as il:
+                    assert len(il.params()) == 4
+            # temporary stacks are deleted
+            assert not list(Path(tmp).glob("*.stack"))
+
+
+def test_library_variance():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 80, 20)
+    controls["height"] = dark.ControlRange(10, 11, 1, timeout=2.0)
+
+    with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in ("mean", "median"):
+                path = Path(tmp) / f"test_{mode}.hdf5"
+                dark.library(
+                    "testlib",
+                    camera,
+                    controls,
+                    3,
+                    path,
+                    stacking=dark.Stacking(mode=mode, variance=True),
+                )
+                with dark.ImageLibrary(path, edit=True) as il:
+                    param = il.params()[0]
+                    image, _, variance = il.get(param, with_variance=True)
+                    assert variance.shape == image.shape
+                    assert np.all(variance == 0)
+                    assert il.nb_frames(param) == 3
+                    # no group left behind by the variance dataset
+                    il.rm(param)
+                    assert param not in il.params()
+
+            # variance not requested
+            path = Path(tmp) / "test.hdf5"
+            dark.library("testlib", camera, controls, 3, path)
+            with dark.ImageLibrary(path) as il:
+                param = il.params()[0]
+                _, _, variance = il.get(param, with_variance=True)
+                assert variance is None
+                assert il.nb_frames(param) == 3
+
+
+def test_library_top_up():
+
+    controls = OrderedDict()
+    controls["width"] = dark.ControlRange(60, 80, 20)
+    controls["height"] = dark.ControlRange(10, 11, 1, timeout=2.0)
+    stacking = dark.Stacking(variance=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "test.hdf5"
+        with dark.DummyCamera(controls, value=3, dynamic=False) as camera:
+            dark.library("testlib", camera, controls, 2, path, stacking=stacking)
+        with dark.ImageLibrary(path) as il:
+            params = il.params()
+        with h5py.File(path, "a") as h5:
+            # as if created by an older version
+            del h5["60"]["10"].attrs["nb_frames"]
+
+        for pipelined in (False, True):
+            with dark.DummyCamera(controls, value=6, dynamic=False) as camera:
+                dark.library(
+                    "testlib",
+                    camera,
+                    controls,
+                    6,
+                    path,
+                    pipelined=pipelined,
+                    stacking=stacking,
+                    top_up=True,
+                )
+
+        with dark.ImageLibrary(path) as il:
+            assert sorted(il.params()) == sorted(params)
+            image, _, variance = il.get((80, 11), with_variance=True)
+            # (2 * 3 + 4 * 6) / 6
+            assert np.all(image == 5)
+            # frames: 3, 3, 6, 6, 6, 6
+            assert np.allclose(variance, np.var([3, 3, 6, 6, 6, 6], ddof=1))
+            assert il.nb_frames((80, 11)) == 6
+            # legacy darkframe not topped up
+            image, _ = il.get((60, 10))
+            assert np.all(image == 3)
+            assert il.nb_frames((60, 10)) is None
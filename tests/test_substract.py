@@ -0,0 +1,100 @@
+import pytest
+import numpy as np
+import h5darkframes as dark
+from h5darkframes.substract import DarkframeError
+
+
+def _former_substract(img, darkframe):
+    sub64 = img.astype(np.int64) - darkframe.astype(np.int64)
+    sub64[sub64 < 0] = 0
+    return sub64.astype(img.dtype)
+
+
+def test_substract():
+
+    rng = np.random.default_rng(0)
+
+    for dtype in (np.uint8, np.uint16, np.int16, np.float32):
+        high = 250 if dtype == np.uint8 else 30000
+        img = rng.integers(0, high, (20, 30)).astype(dtype)
+        darkframe = rng.integers(0, high, (20, 30)).astype(dtype)
+        expected = _former_substract(img, darkframe)
+
+        r = dark.substract(img, darkframe)
+        assert r.dtype == img.dtype
+        assert np.array_equal(r, expected)
+
+        # into a provided array
+        out = np.empty_like(img)
+        r = dark.substract(img, darkframe, out=out)
+        assert r is out
+        assert np.array_equal(out, expected)
+
+        # in place
+        img_copy = img.copy()
+        dark.substract(img_copy, darkframe, out=img_copy)
+        assert np.array_equal(img_copy, expected)
+
+    img = np.zeros((20, 30), dtype=np.uint16)
+    with pytest.raises(DarkframeError):
+        dark.substract(img, np.zeros((20, 30), dtype=np.uint8))
+    with pytest.raises(DarkframeError):
+        dark.substract(img, np.zeros((20, 31), dtype=np.uint16))
+    with pytest.raises(ValueError):
+        dark.substract(img, img, out=np.zeros((20, 30), dtype=np.uint8))
+
+
+def test_substract_stack():
+
+    rng = np.random.default_rng(1)
+
+    frames = rng.integers(0, 30000, (5, 20, 30)).astype(np.uint16)
+    darkframe = rng.integers(0, 30000, (20, 30)).astype(np.uint16)
+    expected = np.array([_former_substract(frame, darkframe) for frame in frames])
+
+    # small strips, to have several strips per frame
+    r = dark.substract_stack(frames, darkframe, strip_bytes=200)
+    assert np.array_equal(r, expected)
+
+    out = np.empty_like(frames)
+    r = dark.substract_stack(frames, darkframe, out=out)
+    assert r is out
+    assert np.array_equal(out, expected)
+
+    r = list(dark.substract_frames(iter(frames), darkframe))
+    assert np.array_equal(np.array(r), expected)
+
+    dark.substract_stack(frames, darkframe, inplace=True)
+    assert np.array_equal(frames, expected)
+
+    with pytest.raises(DarkframeError):
+        dark.substract_stack(frames, darkframe[:10])
+    with pytest.raises(ValueError):
+        dark.substract_stack(frames[0], darkframe)
+
+
+def test_tiled_engine():
+
+    rng = np.random.default_rng(2)
+
+    img = rng.integers(0, 30000, (101, 30)).astype(np.uint16)
+    darkframe = rng.integers(0, 30000, (101, 30)).astype(np.uint16)
+    images = {
+        (0, 0): (rng.integers(0, 30000, (101, 30)).astype(np.uint16), {}),
+        (10, 10): (rng.integers(0, 30000, (101, 30)).astype(np.uint16), {}),
+    }
+    target, min_values, max_values = (3, 4), (0, 0), (10, 10)
+
+    for workers in (1, 3):
+        with dark.TiledEngine(workers=workers) as engine:
+            assert np.array_equal(
+                engine.substract(img, darkframe), dark.substract(img, darkframe)
+            )
+            assert np.array_equal(
+                engine.average_neighbors(target, min_values, max_values, images),
+                dark.neighbors.average_neighbors(
+                    target, min_values, max_values, images
+                ),
+            )
+            with pytest.raises(DarkframeError):
+                engine.substract(img, darkframe[:10])